@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+全記事に created_at・used_in_summary・importance_score を揃える移行スクリプト（1回のみ実行）
+
+未使用記事の取得は (used_in_summary, importance_score, created_at) の複合インデックスで
+行うため、いずれかのフィールドが欠けている古い記事はクエリの対象にならない。
+created_at がない記事には date（それもなければ実行時刻）を設定する。
+"""
+
+from datetime import datetime, timezone
+
+from storage import create_article_store
+
+BACKFILL_FIELDS = ['created_at', 'date', 'used_in_summary', 'importance_score']
+
+def backfill_created_at():
+    """欠けているフィールドを補完"""
+    store = create_article_store()
+
+    try:
+        writer = store.writer()
+        updated = 0
+        skipped = 0
+
+        for article in store.iter_articles(fields=BACKFILL_FIELDS):
+            updates = {}
+            if not article.get('created_at'):
+                updates['created_at'] = article.get('date') or datetime.now(timezone.utc)
+            if 'used_in_summary' not in article:
+                updates['used_in_summary'] = False
+            if article.get('importance_score') is None:
+                updates['importance_score'] = 3
+
+            if not updates:
+                skipped += 1
+                continue
+
+            writer.update_article(article['id'], updates)
+            updated += 1
+
+        failed = writer.flush()
+        print(f"✅ {updated - len(failed)}件の記事を補完しました（補完不要: {skipped}件）")
+        if failed:
+            print(f"⚠️ {len(failed)}件の更新に失敗しました")
+
+    except Exception as e:
+        print(f"❌ エラー: {e}")
+
+if __name__ == "__main__":
+    backfill_created_at()
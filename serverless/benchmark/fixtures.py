@@ -0,0 +1,171 @@
+"""
+ベンチマーク用のフィードのフィクスチャ
+
+RSS_FEEDS の各フィードについて、記録したフィード（benchmark/fixtures/ に保存したもの）が
+あればそれを、なければ乱数の種を固定して生成したフィードを返す。フィードの形式は
+URLから推定する（.rdf は RSS 1.0、atom は Atom、それ以外は RSS 2.0）。
+規模を大きくするときは同じフィードを複製し、複製ごとにタイトルとURLを変えて
+別の記事として扱われるようにする。
+"""
+
+import os
+import re
+import ast
+import random
+import hashlib
+from html import escape
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_ENTRIES = 20
+
+# 記事の文面を組み立てる語句（近似重複判定で別の記事と見なされるよう、組み合わせを乱数で選ぶ）
+COMPANIES = ['OpenAI', 'Google', 'Anthropic', 'Meta', 'NVIDIA', 'Microsoft', 'Apple', 'Amazon', 'Samsung',
+             'Sony', 'Intel', 'AMD', 'IBM', 'Oracle', 'Salesforce', 'Baidu', 'Alibaba', 'Mistral', 'Cohere']
+AI_TERMS_EN = ['language model', 'AI agent', 'machine learning platform', 'generative AI tool', 'neural network',
+               'LLM API', 'diffusion model', 'AI chip', 'deep learning framework', 'multimodal model']
+OTHER_TERMS_EN = ['smartphone', 'laptop', 'streaming plan', 'electric car', 'smartwatch', 'game console',
+                  'office chair', 'headphones', 'tablet', 'router']
+VERBS_EN = ['launches', 'announces', 'releases', 'updates', 'acquires', 'tests', 'expands', 'delays', 'previews']
+WORDS_EN = ['developers', 'enterprise', 'customers', 'benchmark', 'pricing', 'latency', 'regulators', 'partners',
+            'research', 'open source', 'security', 'privacy', 'data center', 'revenue', 'roadmap', 'hardware',
+            'software', 'cloud', 'startup', 'investors', 'performance', 'accuracy', 'training', 'inference']
+AI_TERMS_JA = ['大規模言語モデル', '生成AI', 'AIエージェント', '機械学習基盤', '画像生成AI', 'AI半導体',
+               '音声認識AI', 'ディープラーニング', 'マルチモーダルAI', 'AIアシスタント']
+OTHER_TERMS_JA = ['スマートフォン', 'ノートPC', '動画配信サービス', '電気自動車', 'スマートウォッチ',
+                  'ゲーム機', 'ワイヤレスイヤホン', 'タブレット', 'ルーター']
+VERBS_JA = ['を発表', 'を公開', 'を提供開始', 'を刷新', 'の新版を投入', 'の試験運用を開始', 'を値下げ']
+WORDS_JA = ['開発者', '企業向け', '利用者', '性能', '価格', '応答速度', '規制当局', '提携先', '研究', 'オープンソース',
+            'セキュリティ', 'プライバシー', 'データセンター', '売上', 'ロードマップ', 'クラウド', '投資家', '精度']
+PRIMARY_SOURCES = [
+    'https://openai.com/index/announcement',
+    'https://github.com/example/model',
+    'https://arxiv.org/abs/2401.00001',
+    'https://blog.google/technology/ai/update',
+]
+
+
+def feed_format(feed_url):
+    """URLからフィードの形式を推定（rss / atom / rdf）"""
+    if feed_url.endswith('.rdf') or '/rdf' in feed_url:
+        return 'rdf'
+    if 'atom' in feed_url:
+        return 'atom'
+    return 'rss'
+
+
+def load_rss_feeds(main_path):
+    """main.py の RSS_FEEDS を読む（main を import すると外部サービスのクライアントが作られるため）"""
+    with open(main_path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'RSS_FEEDS' for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError(f"RSS_FEEDS が見つかりません: {main_path}")
+
+
+def fixture_path(feed_url):
+    return os.path.join(FIXTURE_DIR, hashlib.md5(feed_url.encode()).hexdigest() + '.xml')
+
+
+def record_fixtures(feeds, timeout=15):
+    """実際のフィードをダウンロードして benchmark/fixtures/ に保存し、保存できた件数を返す"""
+    import requests
+
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    saved = 0
+    for feed_config in feeds:
+        try:
+            response = requests.get(feed_config['url'], timeout=timeout,
+                                    headers={'User-Agent': 'ai-news-summarizer-benchmark/1.0'})
+            response.raise_for_status()
+            with open(fixture_path(feed_config['url']), 'wb') as f:
+                f.write(response.content)
+            saved += 1
+        except Exception as e:
+            print(f"⚠️ 記録できませんでした ({feed_config['name']}): {e}")
+    return saved
+
+
+def _entry_texts(rng, lang):
+    """記事1件分のタイトルと本文（6割はAI関連の記事）"""
+    ai = rng.random() < 0.6
+    code = f"{rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ')}{rng.randint(100, 9999)}"
+    company = rng.choice(COMPANIES)
+    if lang == 'ja':
+        term = rng.choice(AI_TERMS_JA if ai else OTHER_TERMS_JA)
+        title = f"{company}、{term}「{code}」{rng.choice(VERBS_JA)}"
+        sentences = ['、'.join(rng.sample(WORDS_JA, 4)) + f"の面で{term}の影響が注目される。" for _ in range(8)]
+        body = title + '。' + ''.join(sentences)
+    else:
+        term = rng.choice(AI_TERMS_EN if ai else OTHER_TERMS_EN)
+        title = f"{company} {rng.choice(VERBS_EN)} {term} {code}"
+        sentences = [f"The {term} affects " + ', '.join(rng.sample(WORDS_EN, 5)) + '.' for _ in range(8)]
+        body = title + '. ' + ' '.join(sentences)
+    source = rng.choice(PRIMARY_SOURCES)
+    content = f'<p>{escape(body)}</p><p>Source: <a href="{source}">{source}</a></p>'
+    return title, content
+
+
+def generate_fixture(feed_config, feed_index, replica=0, entries=FIXTURE_ENTRIES):
+    """種を固定した乱数でフィードを生成（同じ引数なら常に同じバイト列）"""
+    rng = random.Random(f"{feed_index}-{replica}")
+    lang = feed_config.get('lang', 'en')
+    kind = feed_format(feed_config['url'])
+    base = f"https://bench.example/{feed_index}/{replica}"
+
+    items = []
+    for number in range(entries):
+        title, content = _entry_texts(rng, lang)
+        link = f"{base}/article-{number}?utm_source=rss"
+        date = f"2025-01-{28 - number % 28:02d}T09:00:00Z"
+        if kind == 'atom':
+            items.append(f'<entry><title>{escape(title)}</title><link rel="alternate" href="{link}"/>'
+                         f'<id>{link}</id><updated>{date}</updated>'
+                         f'<content type="html">{escape(content)}</content></entry>')
+        elif kind == 'rdf':
+            items.append(f'<item rdf:about="{link}"><title>{escape(title)}</title><link>{link}</link>'
+                         f'<description>{escape(content)}</description><dc:date>{date}</dc:date></item>')
+        else:
+            items.append(f'<item><title>{escape(title)}</title><link>{link}</link><guid>{link}</guid>'
+                         f'<description>{escape(content)}</description><pubDate>{date}</pubDate></item>')
+
+    name = escape(feed_config['name'])
+    if kind == 'atom':
+        xml = (f'<feed xmlns="http://www.w3.org/2005/Atom"><title>{name}</title>'
+               f'<link href="{base}"/>{"".join(items)}</feed>')
+    elif kind == 'rdf':
+        xml = ('<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/" '
+               f'xmlns:dc="http://purl.org/dc/elements/1.1/"><channel rdf:about="{base}"><title>{name}</title>'
+               f'<link>{base}</link></channel>{"".join(items)}</rdf:RDF>')
+    else:
+        xml = (f'<rss version="2.0"><channel><title>{name}</title><link>{base}</link>'
+               f'{"".join(items)}</channel></rss>')
+    return ('<?xml version="1.0" encoding="UTF-8"?>' + xml).encode('utf-8')
+
+
+def _replica_url(url, replica):
+    return url + (b'&amp;' if b'?' in url else b'?') + b'bench_replica=%d' % replica
+
+
+def _replicate_recorded(body, replica):
+    """記録したフィードの複製（タイトルとリンクを書き換えて別の記事にする）
+
+    本文は同じなので、複製の記事は近似重複判定で同じストーリーにまとめられる。
+    """
+    if replica == 0:
+        return body
+    body = re.sub(rb'<title>(.*?)</title>', lambda m: b'<title>' + m.group(1) + b' #%d</title>' % replica,
+                  body, flags=re.S)
+    body = re.sub(rb'(<link[^>]*>)\s*(https?://[^<\s]+)\s*(</link>)',
+                  lambda m: m.group(1) + _replica_url(m.group(2), replica) + m.group(3), body)
+    return re.sub(rb'(<link[^>]*href=")([^"]+)(")',
+                  lambda m: m.group(1) + _replica_url(m.group(2), replica) + m.group(3), body)
+
+
+def load_fixture(feed_config, feed_index, replica=0):
+    """記録したフィードがあればそれを、なければ生成したフィードを返す"""
+    path = fixture_path(feed_config['url'])
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return _replicate_recorded(f.read(), replica)
+    return generate_fixture(feed_config, feed_index, replica)
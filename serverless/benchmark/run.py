@@ -0,0 +1,290 @@
+"""
+オフラインのエンドツーエンド・ベンチマーク
+
+外部サービスをすべてローカルの代替に置き換えて、収集→まとめ生成→カスタムスレッド→履歴の
+各ステージを実行し、ステージごとの実行時間・API呼び出し回数・トークン数・ピークメモリを計測する。
+
+- フィード: benchmark/fixtures/ の記録（なければ種を固定して生成したフィード）をローカルのHTTPサーバーで返す
+- OpenAI: chat.completions 互換の偽サーバー（固定の遅延、N回に1回の429）。Batch API は投入と同時に完了する
+- 保存先: SQLiteのインメモリDB（--storage firestore で Firestore エミュレータ）
+- Slack: 受け取った件数を数えるだけの受け口
+
+規模（RSS_FEEDS の何倍のフィードを読むか）ごとに別プロセスで実行するので、
+モジュールの初期化やキャッシュが規模の間で共有されない。フィクスチャ・遅延・429の
+発生位置はすべて固定なので、同じ引数で実行すればコミット間で結果を比較できる。
+
+使い方（serverless/ ディレクトリで実行）:
+    python benchmark/run.py --scales 1,10,100 --output bench.json
+    python benchmark/run.py --baseline bench.json
+    python benchmark/run.py --batch  # 要約を Batch API に回すモード（collect の後に batches で取り込む）
+    python benchmark/run.py --record  # 実際のフィードを benchmark/fixtures/ に記録
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERLESS_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fixtures import load_rss_feeds, record_fixtures  # noqa: E402
+from servers import FeedServer, FakeOpenAIServer, SlackSink  # noqa: E402
+
+STAGES = ['collect', 'summary', 'custom', 'history']
+# --batch では収集の直後に Batch API の結果を取り込むステージを挟む
+BATCH_STAGES = ['collect', 'batches', 'summary', 'custom', 'history']
+# 比較表に出す項目（ステージの結果のキー, 表示名）
+REPORT_COLUMNS = [
+    ('wall_seconds', '時間(秒)'),
+    ('openai_requests', 'OpenAI'),
+    ('openai_batch_requests', 'Batch'),
+    ('openai_429', '429'),
+    ('tokens', 'トークン'),
+    ('feed_requests', 'フィード'),
+    ('db_statements', 'DB文'),
+    ('slack_posts', 'Slack'),
+    ('peak_rss_mb', 'RSS(MB)'),
+]
+
+
+def read_stats(url):
+    # 計測対象のプロセスで requests を読み込まないよう、標準ライブラリで取得する
+    with urllib.request.urlopen(f"{url}/_stats", timeout=10) as response:
+        return json.load(response)
+
+
+def stats_diff(before, after):
+    return {key: value - before.get(key, 0) for key, value in after.items() if value != before.get(key, 0)}
+
+
+def peak_rss_mb():
+    # Linux の ru_maxrss はKB単位
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVERLESS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+class BenchRequest:
+    """Flask の request の代わり（rss_summarizer が参照する属性だけを持つ）"""
+
+    def __init__(self, args=None, json_body=None):
+        self.args = args or {}
+        self.headers = {}
+        self.method = 'POST' if json_body is not None else 'GET'
+        self.base_url = 'http://127.0.0.1/bench'
+        self._json = json_body
+        self.form = {}
+
+    def get_json(self, silent=False):
+        return self._json
+
+
+def worker_environment(args, urls):
+    """計測対象のプロセスの環境変数（main を import する前に設定する）"""
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_BASE_URL': urls['openai'],
+        'SLACK_WEBHOOK_URL': urls['slack'],
+        'LLM_CACHE_BACKEND': 'memory',
+        'FEED_CACHE_BACKEND': 'none',
+        'COLLECT_DEADLINE_SECONDS': '86400',
+        # 429はRetry-Afterに従って待つので、手元のレート制限と指数バックオフは実質無効にする
+        'OPENAI_RPM_LIMIT': '1000000',
+        'OPENAI_TPM_LIMIT': '1000000000',
+        'OPENAI_BACKOFF_BASE_SECONDS': '0.05',
+        'OPENAI_BACKOFF_MAX_SECONDS': '0.5',
+        'OPENAI_MAX_RETRIES': '10',
+        # フィードはすべて同じホストから返すので、ホストごとの同時接続数で詰まらないようにする
+        'FEED_FETCH_PER_HOST_LIMIT': env.get('FEED_FETCH_MAX_WORKERS', '16'),
+        'LLM_BATCH_MODE': '1' if getattr(args, 'batch', False) else '0',
+    })
+    if args.storage == 'firestore':
+        env['STORAGE_BACKEND'] = 'firestore'
+        env.setdefault('FIRESTORE_EMULATOR_HOST', '127.0.0.1:8080')
+        env.setdefault('GOOGLE_CLOUD_PROJECT', 'bench')
+    else:
+        env['STORAGE_BACKEND'] = 'sqlite'
+        env['STORAGE_SQLITE_PATH'] = ':memory:'
+    return env
+
+
+def run_worker(scale, urls):
+    """1つの規模を計測して結果を返す（--worker で起動された子プロセスで実行）"""
+    sys.path.insert(0, SERVERLESS_DIR)
+    started = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - started
+
+    # RSS_FEEDS を規模の数だけ複製し、ローカルのフィードサーバーに向ける
+    base_feeds = list(main.RSS_FEEDS)
+    main.RSS_FEEDS[:] = [
+        dict(feed_config, url=f"{urls['feeds']}/{replica}/{index}",
+             name=feed_config['name'] if replica == 0 else f"{feed_config['name']} #{replica}")
+        for replica in range(scale)
+        for index, feed_config in enumerate(base_feeds)
+    ]
+
+    db_statements = [0]
+    if hasattr(main.store, 'conn'):
+        main.store.conn.set_trace_callback(lambda statement: db_statements.__setitem__(0, db_statements[0] + 1))
+
+    def measure(stage, call):
+        before = {name: read_stats(url) for name, url in urls.items()}
+        statements = db_statements[0]
+        started = time.perf_counter()
+        body, status = call()[:2]
+        wall_seconds = time.perf_counter() - started
+        after = {name: read_stats(url) for name, url in urls.items()}
+        openai = stats_diff(before['openai'], after['openai'])
+        feeds = stats_diff(before['feeds'], after['feeds'])
+        slack = stats_diff(before['slack'], after['slack'])
+        return {
+            'stage': stage,
+            'http_status': status,
+            'wall_seconds': round(wall_seconds, 3),
+            'openai_requests': openai.get('requests', 0),
+            'openai_429': openai.get('rate_limited', 0),
+            'openai_batch_requests': openai.get('batch_requests', 0),
+            'openai_by_kind': {key.split('.', 1)[1]: value for key, value in openai.items()
+                               if key.startswith('requests.')},
+            'prompt_tokens': openai.get('prompt_tokens', 0),
+            'completion_tokens': openai.get('completion_tokens', 0),
+            'tokens': openai.get('prompt_tokens', 0) + openai.get('completion_tokens', 0),
+            'feed_requests': feeds.get('requests', 0),
+            'feed_bytes': feeds.get('bytes', 0),
+            'slack_posts': slack.get('posts', 0),
+            'db_statements': db_statements[0] - statements,
+            'peak_rss_mb': peak_rss_mb(),
+            'response': json.loads(body) if status == 200 and body else None,
+        }
+
+    def custom():
+        ids = [article['id'] for article in main.store.recent_articles(10, fields=['title'])]
+        return main.rss_summarizer(BenchRequest({'action': 'custom'}, {'ids': ids}))
+
+    calls = {
+        'collect': lambda: main.rss_summarizer(BenchRequest({'action': 'collect', 'notify': '1'})),
+        'summary': lambda: main.rss_summarizer(BenchRequest({'action': 'summary'})),
+        'custom': custom,
+        'history': lambda: main.rss_summarizer(BenchRequest({'action': 'history'})),
+        'batches': lambda: main.rss_summarizer(BenchRequest({'action': 'batches', 'notify': '1'})),
+    }
+    stages = [measure(stage, calls[stage]) for stage in (BATCH_STAGES if main.LLM_BATCH_MODE else STAGES)]
+
+    # 応答の本文は件数などの要点だけ残す
+    for result in stages:
+        response = result.pop('response') or {}
+        result['result'] = {key: value for key, value in response.items()
+                            if isinstance(value, (int, float, str)) and key not in ('timestamp', 'x_summary', 'thread_summary')}
+
+    return {
+        'scale': scale,
+        'feeds': len(main.RSS_FEEDS),
+        'import_seconds': round(import_seconds, 3),
+        'stages': stages,
+    }
+
+
+def run_scale(args, scale, urls):
+    """規模ごとに子プロセスを起動して計測する"""
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--scale', str(scale),
+               '--urls', json.dumps(urls), '--storage', args.storage]
+    completed = subprocess.run(command, cwd=SERVERLESS_DIR, env=worker_environment(args, urls),
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stderr[-3000:], file=sys.stderr)
+        raise RuntimeError(f"規模 {scale}x の計測に失敗しました (exit {completed.returncode})")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_report(runs, baseline=None):
+    """規模×ステージの表を表示（baseline があれば前回からの変化率も表示）"""
+    previous = {(run['scale'], stage['stage']): stage
+                for run in (baseline or {}).get('runs', []) for stage in run['stages']}
+    header = f"{'規模':>5} {'ステージ':<8}" + ''.join(f"{label:>12}" for _, label in REPORT_COLUMNS)
+    print(header)
+    print('-' * len(header))
+    for run in runs:
+        for stage in run['stages']:
+            cells = []
+            before = previous.get((run['scale'], stage['stage']))
+            for key, _ in REPORT_COLUMNS:
+                cell = f"{stage[key]}"
+                if before and before.get(key):
+                    cell += f"({(stage[key] - before[key]) / before[key] * 100:+.0f}%)"
+                cells.append(f"{cell:>12}")
+            print(f"{str(run['scale']) + 'x':>5} {stage['stage']:<8}" + ''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='オフラインのエンドツーエンド・ベンチマーク')
+    parser.add_argument('--scales', default='1,10,100', help='RSS_FEEDS の倍率（カンマ区切り）')
+    parser.add_argument('--storage', choices=['sqlite', 'firestore'], default='sqlite',
+                        help='保存先（firestore は FIRESTORE_EMULATOR_HOST のエミュレータを使う）')
+    parser.add_argument('--latency', type=float, default=0.05, help='偽OpenAIの応答までの秒数')
+    parser.add_argument('--rate-limit-every', type=int, default=50, help='偽OpenAIがN回に1回429を返す（0で無効）')
+    parser.add_argument('--output', help='結果をJSONで保存するファイル')
+    parser.add_argument('--baseline', help='比較する前回の結果（--output で保存したJSON）')
+    parser.add_argument('--record', action='store_true', help='実際のフィードを benchmark/fixtures/ に記録して終了')
+    parser.add_argument('--batch', action='store_true', help='要約・1次情報抽出を Batch API に回すモードで計測')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--scale', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--urls', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.scale, json.loads(args.urls)), ensure_ascii=False))
+        return
+
+    feeds = load_rss_feeds(os.path.join(SERVERLESS_DIR, 'main.py'))
+
+    if args.record:
+        saved = record_fixtures(feeds)
+        print(f"✅ {saved}/{len(feeds)}件のフィードを記録しました")
+        return
+
+    feed_server = FeedServer(feeds).start()
+    openai_server = FakeOpenAIServer(latency=args.latency, rate_limit_every=args.rate_limit_every).start()
+    slack_sink = SlackSink().start()
+    urls = {'feeds': feed_server.url, 'openai': openai_server.base_url, 'slack': slack_sink.url}
+
+    runs = []
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+        print(f"⏱️ {scale}x ({len(feeds) * scale}フィード) を計測中...", file=sys.stderr)
+        runs.append(run_scale(args, scale, urls))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(runs, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'commit': git_commit(),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'config': {'storage': args.storage, 'latency': args.latency,
+                           'rate_limit_every': args.rate_limit_every, 'base_feeds': len(feeds),
+                           'batch': args.batch},
+                'runs': runs,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+ベンチマーク用のローカルサーバー
+
+- FeedServer: フィクスチャのフィードを返す（/<複製番号>/<フィード番号>）
+- FakeOpenAIServer: chat.completions 互換のAPI（固定の遅延と、N回に1回の429を返せる）と
+  Batch API（files・batches。投入したジョブはその場で処理して完了にする）
+- SlackSink: Slack Incoming Webhook の受け口（受け取った件数を数えるだけ）
+
+どのサーバーも GET /_stats で呼び出し回数などのカウンタをJSONで返すので、
+計測対象のプロセスからステージごとの差分を取れる。
+"""
+
+import re
+import json
+import time
+import hashlib
+import threading
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from fixtures import load_fixture
+
+
+class CountingServer(ThreadingHTTPServer):
+    """カウンタ付きのHTTPサーバー（別スレッドで動かす）"""
+
+    daemon_threads = True
+
+    def __init__(self, handler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def handle_error(self, request, client_address):
+        # 計測対象が接続を打ち切った場合（フィードの読み込みを途中で止めたときなど）は無視する
+        pass
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def send_stats(self):
+        self.send_body(200, json.dumps(self.server.snapshot()).encode())
+
+
+class FeedHandler(Handler):
+    def do_GET(self):
+        if self.path == '/_stats':
+            return self.send_stats()
+        match = re.fullmatch(r'/(\d+)/(\d+)', self.path)
+        if not match or int(match.group(2)) >= len(self.server.feeds):
+            return self.send_body(404, b'not found', 'text/plain')
+        replica, index = int(match.group(1)), int(match.group(2))
+        body = load_fixture(self.server.feeds[index], index, replica)
+        self.server.count(requests=1, bytes=len(body))
+        self.send_body(200, body, 'application/rss+xml; charset=utf-8')
+
+
+class FeedServer(CountingServer):
+    """RSS_FEEDS のフィクスチャを返すサーバー"""
+
+    def __init__(self, feeds):
+        super().__init__(FeedHandler)
+        self.feeds = feeds
+
+    def feed_url(self, replica, index):
+        return f"{self.url}/{replica}/{index}"
+
+
+def estimate_usage_tokens(text):
+    """カウンタ用のトークン数（文字数からの概算。実行ごとに同じ値になればよい）"""
+    return len(text) // 4 + 1
+
+
+def request_kind(payload):
+    """リクエストの種類（プロンプトの内容から判別する）"""
+    response_format = payload.get('response_format') or {}
+    schema_name = (response_format.get('json_schema') or {}).get('name')
+    if schema_name:
+        return schema_name
+    system = payload['messages'][0]['content']
+    if '番号: YES' in system:
+        return 'classify_batch'
+    if '"YES" または "NO"' in system:
+        return 'classify'
+    if '1次情報のリンクを抽出' in system:
+        return 'sources'
+    if 'X（Twitter）投稿用のスレッド' in system:
+        return 'thread'
+    return 'summarize'
+
+
+def fake_completion(kind, payload):
+    """種類ごとにそれらしい回答を作る（同じ入力なら常に同じ回答）"""
+    user = payload['messages'][-1]['content']
+    seed = int(hashlib.md5(user.encode()).hexdigest(), 16)
+    is_ai = any(word in user for word in ('AI', 'model', 'learning', 'LLM', 'neural', 'モデル', '機械学習'))
+
+    if kind in ('article_analysis', 'article_summary'):
+        answer = {
+            'is_ai': is_ai,
+            'summary': 'この記事はAI分野の新しい発表について説明しています。' * 3 if is_ai else '',
+            'importance_score': seed % 5 + 1
+        }
+        if kind == 'article_analysis':
+            # 候補のリンクのうち最初のものを選ぶ
+            candidates = re.findall(r'https?://\S+', user.partition('候補のリンク:')[2])
+            answer['primary_sources'] = candidates[:1] if is_ai else []
+        return json.dumps(answer, ensure_ascii=False)
+    if kind == 'thread_digest':
+        numbers = [int(number) for number in re.findall(r'^\[(\d+)\]', user, re.M)]
+        return json.dumps({'items': [{'number': number, 'digest': f'記事{number}の要点を1文にまとめたもの。'}
+                                     for number in numbers[:4]]}, ensure_ascii=False)
+    if kind == 'classify_batch':
+        numbers = [int(number) for number in re.findall(r'^\[(\d+)\]', user, re.M)]
+        lines = re.split(r'^\[\d+\]', user, flags=re.M)[1:]
+        return '\n'.join(f"{number}: {'YES' if 'AI' in line or 'model' in line else 'NO'}"
+                         for number, line in zip(numbers, lines))
+    if kind == 'classify':
+        return 'YES' if is_ai else 'NO'
+    if kind == 'sources':
+        # 候補のリンクのうち最初のものを選ぶ
+        candidates = re.findall(r'https?://\S+', user)
+        return candidates[0] if is_ai and candidates else 'なし'
+    if kind == 'thread':
+        return '【メインポスト】\n今日のAIニュースをまとめました👇🧵\n\n【詳細スレッド】\n' + '1. 見出し ★★★★☆\n詳細説明。\n' * 5
+    return f"要約: AIに関する記事の要約です。\n重要度: {seed % 5 + 1}"
+
+
+def chat_completion(number, payload):
+    """chat.completion のレスポンス本文と、その種類を返す"""
+    kind = request_kind(payload)
+    content = fake_completion(kind, payload)
+    prompt_tokens = sum(estimate_usage_tokens(message.get('content') or '') for message in payload['messages'])
+    completion_tokens = estimate_usage_tokens(content)
+    return kind, {
+        'id': f'chatcmpl-bench{number}',
+        'object': 'chat.completion',
+        'created': 0,
+        'model': payload.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens}
+    }
+
+
+def parse_multipart(content_type, body):
+    """multipart/form-data の本文を {名前: (ファイル名, 内容)} に変換"""
+    message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    return {part.get_param('name', header='content-disposition'):
+            (part.get_filename(), part.get_payload(decode=True)) for part in message.get_payload()}
+
+
+class OpenAIHandler(Handler):
+    def do_GET(self):
+        if self.path.endswith('/_stats'):
+            return self.send_stats()
+        match = re.search(r'/files/([\w-]+)/content$', self.path)
+        if match and match.group(1) in self.server.files:
+            return self.send_body(200, self.server.files[match.group(1)]['content'], 'application/octet-stream')
+        match = re.search(r'/batches/([\w-]+)$', self.path)
+        if match and match.group(1) in self.server.batches:
+            return self.send_body(200, json.dumps(self.server.batches[match.group(1)]).encode())
+        self.send_body(404, b'{"error": {"message": "not found"}}')
+
+    def do_POST(self):
+        if self.path.endswith('/files'):
+            return self.create_file()
+        if self.path.endswith('/batches'):
+            return self.create_batch()
+        if not self.path.endswith('/chat/completions'):
+            return self.send_body(404, b'{"error": {"message": "not found"}}')
+        payload = json.loads(self.read_body())
+        server = self.server
+        time.sleep(server.latency)
+
+        number = server.next_request_number()
+        if server.rate_limit_every and number % server.rate_limit_every == 0:
+            server.count(rate_limited=1)
+            body = json.dumps({'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}}).encode()
+            return self.send_body(429, body, headers={'retry-after': str(server.retry_after)})
+
+        kind, completion = chat_completion(number, payload)
+        usage = completion['usage']
+        server.count(**{'requests': 1, 'prompt_tokens': usage['prompt_tokens'],
+                        'completion_tokens': usage['completion_tokens'], f'requests.{kind}': 1})
+        self.send_body(200, json.dumps(completion, ensure_ascii=False).encode())
+
+    def create_file(self):
+        fields = parse_multipart(self.headers['Content-Type'], self.read_body())
+        filename, content = fields['file']
+        file = self.server.add_file(filename, content, fields['purpose'][1].decode())
+        self.send_body(200, json.dumps({key: value for key, value in file.items() if key != 'content'}).encode())
+
+    def create_batch(self):
+        """ジョブをその場で処理し、完了したバッチを返す（Batch API は遅延・レート制限なし）"""
+        payload = json.loads(self.read_body())
+        server = self.server
+        lines = server.files[payload['input_file_id']]['content'].decode().splitlines()
+
+        output = []
+        for line in filter(None, lines):
+            request = json.loads(line)
+            kind, completion = chat_completion(server.next_request_number(), request['body'])
+            usage = completion['usage']
+            server.count(**{'batch_requests': 1, 'prompt_tokens': usage['prompt_tokens'],
+                            'completion_tokens': usage['completion_tokens'], f'requests.{kind}': 1})
+            output.append(json.dumps({
+                'id': f"batch_req_{completion['id']}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': completion['id'], 'body': completion},
+                'error': None
+            }, ensure_ascii=False))
+        output_file = server.add_file('output.jsonl', '\n'.join(output).encode(), 'batch_output')
+
+        batch = server.add_batch({
+            'object': 'batch',
+            'endpoint': payload['endpoint'],
+            'input_file_id': payload['input_file_id'],
+            'completion_window': payload['completion_window'],
+            'status': 'completed',
+            'output_file_id': output_file['id'],
+            'metadata': payload.get('metadata'),
+            'request_counts': {'total': len(output), 'completed': len(output), 'failed': 0}
+        })
+        server.count(batches=1)
+        self.send_body(200, json.dumps(batch).encode())
+
+
+class FakeOpenAIServer(CountingServer):
+    """chat.completions・Batch API 互換の偽サーバー
+
+    latency 秒待ってから回答する。rate_limit_every を指定すると、その回数に1回
+    429（Retry-After: retry_after 秒）を返す（乱数を使わないので実行ごとに同じ）。
+    アップロードされたファイルとバッチはメモリに保持する。
+    """
+
+    def __init__(self, latency=0.05, rate_limit_every=0, retry_after=0.05):
+        super().__init__(OpenAIHandler)
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self._number = 0
+        self.files = {}
+        self.batches = {}
+
+    def add_file(self, filename, content, purpose):
+        with self._lock:
+            file_id = f"file-bench{len(self.files) + 1}"
+            self.files[file_id] = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                                   'filename': filename, 'purpose': purpose, 'status': 'processed',
+                                   'content': content}
+            return self.files[file_id]
+
+    def add_batch(self, batch):
+        with self._lock:
+            batch_id = f"batch_bench{len(self.batches) + 1}"
+            self.batches[batch_id] = dict(batch, id=batch_id, created_at=int(time.time()))
+            return self.batches[batch_id]
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def next_request_number(self):
+        with self._lock:
+            self._number += 1
+            return self._number
+
+
+class SlackHandler(Handler):
+    def do_GET(self):
+        if self.path == '/_stats':
+            return self.send_stats()
+        self.send_body(404, b'')
+
+    def do_POST(self):
+        body = self.read_body()
+        self.server.count(posts=1, bytes=len(body))
+        self.send_body(200, b'ok', 'text/plain')
+
+
+class SlackSink(CountingServer):
+    """Slack Incoming Webhook の受け口"""
+
+    def __init__(self):
+        super().__init__(SlackHandler)
@@ -0,0 +1,141 @@
+"""
+コールドスタートのベンチマーク
+
+アクションごとに新しいPythonプロセスを起動し、main の読み込み時間・最初のリクエストの
+所要時間（クライアントの生成や依存の読み込みを含む）・2回目のリクエストの所要時間と、
+最初のリクエストまでに読み込まれた重い依存を表にする。外部サービスは run.py と同じ
+ローカルの代替を使う。
+
+使い方（serverless/ ディレクトリで実行）:
+    python benchmark/startup.py
+    python benchmark/startup.py --actions list,history --repeat 5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERLESS_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fixtures import load_rss_feeds  # noqa: E402
+from run import BenchRequest, worker_environment  # noqa: E402
+from servers import FeedServer, FakeOpenAIServer, SlackSink  # noqa: E402
+
+ACTIONS = ['list', 'history', 'feeds', 'metrics', 'custom', 'summary', 'collect']
+# 読み込みの有無を表示する重い依存
+HEAVY_MODULES = ['openai', 'google.cloud.firestore', 'slack_sdk', 'feedparser', 'requests', 'tiktoken']
+# 収集のフィード数（コールドスタートの計測なので少なくてよい）
+COLLECT_FEEDS = 3
+
+
+def action_request(action):
+    if action == 'custom':
+        return BenchRequest({'action': 'custom'}, {'ids': ['bench-missing']})
+    return BenchRequest({'action': action, 'notify': '0'})
+
+
+def run_worker(action, urls):
+    """1つのアクションのコールドスタートを計測（--worker で起動された子プロセスで実行）"""
+    sys.path.insert(0, SERVERLESS_DIR)
+    started = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - started
+    modules_after_import = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    main.RSS_FEEDS[:] = [dict(feed_config, url=f"{urls['feeds']}/0/{index}")
+                         for index, feed_config in enumerate(main.RSS_FEEDS[:COLLECT_FEEDS])]
+
+    timings = []
+    statuses = []
+    for _ in range(2):
+        started = time.perf_counter()
+        response = main.rss_summarizer(action_request(action))
+        timings.append(time.perf_counter() - started)
+        statuses.append(response[1])
+
+    return {
+        'action': action,
+        'import_ms': round(import_seconds * 1000, 1),
+        'first_request_ms': round(timings[0] * 1000, 1),
+        'second_request_ms': round(timings[1] * 1000, 1),
+        'http_status': statuses[0],
+        'modules_after_import': modules_after_import,
+        'modules_after_request': [name for name in HEAVY_MODULES if name in sys.modules],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def measure(args, action, urls):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--action', action,
+               '--urls', json.dumps(urls), '--storage', args.storage]
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=SERVERLESS_DIR, env=worker_environment(args, urls),
+                               capture_output=True, text=True)
+    process_seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        print(completed.stderr[-3000:], file=sys.stderr)
+        raise RuntimeError(f"{action} の計測に失敗しました (exit {completed.returncode})")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_ms'] = round(process_seconds * 1000, 1)
+    return result
+
+
+def median_result(results):
+    """繰り返した結果のうち、時間は中央値をとる"""
+    result = dict(results[0])
+    for key in ('import_ms', 'first_request_ms', 'second_request_ms', 'process_ms', 'peak_rss_mb'):
+        result[key] = round(statistics.median(run[key] for run in results), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コールドスタートのベンチマーク')
+    parser.add_argument('--actions', default=','.join(ACTIONS), help='計測するアクション（カンマ区切り）')
+    parser.add_argument('--repeat', type=int, default=3, help='アクションごとの試行回数（中央値を表示）')
+    parser.add_argument('--storage', choices=['sqlite', 'firestore'], default='sqlite',
+                        help='保存先（firestore は FIRESTORE_EMULATOR_HOST のエミュレータを使う）')
+    parser.add_argument('--output', help='結果をJSONで保存するファイル')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--action', help=argparse.SUPPRESS)
+    parser.add_argument('--urls', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.action, json.loads(args.urls)), ensure_ascii=False))
+        return
+
+    feeds = load_rss_feeds(os.path.join(SERVERLESS_DIR, 'main.py'))
+    feed_server = FeedServer(feeds).start()
+    openai_server = FakeOpenAIServer(latency=0).start()
+    slack_sink = SlackSink().start()
+    urls = {'feeds': feed_server.url, 'openai': openai_server.base_url, 'slack': slack_sink.url}
+
+    results = []
+    for action in args.actions.split(','):
+        results.append(median_result([measure(args, action, urls) for _ in range(args.repeat)]))
+
+    header = (f"{'アクション':<10}{'プロセス(ms)':>14}{'import(ms)':>12}{'初回(ms)':>12}{'2回目(ms)':>12}"
+              f"{'RSS(MB)':>10}  初回までに読み込んだ依存")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result['action']:<10}{result['process_ms']:>14}{result['import_ms']:>12}"
+              f"{result['first_request_ms']:>12}{result['second_request_ms']:>12}{result['peak_rss_mb']:>10}  "
+              f"{', '.join(result['modules_after_request']) or '-'}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'storage': args.storage, 'repeat': args.repeat, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"✅ 結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
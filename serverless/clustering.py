@@ -0,0 +1,207 @@
+"""
+URLの正規化とニュースの近似重複クラスタリング
+
+同じ発表が複数メディアに配信された場合に、タイトル・抜粋のSimHashで
+既存のストーリークラスタに紐づけ、要約を使い回すためのモジュール。
+"""
+
+import os
+import re
+import html
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+# クラスタリング設定（環境変数で上書き可能）
+SIMHASH_MAX_DISTANCE = int(os.environ.get('SIMHASH_MAX_DISTANCE', '10'))
+CLUSTER_WINDOW_HOURS = float(os.environ.get('CLUSTER_WINDOW_HOURS', '72'))
+CLUSTER_COLLECTION = 'story_clusters'
+CLUSTER_INDEX_DOC = '_index'
+
+# 記事の同一性に関係しないクエリパラメータ
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', 'igshid',
+    'ref', 'ref_src', 'ref_url', 'referrer', 'source', 'src', 'cmpid', 'cmp', 'ncid',
+    'ocid', 'mbid', 'rss', 'guccounter', 'guce_referrer', 'guce_referrer_sig', 'sr_share', 'smid', 'spm'
+}
+TRACKING_PREFIXES = ('utm_', 'at_', 'pk_', 'mtm_', '__twitter')
+
+# リダイレクトURL -> 元記事URL（フィードに元URLが含まれていたものを記録）
+_redirect_cache = {}
+_redirect_lock = threading.Lock()
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WORD_RE = re.compile(r'[a-z0-9]+(?:[\'.-][a-z0-9]+)*')
+_CJK_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uff66-\uff9f]+')
+
+# 英語のストップワード（SimHashの特徴から除外）
+STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'with', 'by', 'at', 'from',
+    'is', 'are', 'was', 'be', 'as', 'it', 'its', 'this', 'that', 'new', 'says', 'will', 'has', 'have'
+}
+
+
+def remember_redirect(redirect_url, original_url):
+    """フィードに含まれていた元記事URLをリダイレクト先として記録"""
+    if redirect_url and original_url and redirect_url != original_url:
+        with _redirect_lock:
+            _redirect_cache[redirect_url] = original_url
+
+
+def canonicalize_url(url):
+    """トラッキング用パラメータやフラグメントを除いた正規URLを返す"""
+    if not url:
+        return url
+
+    with _redirect_lock:
+        url = _redirect_cache.get(url, url)
+
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower() or 'https'
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+
+    path = parts.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/')
+
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+def _features(text):
+    """SimHash用の特徴量（英単語とCJK文字のバイグラム）と出現回数"""
+    text = html.unescape(_TAG_RE.sub(' ', text or '')).lower()
+    features = {}
+
+    for word in _WORD_RE.findall(text):
+        if word not in STOPWORDS and len(word) > 1:
+            features[word] = features.get(word, 0) + 1
+
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            features[run] = features.get(run, 0) + 1
+        for i in range(len(run) - 1):
+            bigram = run[i:i + 2]
+            features[bigram] = features.get(bigram, 0) + 1
+
+    return features
+
+
+def simhash(text, bits=64):
+    """テキストの64bit SimHashを返す"""
+    vector = [0] * bits
+    for feature, weight in _features(text).items():
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+        for bit in range(bits):
+            vector[bit] += weight if value >> bit & 1 else -weight
+
+    fingerprint = 0
+    for bit in range(bits):
+        if vector[bit] > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def story_fingerprint(title, content, snippet_chars=300):
+    """タイトルと抜粋からストーリーの指紋を計算（タイトルを重めに扱う）"""
+    snippet = _TAG_RE.sub(' ', content or '')[:snippet_chars]
+    return simhash(f"{title} {title} {snippet}")
+
+
+class StoryClusterIndex:
+    """直近のストーリークラスタの指紋一覧
+
+    指紋の一覧は story_clusters/_index の1ドキュメントにまとめて保持し、
+    実行ごとの読み取りを1回に抑える。要約などの本体は一致したときだけ読む。
+    シャードが並行して書き込むので、一覧は書き直さずに追加・削除する値だけを送る。
+    """
+
+    def __init__(self, store, window_hours=CLUSTER_WINDOW_HOURS, max_distance=SIMHASH_MAX_DISTANCE):
+        self.store = store
+        self.window = timedelta(hours=window_hours)
+        self.max_distance = max_distance
+        self.entries = []
+        self._clusters = {}
+        self._added = []
+        self._expired = []
+
+    def load(self):
+        """指紋一覧を読み込み、期間外のものを除く"""
+        index = self.store.get_document(CLUSTER_COLLECTION, CLUSTER_INDEX_DOC)
+        entries = index.get('entries', []) if index else []
+        cutoff = datetime.now(timezone.utc) - self.window
+        self.entries = [entry for entry in entries if entry.get('at') and entry['at'] >= cutoff]
+        self._expired = [entry for entry in entries if not (entry.get('at') and entry['at'] >= cutoff)]
+        return self
+
+    def find(self, fingerprint):
+        """最も近いクラスタIDを返す（しきい値内になければNone）"""
+        best_id = None
+        best_distance = self.max_distance + 1
+        for entry in self.entries:
+            distance = hamming_distance(fingerprint, int(entry['simhash'], 16))
+            if distance < best_distance:
+                best_id = entry['id']
+                best_distance = distance
+        return best_id
+
+    def get_cluster(self, cluster_id):
+        if cluster_id not in self._clusters:
+            self._clusters[cluster_id] = self.store.get_document(CLUSTER_COLLECTION, cluster_id)
+        return self._clusters[cluster_id]
+
+    def create_cluster(self, cluster_id, fingerprint, article, writer=None):
+        """新しいクラスタを作成し、指紋一覧に追加（writerを渡すと一括書き込みに載せる）"""
+        now = datetime.now(timezone.utc)
+        cluster = {
+            'simhash': f"{fingerprint:016x}",
+            'title': article['title'],
+            'summary': article['summary'],
+            'importance_score': article['importance_score'],
+            'primary_source': article['primary_source'],
+            'summary_status': article.get('summary_status', 'done'),
+            'article_ids': [cluster_id],
+            'created_at': now
+        }
+        if writer is not None:
+            writer.set_document(CLUSTER_COLLECTION, cluster_id, cluster)
+        else:
+            self.store.set_document(CLUSTER_COLLECTION, cluster_id, cluster)
+        self._clusters[cluster_id] = cluster
+        entry = {'id': cluster_id, 'simhash': f"{fingerprint:016x}", 'at': now}
+        self.entries.append(entry)
+        self._added.append(entry)
+
+    def add_member(self, cluster_id, article_id, writer=None):
+        if writer is not None:
+            writer.array_union(CLUSTER_COLLECTION, cluster_id, 'article_ids', [article_id])
+        else:
+            self.store.array_union(CLUSTER_COLLECTION, cluster_id, 'article_ids', [article_id])
+
+    def save(self):
+        """追加分と期間外の削除を指紋一覧に反映（他のシャードが追加した指紋は消さない）"""
+        if self._added:
+            self.store.array_union(CLUSTER_COLLECTION, CLUSTER_INDEX_DOC, 'entries', self._added)
+        if self._expired:
+            self.store.array_remove(CLUSTER_COLLECTION, CLUSTER_INDEX_DOC, 'entries', self._expired)
+
+        self._added = []
+        self._expired = []
@@ -1,26 +1,23 @@
 #!/usr/bin/env python3
 """
-Firestoreの記事データを確認するデバッグスクリプト
+記事データを確認するデバッグスクリプト（保存先は STORAGE_BACKEND で切り替え）
 """
 
-from google.cloud import firestore
+from storage import create_article_store
 
 def debug_articles():
     """記事データの状態を確認"""
-    db = firestore.Client()
+    store = create_article_store()
     
     try:
         # 全ての記事を取得
-        docs = db.collection('ai_articles').stream()
-        
         print("=== 全記事の状態確認 ===")
         count = 0
-        for doc in docs:
-            data = doc.to_dict()
+        for data in store.iter_articles():
             count += 1
             
             print(f"\n📄 記事 {count}:")
-            print(f"  ID: {doc.id}")
+            print(f"  ID: {data['id']}")
             print(f"  タイトル: {data.get('title', 'なし')[:50]}...")
             print(f"  ソース: {data.get('source', 'なし')}")
             print(f"  used_in_summary: {data.get('used_in_summary', 'フィールドなし')}")
@@ -31,12 +28,9 @@ def debug_articles():
         
         # 未使用記事のみ確認
         print("\n=== 未使用記事の確認 ===")
-        unused_docs = db.collection('ai_articles').where('used_in_summary', '==', False).stream()
-        
         unused_count = 0
-        for doc in unused_docs:
+        for data in store.unused_articles():
             unused_count += 1
-            data = doc.to_dict()
             print(f"  未使用記事 {unused_count}: {data.get('title', 'なし')[:30]}...")
         
         print(f"✅ 未使用記事: {unused_count} 件")
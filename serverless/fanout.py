@@ -0,0 +1,153 @@
+"""
+収集処理のシャード分割と並列実行
+
+RSS_FEEDS をN個のシャードに分け、ワーカー（?action=collect&shard=i/n）を並列に
+呼び出して結果をまとめる。ワーカーの呼び出しはHTTP（本番）とプロセス内キュー
+（ローカル・テスト用）の2通りを用意している。
+"""
+
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# シャード設定（環境変数で上書き可能）
+COLLECT_SHARDS = int(os.environ.get('COLLECT_SHARDS', '4'))
+FANOUT_DISPATCHER = os.environ.get('FANOUT_DISPATCHER', 'http')  # http / local
+FANOUT_WORKER_URL = os.environ.get('FANOUT_WORKER_URL')
+FANOUT_WORKER_TIMEOUT = float(os.environ.get('FANOUT_WORKER_TIMEOUT', '500'))
+
+# 合算しない項目（シャードごとにしか意味を持たない値）
+MERGE_SKIP_KEYS = {
+    'status', 'action', 'timestamp', 'shard', 'next_feed_index', 'estimated_seconds_per_candidate', 'elapsed_seconds',
+    'peak_rss_mb'
+}
+
+
+def parse_shard(value):
+    """「i/n」形式（iは0始まり）を (i, n) に変換する（不正な値は ValueError）"""
+    index, _, count = (value or '').partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"シャード指定が不正です: {value}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"シャード指定が不正です: {value}")
+    return index, count
+
+
+def parse_shard_count(value, feed_count):
+    """シャード数を整数に変換し、フィード数を上限に収める（整数でない・1未満の値は ValueError）"""
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"シャード数が不正です: {value}") from None
+    if count < 1:
+        raise ValueError(f"シャード数は1以上を指定してください: {value}")
+    return min(count, max(1, feed_count))
+
+
+def shard_feeds(feeds, index, count):
+    """index番目のシャードが担当するフィードの一覧
+
+    URL順に並べたフィードを順番に割り当てるので、シャードごとのフィード数の差は1以内になる。
+    """
+    ordered = sorted(feeds, key=lambda feed: feed['url'])
+    return ordered[index::count]
+
+
+def merge_results(results):
+    """ワーカーの収集結果を合算する（数値は合計、リストは連結、辞書は再帰的に合算）"""
+    merged = {}
+    for result in results:
+        _merge_into(merged, result)
+    return merged
+
+
+def _merge_into(target, source):
+    for key, value in source.items():
+        if key in MERGE_SKIP_KEYS:
+            continue
+        if isinstance(value, bool) or value is None or isinstance(value, str):
+            target.setdefault(key, value)
+        elif isinstance(value, (int, float)):
+            target[key] = target.get(key, 0) + value
+        elif isinstance(value, list):
+            target.setdefault(key, []).extend(value)
+        elif isinstance(value, dict):
+            _merge_into(target.setdefault(key, {}), value)
+
+
+class HttpDispatcher:
+    """ワーカーをHTTPで並列に呼び出す"""
+
+    def __init__(self, worker_url, timeout=FANOUT_WORKER_TIMEOUT):
+        self.worker_url = worker_url
+        self.timeout = timeout
+
+    def _call(self, index, count):
+        import requests
+
+        response = requests.get(
+            self.worker_url,
+            params={'action': 'collect', 'shard': f"{index}/{count}", 'notify': '0'},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def dispatch(self, count):
+        """全シャードを実行し、シャード番号順に (結果, エラー) のリストを返す"""
+        def run(index):
+            try:
+                return self._call(index, count), None
+            except Exception as e:
+                logger.error(f"シャード{index}/{count}の呼び出しエラー: {e}")
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix='fanout') as executor:
+            return list(executor.map(run, range(count)))
+
+
+class LocalQueueDispatcher:
+    """プロセス内のキューとスレッドでワーカーを実行する（ローカル実行・テスト用）
+
+    handler(index, count) がワーカー1回分の処理で、収集結果の辞書を返す。
+    collect_articles はLLMの使用量などをモジュール共通のクライアントで集計するので、
+    既定ではシャードを1つずつ順に実行する（workers で並列数を指定できる）。
+    """
+
+    def __init__(self, handler, workers=1):
+        self.handler = handler
+        self.workers = workers
+
+    def dispatch(self, count):
+        tasks = queue.Queue()
+        for index in range(count):
+            tasks.put(index)
+        results = [None] * count
+
+        def worker():
+            while True:
+                try:
+                    index = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[index] = (self.handler(index, count), None)
+                except Exception as e:
+                    logger.error(f"シャード{index}/{count}の実行エラー: {e}")
+                    results[index] = (None, e)
+                finally:
+                    tasks.task_done()
+
+        threads = [threading.Thread(target=worker, name=f'shard-{number}')
+                   for number in range(min(self.workers or count, count))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
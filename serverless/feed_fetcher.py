@@ -0,0 +1,373 @@
+"""
+RSSフィードの並行取得モジュール
+
+スレッドプールでフィードを並行にダウンロードし、取得が完了したフィードから
+順にパース結果を呼び出し元へ渡す。既定では先頭の数件だけを逐次パースして
+読み込みを打ち切り、逐次パースできないフィードは全体を読んで feedparser で解析する。
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import feedparser
+import requests
+
+from feed_stream import StreamingFeedParser, StreamParseError
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 取得設定（環境変数で上書き可能）
+FETCH_MAX_WORKERS = int(os.environ.get('FEED_FETCH_MAX_WORKERS', '16'))
+FETCH_PER_HOST_LIMIT = int(os.environ.get('FEED_FETCH_PER_HOST_LIMIT', '2'))
+FETCH_CONNECT_TIMEOUT = float(os.environ.get('FEED_FETCH_CONNECT_TIMEOUT', '5'))
+FETCH_READ_TIMEOUT = float(os.environ.get('FEED_FETCH_READ_TIMEOUT', '15'))
+FETCH_MAX_BYTES = int(os.environ.get('FEED_FETCH_MAX_BYTES', str(5 * 1024 * 1024)))
+FEED_STREAM_CHUNK_BYTES = 16 * 1024  # 逐次パースで1回に読むバイト数
+
+USER_AGENT = 'ai-news-summarizer/1.0 (+https://github.com/solunaai/ai-news-summarizer)'
+
+# 条件付きGETキャッシュの保存先（firestore / local / none）
+FEED_CACHE_BACKEND = os.environ.get('FEED_CACHE_BACKEND', 'firestore')
+FEED_CACHE_PATH = os.environ.get('FEED_CACHE_PATH', '/tmp/feed_cache.json')
+FEED_CACHE_COLLECTION = 'feed_cache'
+
+# スレッドごとにSessionを持たせる（requests.Sessionはスレッドセーフではないため）
+_thread_local = threading.local()
+
+
+class FeedFetchTimeout(Exception):
+    """フィード取得が期限内に終わらなかった"""
+
+
+class HostLimiter:
+    """ホストごとの同時接続数を制限する"""
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def get(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[host]
+
+
+class FeedCacheStore:
+    """フィードごとのETag・Last-Modified・本文ダイジェストの保存先（何も保存しない実装）"""
+
+    def load_all(self, urls):
+        """URL -> キャッシュ状態 の辞書を返す"""
+        return {}
+
+    def save(self, url, state):
+        pass
+
+
+class FirestoreFeedCacheStore(FeedCacheStore):
+    """Firestoreの feed_cache コレクションに保存する"""
+
+    def __init__(self, db, collection=FEED_CACHE_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def _doc_id(self, url):
+        return hashlib.md5(url.encode()).hexdigest()
+
+    def load_all(self, urls):
+        refs = [self.db.collection(self.collection).document(self._doc_id(url)) for url in urls]
+        states = {}
+        metrics.count('firestore_reads', len(refs), collection=self.collection)
+        for doc in self.db.get_all(refs):
+            if doc.exists:
+                data = doc.to_dict()
+                states[data.get('url')] = data
+        return states
+
+    def save(self, url, state):
+        self.db.collection(self.collection).document(self._doc_id(url)).set(dict(state, url=url))
+        metrics.count('firestore_writes', collection=self.collection)
+
+
+class LocalFeedCacheStore(FeedCacheStore):
+    """ローカルのJSONファイルに保存する（/tmp などインスタンス内で有効）"""
+
+    def __init__(self, path=FEED_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._states = None
+
+    def _load(self):
+        if self._states is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._states = json.load(f)
+            except (OSError, ValueError):
+                self._states = {}
+        return self._states
+
+    def load_all(self, urls):
+        with self._lock:
+            states = self._load()
+            return {url: states[url] for url in urls if url in states}
+
+    def save(self, url, state):
+        with self._lock:
+            states = self._load()
+            states[url] = dict(state, url=url)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(states, f, ensure_ascii=False)
+
+
+def create_feed_cache_store(db=None, backend=None):
+    """設定に応じたキャッシュストアを生成"""
+    backend = backend or FEED_CACHE_BACKEND
+    if backend == 'firestore' and db is not None:
+        return FirestoreFeedCacheStore(db)
+    if backend == 'local':
+        return LocalFeedCacheStore()
+    return FeedCacheStore()
+
+
+def _conditional_headers(cached_state):
+    headers = {}
+    if cached_state:
+        if cached_state.get('etag'):
+            headers['If-None-Match'] = cached_state['etag']
+        if cached_state.get('last_modified'):
+            headers['If-Modified-Since'] = cached_state['last_modified']
+    return headers
+
+
+def _get_session():
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers['User-Agent'] = USER_AGENT
+        _thread_local.session = session
+    return session
+
+
+def _open(url, connect_timeout, read_timeout, deadline, headers=None):
+    """フィードへのリクエストを送り、本文を読む前のレスポンスを返す"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise FeedFetchTimeout('期限切れのため取得を中止')
+
+    timeout = (min(connect_timeout, remaining), min(read_timeout, remaining))
+    return _get_session().get(url, headers=headers, timeout=timeout, stream=True)
+
+
+def _iter_body(response, deadline, chunk_size=64 * 1024):
+    """本文をチャンクごとに返す（読み取り中も全体の期限とサイズ上限を確認する）"""
+    size = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        size += len(chunk)
+        if size > FETCH_MAX_BYTES:
+            raise ValueError(f'レスポンスが大きすぎます ({size} bytes)')
+        if time.monotonic() > deadline:
+            raise FeedFetchTimeout('期限切れのため取得を中止')
+        yield chunk
+
+
+def _read_streaming(response, deadline, max_entries):
+    """先頭 max_entries 件のエントリを逐次パースし、揃った時点で読み込みをやめる
+
+    (パース結果, None, 読んだバイト数, 保持した最大バイト数) を返す。最初のエントリを
+    パースできるまでは、逐次パースに失敗したときに feedparser へ渡すため読んだ分を保持し、
+    パースできた時点で捨てる。それ以降に失敗した場合はパースできたエントリだけを返す。
+    最初のエントリより前に失敗したフィードは残りも読み、(None, 本文, ...) を返す。
+    保持した最大バイト数は、保持している本文と、パース中のエントリの分
+    （最後にエントリが完成してから渡したバイト数）の合計の最大値。
+    """
+    parser = StreamingFeedParser(max_entries)
+    chunks = []
+    buffered = 0
+    since_entry = 0
+    peak_bytes = 0
+    bytes_read = 0
+    body = _iter_body(response, deadline, FEED_STREAM_CHUNK_BYTES)
+    try:
+        for chunk in body:
+            bytes_read += len(chunk)
+            since_entry += len(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+                buffered += len(chunk)
+            peak_bytes = max(peak_bytes, buffered if chunks is not None else since_entry)
+
+            entries_before = len(parser.entries)
+            parser.feed(chunk)
+            if parser.done:
+                return parser.result(), None, bytes_read, peak_bytes
+            if len(parser.entries) > entries_before:
+                since_entry = 0
+                # フィードとしてパースできたので、feedparser 用に保持していた本文は捨てる
+                chunks, buffered = None, 0
+        parser.close()
+        return parser.result(), None, bytes_read, peak_bytes
+    except StreamParseError as e:
+        if chunks is None:
+            logger.info(f"逐次パースを途中で中止: {response.url} ({len(parser.entries)}件, {e})")
+            return parser.result(), None, bytes_read, peak_bytes
+        logger.info(f"逐次パースできないため全体を解析: {response.url} ({e})")
+        for chunk in body:
+            chunks.append(chunk)
+            bytes_read += len(chunk)
+        return None, b''.join(chunks), bytes_read, bytes_read
+
+
+def entries_digest(entries):
+    """逐次パースしたエントリのダイジェスト（読み込みを打ち切るため本文全体のダイジェストは取れない）"""
+    digest = hashlib.sha256()
+    for entry in entries:
+        for key in ('id', 'link', 'title', 'summary'):
+            digest.update(entry.get(key, '').encode('utf-8'))
+            digest.update(b'\0')
+    return 'entries:' + digest.hexdigest()
+
+
+def fetch_feed(feed_config, host_limiter, connect_timeout, read_timeout, deadline, cached_state=None,
+               max_entries=None):
+    """1件のフィードを取得・パースして結果を返す
+
+    前回から変化がない場合（304 またはダイジェスト一致）は
+    status='not_modified' / 'unchanged' を返す。max_entries を指定すると先頭の
+    max_entries 件だけを逐次パースする（指定しなければ全体を feedparser で解析）。結果の bytes_read は読んだバイト数、
+    peak_bytes はフィードの本文を同時に保持した最大バイト数（_read_streaming を参照）。
+    """
+    feed_url = feed_config['url']
+    started = time.monotonic()
+    result = {
+        'feed': feed_config,
+        'status': 'ok',
+        'feed_data': None,
+        'cache_state': None,
+        'error': None,
+        'elapsed': 0.0,
+        'parser': None,
+        'bytes_read': 0,
+        'peak_bytes': 0
+    }
+
+    try:
+        with host_limiter.get(feed_url):
+            response = _open(feed_url, connect_timeout, read_timeout, deadline,
+                             headers=_conditional_headers(cached_state))
+            try:
+                if response.status_code == 304:
+                    result['status'] = 'not_modified'
+                    result['elapsed'] = time.monotonic() - started
+                    return result
+
+                response.raise_for_status()
+                headers = response.headers
+                if max_entries:
+                    feed, body, result['bytes_read'], result['peak_bytes'] = _read_streaming(
+                        response, deadline, max_entries)
+                else:
+                    feed, body = None, b''.join(_iter_body(response, deadline))
+                    result['bytes_read'] = result['peak_bytes'] = len(body)
+            finally:
+                response.close()
+
+        if feed is not None:
+            result['parser'] = 'stream'
+            digest = entries_digest(feed.entries)
+        else:
+            result['parser'] = 'feedparser'
+            digest = hashlib.sha256(body).hexdigest()
+        result['cache_state'] = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'digest': digest,
+            'checked_at': datetime.now(timezone.utc).isoformat()
+        }
+
+        if cached_state and cached_state.get('digest') == digest:
+            result['status'] = 'unchanged'
+            result['elapsed'] = time.monotonic() - started
+            return result
+
+        if feed is None:
+            feed = feedparser.parse(body, response_headers={
+                'content-location': feed_url,
+                'content-type': headers.get('Content-Type', '')
+            })
+
+        if feed.bozo:
+            result['status'] = 'bozo'
+            result['error'] = str(feed.get('bozo_exception', ''))
+        else:
+            result['feed_data'] = feed
+    except (FeedFetchTimeout, requests.Timeout) as e:
+        result['status'] = 'timeout'
+        result['error'] = str(e)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+
+    result['elapsed'] = time.monotonic() - started
+    return result
+
+
+def fetch_feeds(feeds, deadline, max_workers=None, per_host_limit=None,
+                connect_timeout=None, read_timeout=None, cache_states=None, max_entries=None):
+    """フィードを並行取得し、完了したものから順にyieldする
+
+    deadline は time.monotonic() 基準の締め切り時刻。期限までに完了しなかった
+    フィードは status='timeout' として返す。cache_states（URL -> 前回のキャッシュ状態）
+    を渡すと条件付きGETを行う。max_entries を渡すと各フィードの先頭の
+    max_entries 件だけを逐次パースする。
+    """
+    cache_states = cache_states or {}
+    max_workers = max_workers or FETCH_MAX_WORKERS
+    host_limiter = HostLimiter(per_host_limit or FETCH_PER_HOST_LIMIT)
+    connect_timeout = connect_timeout or FETCH_CONNECT_TIMEOUT
+    read_timeout = read_timeout or FETCH_READ_TIMEOUT
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='feed-fetch')
+    futures = {
+        executor.submit(fetch_feed, feed_config, host_limiter, connect_timeout, read_timeout, deadline,
+                        cache_states.get(feed_config['url']), max_entries): feed_config
+        for feed_config in feeds
+    }
+    pending = set(futures)
+
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+        # 期限切れで残ったフィード
+        for future in pending:
+            future.cancel()
+            yield {
+                'feed': futures[future],
+                'status': 'timeout',
+                'feed_data': None,
+                'cache_state': None,
+                'error': '収集全体の期限を超過',
+                'elapsed': 0.0,
+                'parser': None,
+                'bytes_read': 0,
+                'peak_bytes': 0
+            }
+    finally:
+        # 実行中の取得は各自のタイムアウトで終了するため待たない
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,157 @@
+"""
+フィードごとの稼働状況の記録と取得スケジュール
+
+フィードごとに最後に成功した日時・連続失敗回数・平均応答時間・新着記事の間隔を
+記録する。失敗が続くフィードは取得の間隔を倍々に空け（サーキットブレーカー）、
+正常なフィードは新着記事が出る間隔に合わせて次に取得する時刻を決める。
+状態は全フィード分を1つのドキュメントにまとめて保存する。
+"""
+
+import os
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# サーキットブレーカーと取得間隔の設定（環境変数で上書き可能）
+FEED_BREAKER_THRESHOLD = int(os.environ.get('FEED_BREAKER_THRESHOLD', '3'))
+FEED_BREAKER_BASE_SECONDS = float(os.environ.get('FEED_BREAKER_BASE_SECONDS', '1800'))
+FEED_BREAKER_MAX_SECONDS = float(os.environ.get('FEED_BREAKER_MAX_SECONDS', '86400'))
+FEED_POLL_MIN_SECONDS = float(os.environ.get('FEED_POLL_MIN_SECONDS', '0'))
+FEED_POLL_MAX_SECONDS = float(os.environ.get('FEED_POLL_MAX_SECONDS', '21600'))
+
+FEED_HEALTH_COLLECTION = 'feed_health'
+FEED_HEALTH_DOC = 'feeds'
+FAILURE_STATUSES = ('error', 'bozo', 'timeout')
+POLL_FRACTION = 0.25  # 新着記事の間隔の何分の1ごとに取得するか
+EMA_ALPHA = 0.3  # 平均応答時間・新着間隔の指数移動平均の重み
+DUE_SLACK_SECONDS = 120  # 定期実行の起動時刻のずれを吸収する余裕
+
+
+def feed_key(feed_url):
+    return hashlib.md5(feed_url.encode()).hexdigest()
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _ema(previous, value):
+    return value if previous is None else previous + EMA_ALPHA * (value - previous)
+
+
+def poll_interval(state, now):
+    """次に取得するまでの秒数（新着の間隔、または最後の新着からの経過時間の大きい方を基準にする）"""
+    expected = state.get('publish_interval_seconds') or 0
+    last_new_at = _parse_time(state.get('last_new_at'))
+    if last_new_at:
+        expected = max(expected, (now - last_new_at).total_seconds())
+    return min(FEED_POLL_MAX_SECONDS, max(FEED_POLL_MIN_SECONDS, expected * POLL_FRACTION))
+
+
+def breaker_backoff(error_streak):
+    """連続失敗回数に応じて取得を止める秒数（しきい値未満なら0）"""
+    if error_streak < FEED_BREAKER_THRESHOLD:
+        return 0
+    return min(FEED_BREAKER_MAX_SECONDS, FEED_BREAKER_BASE_SECONDS * 2 ** (error_streak - FEED_BREAKER_THRESHOLD))
+
+
+class FeedHealthTracker:
+    """フィードの稼働状況（feed_health/feeds ドキュメント）の読み書き"""
+
+    def __init__(self, store):
+        self.store = store
+        self.states = {}
+        self._updated = {}
+
+    def load(self):
+        self.states = self.store.get_document(FEED_HEALTH_COLLECTION, FEED_HEALTH_DOC) or {}
+        return self
+
+    def state(self, feed_url):
+        return self.states.get(feed_key(feed_url), {})
+
+    def is_due(self, feed_url, now=None):
+        """取得する時刻になったか（初めてのフィード・時刻未設定のフィードは常に対象）"""
+        next_due_at = _parse_time(self.state(feed_url).get('next_due_at'))
+        now = now or datetime.now(timezone.utc)
+        return next_due_at is None or next_due_at <= now + timedelta(seconds=DUE_SLACK_SECONDS)
+
+    def split_due(self, feeds, now=None):
+        """フィードを (今回取得する, 今回は見送る) に分ける（順序は保つ）"""
+        now = now or datetime.now(timezone.utc)
+        due, waiting = [], []
+        for feed_config in feeds:
+            (due if self.is_due(feed_config['url'], now) else waiting).append(feed_config)
+        return due, waiting
+
+    def record(self, feed_config, status, elapsed, new_entries=0, error=None, now=None):
+        """1回分の取得結果を記録し、次に取得する時刻を決める"""
+        now = now or datetime.now(timezone.utc)
+        state = dict(self.state(feed_config['url']))
+        state.update({
+            'url': feed_config['url'],
+            'name': feed_config['name'],
+            'last_attempt_at': now.isoformat(),
+            'last_status': status,
+            'avg_latency_seconds': round(_ema(state.get('avg_latency_seconds'), elapsed), 3)
+        })
+
+        if status in FAILURE_STATUSES:
+            state['error_streak'] = state.get('error_streak', 0) + 1
+            state['total_failures'] = state.get('total_failures', 0) + 1
+            state['last_error'] = (error or status)[:200]
+            backoff = breaker_backoff(state['error_streak'])
+            state['circuit'] = 'open' if backoff else 'closed'
+            # しきい値に達するまでは次の実行で再試行する
+            state['next_due_at'] = (now + timedelta(seconds=backoff)).isoformat() if backoff else None
+            if backoff:
+                logger.warning(f"フィードの取得を{backoff / 60:.0f}分停止: {feed_config['name']} "
+                               f"(連続{state['error_streak']}回失敗: {state['last_error']})")
+        else:
+            if new_entries:
+                last_new_at = _parse_time(state.get('last_new_at'))
+                if last_new_at:
+                    state['publish_interval_seconds'] = round(
+                        _ema(state.get('publish_interval_seconds'), (now - last_new_at).total_seconds()))
+                state['last_new_at'] = now.isoformat()
+            state['error_streak'] = 0
+            state['last_error'] = None
+            state['last_success_at'] = now.isoformat()
+            state['circuit'] = 'closed'
+            state['next_due_at'] = (now + timedelta(seconds=poll_interval(state, now))).isoformat()
+
+        key = feed_key(feed_config['url'])
+        self.states[key] = state
+        self._updated[key] = state
+
+    def save(self):
+        """今回記録したフィードの状態だけを書き込む（他のシャードが書いた状態は残る）"""
+        if self._updated:
+            self.store.set_document(FEED_HEALTH_COLLECTION, FEED_HEALTH_DOC, self._updated, merge=True)
+            self._updated = {}
+
+    def report(self, feeds, now=None):
+        """フィードごとの状態の一覧（?action=feeds 用）"""
+        now = now or datetime.now(timezone.utc)
+        report = []
+        for feed_config in feeds:
+            state = self.state(feed_config['url'])
+            report.append({
+                'name': feed_config['name'],
+                'url': feed_config['url'],
+                'due': self.is_due(feed_config['url'], now),
+                'circuit': state.get('circuit', 'closed'),
+                'error_streak': state.get('error_streak', 0),
+                'total_failures': state.get('total_failures', 0),
+                'last_status': state.get('last_status'),
+                'last_error': state.get('last_error'),
+                'last_success_at': state.get('last_success_at'),
+                'last_attempt_at': state.get('last_attempt_at'),
+                'last_new_at': state.get('last_new_at'),
+                'next_due_at': state.get('next_due_at'),
+                'avg_latency_seconds': state.get('avg_latency_seconds'),
+                'publish_interval_seconds': state.get('publish_interval_seconds')
+            })
+        return report
@@ -0,0 +1,162 @@
+"""
+RSS/Atom/RDFフィードの逐次パーサー
+
+ダウンロードしながらXMLを少しずつパースし、先頭からN件のエントリが揃った時点で
+読み込みを打ち切る。全文入りのエントリが数十件あるフィードでも、本文全体や
+feedparserのオブジェクトツリーをメモリに持たずに済む。XMLとして不正なフィードや
+RSS/Atom/RDF以外の形式では StreamParseError を送出するので、呼び出し元は
+feedparser で読み直す。
+"""
+
+import copy
+import xml.etree.ElementTree as ET
+
+import feedparser
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+RSS1_NS = 'http://purl.org/rss/1.0/'
+RDF_NS = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+CONTENT_NS = 'http://purl.org/rss/1.0/modules/content/'
+FEEDBURNER_NS = 'http://rssnamespace.org/feedburner/ext/1.0'
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+
+# ルート要素 -> (形式, エントリの要素)
+FEED_FORMATS = {
+    'rss': ('rss', 'item'),
+    f'{{{ATOM_NS}}}feed': ('atom', f'{{{ATOM_NS}}}entry'),
+    f'{{{RDF_NS}}}RDF': ('rdf', f'{{{RSS1_NS}}}item'),
+}
+
+
+class StreamParseError(Exception):
+    """逐次パースできないフィード（feedparserで読み直す）"""
+
+
+def _xhtml(elem):
+    """Atomの type="xhtml" の内容をHTMLの文字列にする（包んでいるdivは除く、feedparserと同じ）"""
+    elem = copy.deepcopy(elem)
+    for node in elem.iter():
+        if isinstance(node.tag, str) and node.tag.startswith(f'{{{XHTML_NS}}}'):
+            node.tag = node.tag[len(XHTML_NS) + 2:]
+    children = list(elem)
+    if len(children) == 1 and children[0].tag == 'div' and not (elem.text or '').strip():
+        elem = children[0]
+    return (elem.text or '') + ''.join(ET.tostring(child, encoding='unicode', method='html') for child in elem)
+
+
+def _text(elem, *tags, markup=False):
+    """最初に見つかった空でない子要素のテキスト（子要素を含む場合は連結）
+
+    markup=True ならAtomの type="xhtml" の内容はリンクなどのマークアップを残したHTMLで返す。
+    """
+    for tag in tags:
+        child = elem.find(tag)
+        if child is not None:
+            if markup and child.get('type') == 'xhtml':
+                text = _xhtml(child).strip()
+            else:
+                text = ''.join(child.itertext()).strip()
+            if text:
+                return text
+    return ''
+
+
+def _atom_link(elem):
+    links = elem.findall(f'{{{ATOM_NS}}}link')
+    for link in links:
+        if link.get('rel', 'alternate') == 'alternate' and link.get('href'):
+            return link.get('href')
+    return next((link.get('href') for link in links if link.get('href')), '')
+
+
+def entry_from_element(elem, feed_format):
+    """エントリの要素を feedparser と同じキー名の辞書に変換"""
+    if feed_format == 'atom':
+        values = {
+            'title': _text(elem, f'{{{ATOM_NS}}}title'),
+            'link': _atom_link(elem),
+            'summary': _text(elem, f'{{{ATOM_NS}}}summary', f'{{{ATOM_NS}}}content', markup=True),
+            'id': _text(elem, f'{{{ATOM_NS}}}id'),
+            'published': _text(elem, f'{{{ATOM_NS}}}published', f'{{{ATOM_NS}}}updated'),
+        }
+    elif feed_format == 'rdf':
+        values = {
+            'title': _text(elem, f'{{{RSS1_NS}}}title'),
+            'link': _text(elem, f'{{{RSS1_NS}}}link') or elem.get(f'{{{RDF_NS}}}about', ''),
+            'summary': _text(elem, f'{{{RSS1_NS}}}description', f'{{{CONTENT_NS}}}encoded'),
+            'id': elem.get(f'{{{RDF_NS}}}about', ''),
+            'published': _text(elem, f'{{{DC_NS}}}date'),
+        }
+    else:
+        guid = elem.find('guid')
+        guid_text = (guid.text or '').strip() if guid is not None else ''
+        # link がない場合、パーマリンクのguidをリンクとして使う（feedparserと同じ）
+        guid_is_link = guid is not None and guid.get('isPermaLink', 'true') != 'false'
+        values = {
+            'title': _text(elem, 'title'),
+            'link': _text(elem, 'link') or (guid_text if guid_is_link else ''),
+            'summary': _text(elem, 'description', f'{{{CONTENT_NS}}}encoded'),
+            'id': guid_text,
+            'published': _text(elem, 'pubDate', f'{{{DC_NS}}}date'),
+        }
+    values['feedburner_origlink'] = _text(elem, f'{{{FEEDBURNER_NS}}}origLink')
+    # 値のない項目は feedparser と同じくキー自体を持たせない
+    return feedparser.FeedParserDict({key: value for key, value in values.items() if value})
+
+
+class StreamingFeedParser:
+    """チャンクを渡すたびにパースを進め、max_entries件のエントリが揃ったら done になる"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = []
+        self.format = None
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._stack = []
+        self._entry_tag = None
+
+    @property
+    def done(self):
+        return len(self.entries) >= self.max_entries
+
+    def feed(self, chunk):
+        try:
+            self._parser.feed(chunk)
+            self._handle_events()
+        except (ET.ParseError, ValueError) as e:
+            # ValueError は expat が対応していない文字コード（Shift_JISなど）
+            raise StreamParseError(f"XMLのパースに失敗: {e}") from e
+
+    def close(self):
+        """本文を最後まで読んだ（エントリがmax_entries件に満たないフィード）"""
+        try:
+            self._parser.close()
+            self._handle_events()
+        except (ET.ParseError, ValueError) as e:
+            raise StreamParseError(f"XMLのパースに失敗: {e}") from e
+        if self.format is None:
+            raise StreamParseError('フィードの要素がありません')
+
+    def result(self):
+        """feedparser.parse の戻り値と同じように .entries で参照できる結果"""
+        return feedparser.FeedParserDict(entries=self.entries, bozo=0, version=self.format)
+
+    def _handle_events(self):
+        for event, elem in self._parser.read_events():
+            if self.done:
+                return
+            if event == 'start':
+                if not self._stack:
+                    if elem.tag not in FEED_FORMATS:
+                        raise StreamParseError(f"未対応のフィード形式: {elem.tag}")
+                    self.format, self._entry_tag = FEED_FORMATS[elem.tag]
+                self._stack.append(elem)
+                continue
+
+            self._stack.pop()
+            if elem.tag == self._entry_tag:
+                self.entries.append(entry_from_element(elem, self.format))
+                # 変換済みのエントリはツリーから外してメモリを解放する
+                if self._stack:
+                    self._stack[-1].remove(elem)
@@ -0,0 +1,127 @@
+"""
+Firestoreの一括書き込み
+
+書き込みをバッファに溜め、最大500件ずつのWriteBatchでコミットする。
+一時的なエラーは指数バックオフで再試行し、それ以外のエラーでバッチ全体が
+失敗した場合は二分割して書き込み直し、失敗したドキュメントだけを特定する。
+"""
+
+import time
+import random
+import logging
+
+from google.api_core import exceptions as google_exceptions
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 500  # Firestoreの1バッチあたりの書き込み上限
+
+RETRYABLE_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+)
+
+
+class BulkWriter:
+    """書き込みをまとめてコミットするバッファ"""
+
+    def __init__(self, db, batch_size=MAX_BATCH_SIZE, max_retries=4, base_delay=0.5):
+        self.db = db
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._ops = []
+        self._failed = {}
+        self.stats = {'writes': 0, 'commits': 0, 'retries': 0, 'failed': 0}
+
+    def create(self, ref, data):
+        self._add('create', ref, data)
+
+    def set(self, ref, data, merge=False):
+        self._add('set', ref, data, merge=merge)
+
+    def update(self, ref, data):
+        self._add('update', ref, data)
+
+    def delete(self, ref):
+        self._add('delete', ref, None)
+
+    def __len__(self):
+        return len(self._ops)
+
+    def _add(self, kind, ref, data, **options):
+        self._ops.append((kind, ref, data, options))
+        if len(self._ops) >= self.batch_size:
+            self._flush_pending()
+
+    def _apply(self, batch, op):
+        kind, ref, data, options = op
+        if kind == 'create':
+            batch.create(ref, data)
+        elif kind == 'set':
+            batch.set(ref, data, **options)
+        elif kind == 'update':
+            batch.update(ref, data)
+        else:
+            batch.delete(ref)
+
+    def _commit(self, ops):
+        """opsを1バッチでコミット（一時的なエラーは再試行）"""
+        for attempt in range(self.max_retries + 1):
+            batch = self.db.batch()
+            for op in ops:
+                self._apply(batch, op)
+            try:
+                self.stats['commits'] += 1
+                batch.commit()
+                self.stats['writes'] += len(ops)
+                for _, ref, _, _ in ops:
+                    metrics.count('firestore_writes', collection=ref.parent.id)
+                return
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                self.stats['retries'] += 1
+                delay = self.base_delay * (2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"Firestore一括書き込みを再試行 ({attempt + 1}/{self.max_retries}): {e}")
+                time.sleep(delay)
+
+    def _commit_isolating(self, ops):
+        """コミットに失敗したら半分ずつに分けて再実行し、失敗したドキュメントだけを特定する"""
+        try:
+            self._commit(ops)
+        except Exception as e:
+            if len(ops) == 1:
+                self._record_failure(ops[0], e)
+                return
+
+            logger.warning(f"Firestore一括書き込み失敗のため分割して再実行 ({len(ops)}件): {e}")
+            middle = len(ops) // 2
+            self._commit_isolating(ops[:middle])
+            self._commit_isolating(ops[middle:])
+
+    def _flush_pending(self):
+        ops, self._ops = self._ops, []
+        for start in range(0, len(ops), self.batch_size):
+            self._commit_isolating(ops[start:start + self.batch_size])
+
+    def _record_failure(self, op, error):
+        kind, ref, _, _ = op
+        self.stats['failed'] += 1
+        self._failed[ref.path] = error
+        if isinstance(error, google_exceptions.AlreadyExists):
+            logger.info(f"保存済みのためスキップ: {ref.path}")
+        else:
+            logger.error(f"Firestore書き込みエラー ({kind} {ref.path}): {error}")
+
+    def flush(self):
+        """残りをすべてコミットし、前回のflush以降に失敗したドキュメントのパス -> 例外 を返す"""
+        self._flush_pending()
+        failed, self._failed = self._failed, {}
+        return failed
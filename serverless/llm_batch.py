@@ -0,0 +1,146 @@
+"""
+OpenAI Batch API のジョブ管理
+
+急がない要約・1次情報抽出のリクエストをJSONLにまとめて Batch API に投入し、
+後の実行で完了したジョブの結果を読み込む。Batch API は24時間以内に処理され、
+料金は同期呼び出しの半額になる。
+
+ジョブごとの対応表（custom_id -> 記事ID・キャッシュキー）は llm_batches/<バッチID> に、
+処理中のジョブの一覧は llm_batches/_open の1ドキュメントに保存する。
+"""
+
+import os
+import json
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Batch API の設定（環境変数で上書き可能）
+LLM_BATCH_COMPLETION_WINDOW = os.environ.get('LLM_BATCH_COMPLETION_WINDOW', '24h')
+LLM_BATCH_MAX_REQUESTS = int(os.environ.get('LLM_BATCH_MAX_REQUESTS', '500'))
+
+BATCH_COLLECTION = 'llm_batches'
+BATCH_OPEN_DOC = '_open'
+BATCH_ENDPOINT = '/v1/chat/completions'
+RUNNING_STATUSES = ('validating', 'in_progress', 'finalizing', 'cancelling')
+BATCH_OPEN_PRUNE_THRESHOLD = 200
+
+
+def batch_line(custom_id, body):
+    """JSONLの1行（1リクエスト分）"""
+    return json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': BATCH_ENDPOINT, 'body': body},
+                      ensure_ascii=False)
+
+
+def parse_output_line(line):
+    """出力ファイルの1行を (custom_id, 本文の文字列, 使用量) に変換（エラーの行は本文がNone）"""
+    record = json.loads(line)
+    response = record.get('response') or {}
+    body = response.get('body') or {}
+    if record.get('error') or response.get('status_code') != 200:
+        return record.get('custom_id'), None, None
+    try:
+        content = body['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        content = None
+    return record.get('custom_id'), content, body.get('usage')
+
+
+def _file_text(client, file_id):
+    if not file_id:
+        return ''
+    return client.files.content(file_id).text
+
+
+class BatchJobs:
+    """Batch API のジョブの投入・完了確認と、処理中のジョブの一覧の読み書き"""
+
+    def __init__(self, store, llm):
+        self.store = store
+        self.llm = llm
+
+    def open_jobs(self):
+        """処理中のジョブの {バッチID: 投入日時}（処理済みのジョブは値がNone）"""
+        jobs = self.store.get_document(BATCH_COLLECTION, BATCH_OPEN_DOC) or {}
+        return {batch_id: submitted_at for batch_id, submitted_at in jobs.items() if submitted_at}
+
+    def get_job(self, batch_id):
+        return self.store.get_document(BATCH_COLLECTION, batch_id)
+
+    def submit(self, requests, items, kind):
+        """(custom_id, リクエスト本文) のリストをジョブとして投入し、バッチIDを返す
+
+        items は custom_id -> 結果の取り込みに使う情報（記事IDなど）。
+        """
+        data = '\n'.join(batch_line(custom_id, body) for custom_id, body in requests).encode('utf-8')
+        client = self.llm.client
+        input_file = client.files.create(file=(f"{kind}.jsonl", data), purpose='batch')
+        batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                      completion_window=LLM_BATCH_COMPLETION_WINDOW,
+                                      metadata={'kind': kind})
+
+        now = datetime.now(timezone.utc)
+        self.store.set_document(BATCH_COLLECTION, batch.id, {
+            'kind': kind,
+            'status': batch.status,
+            'input_file_id': input_file.id,
+            'request_count': len(requests),
+            'items': items,
+            'created_at': now
+        })
+        self.store.set_document(BATCH_COLLECTION, BATCH_OPEN_DOC, {batch.id: now.isoformat()}, merge=True)
+        logger.info(f"Batch APIにジョブを投入: {batch.id} ({kind}, {len(requests)}件)")
+        return batch.id
+
+    def poll(self, batch_id):
+        """ジョブの状態を確認し、終わっていれば (状態, {custom_id: 本文}, 使用量のリスト) を返す
+
+        処理中ならNoneを返す。失敗・期限切れのジョブでも処理できた分の結果は返す
+        （結果がない custom_id は呼び出し側で同期呼び出しに回す）。
+        """
+        client = self.llm.client
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in RUNNING_STATUSES:
+            return None
+
+        results = {}
+        usages = []
+        output = _file_text(client, getattr(batch, 'output_file_id', None))
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            custom_id, content, usage = parse_output_line(line)
+            if content is not None:
+                results[custom_id] = content
+                usages.append(usage)
+        if batch.status != 'completed':
+            logger.warning(f"Batch APIのジョブが完了しませんでした: {batch_id} ({batch.status})")
+        return batch.status, results, usages
+
+    def input_bodies(self, job):
+        """投入したリクエストの {custom_id: 本文}（結果がなかった分を同期呼び出しでやり直すため）"""
+        bodies = {}
+        for line in _file_text(self.llm.client, job['input_file_id']).splitlines():
+            if line.strip():
+                record = json.loads(line)
+                bodies[record['custom_id']] = record['body']
+        return bodies
+
+    def retain(self, batch_id, job, items):
+        """ジョブを処理中のまま残し、次回取り込む項目を items だけにする（使用量は集計済みにする）"""
+        # マージでは対応表から項目を消せないので、ジョブのドキュメントごと書き直す
+        self.store.set_document(BATCH_COLLECTION, batch_id, dict(job, items=items, usage_recorded=True))
+
+    def close(self, batch_id, status, summary):
+        """ジョブを処理済みにし、処理中の一覧から外す"""
+        self.store.set_document(BATCH_COLLECTION, batch_id, dict(
+            summary, status=status, finished_at=datetime.now(timezone.utc)), merge=True)
+        # 並行して投入されたジョブを消さないよう、一覧は書き直さずにこのジョブの値だけを消す
+        self.store.set_document(BATCH_COLLECTION, BATCH_OPEN_DOC, {batch_id: None}, merge=True)
+
+        # 処理済みの値が溜まったら処理中のジョブだけで書き直す（ドキュメントのサイズ上限対策）
+        jobs = self.store.get_document(BATCH_COLLECTION, BATCH_OPEN_DOC) or {}
+        open_jobs = {job_id: submitted_at for job_id, submitted_at in jobs.items() if submitted_at}
+        if len(jobs) - len(open_jobs) >= BATCH_OPEN_PRUNE_THRESHOLD:
+            self.store.set_document(BATCH_COLLECTION, BATCH_OPEN_DOC, open_jobs)
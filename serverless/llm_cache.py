@@ -0,0 +1,330 @@
+"""
+LLM応答キャッシュ
+
+モデル名・プロンプトのバージョン・正規化した記事内容のダイジェストをキーに
+LLMの応答を保存する。プロセス内のLRUと永続層（Firestore または SQLite）の
+2段構成で、永続層はTTLと件数上限で古いものから削除する。
+"""
+
+import os
+import re
+import json
+import html
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from metrics import metrics
+from storage import GET_ALL_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# キャッシュ設定（環境変数で上書き可能）
+LLM_CACHE_BACKEND = os.environ.get('LLM_CACHE_BACKEND', 'firestore')  # firestore / sqlite / memory / none
+LLM_CACHE_TTL_HOURS = float(os.environ.get('LLM_CACHE_TTL_HOURS', '168'))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '5000'))
+LLM_CACHE_MEMORY_ENTRIES = int(os.environ.get('LLM_CACHE_MEMORY_ENTRIES', '512'))
+LLM_CACHE_SQLITE_PATH = os.environ.get('LLM_CACHE_SQLITE_PATH', '/tmp/llm_cache.sqlite3')
+LLM_CACHE_COLLECTION = 'llm_cache'
+
+# 本文がこの文字数以上あれば本文のみをキーにする（タイトルの微修正でキャッシュを外さないため）
+CONTENT_ONLY_KEY_MIN_CHARS = 200
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_URL_NOISE_RE = re.compile(r'(https?://[^\s?#"\'<>]+)[?#][^\s"\'<>]*')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """HTMLタグ・URLのクエリ・大文字小文字・空白の違いを吸収した文字列を返す"""
+    text = html.unescape(_TAG_RE.sub(' ', text or ''))
+    text = _URL_NOISE_RE.sub(r'\1', text)
+    return _SPACE_RE.sub(' ', text).strip().lower()
+
+
+def article_key_parts(title, content):
+    """記事単位の呼び出しでキーに使う要素（本文が十分長ければ本文のみ）"""
+    normalized_content = normalize_text(content)
+    if len(normalized_content) >= CONTENT_ONLY_KEY_MIN_CHARS:
+        return (normalized_content,)
+    return (normalize_text(title), normalized_content)
+
+
+def make_cache_key(kind, model, prompt_version, *parts):
+    """モデル・プロンプトのバージョン・内容ダイジェストからキーを生成"""
+    digest = hashlib.sha256('\x1f'.join(normalize_text(str(part)) for part in parts).encode()).hexdigest()
+    return hashlib.sha256(f"{kind}|{model}|{prompt_version}|{digest}".encode()).hexdigest()
+
+
+class CacheTier:
+    """永続層のインターフェース（何も保存しない実装）"""
+
+    def get(self, key):
+        """(ヒットしたか, 値) を返す"""
+        return False, None
+
+    def get_many(self, keys):
+        """ヒットしたキーの {キー: 値} を返す"""
+        found = {}
+        for key in keys:
+            hit, value = self.get(key)
+            if hit:
+                found[key] = value
+        return found
+
+    def set(self, key, value, kind):
+        pass
+
+    def evict(self):
+        """期限切れ・上限超過分を削除し、削除件数を返す"""
+        return 0
+
+
+class FirestoreCacheTier(CacheTier):
+    """Firestoreの llm_cache コレクションに保存する
+
+    expires_at にFirestoreのTTLポリシーを設定しておくと期限切れ分は自動削除される。
+    """
+
+    def __init__(self, db, ttl_hours=LLM_CACHE_TTL_HOURS, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 collection=LLM_CACHE_COLLECTION):
+        self.db = db
+        self.ttl = timedelta(hours=ttl_hours)
+        self.max_entries = max_entries
+        self.collection = collection
+
+    def get(self, key):
+        doc = self.db.collection(self.collection).document(key).get()
+        metrics.count('firestore_reads', collection=self.collection)
+        if not doc.exists:
+            return False, None
+        data = doc.to_dict()
+        if data.get('expires_at') and data['expires_at'] < datetime.now(timezone.utc):
+            return False, None
+        return True, json.loads(data['value'])
+
+    def get_many(self, keys):
+        """get_all で GET_ALL_CHUNK_SIZE 件ずつまとめて読む"""
+        keys = list(dict.fromkeys(keys))
+        now = datetime.now(timezone.utc)
+        found = {}
+        for start in range(0, len(keys), GET_ALL_CHUNK_SIZE):
+            refs = [self.db.collection(self.collection).document(key) for key in keys[start:start + GET_ALL_CHUNK_SIZE]]
+            metrics.count('firestore_reads', len(refs), collection=self.collection)
+            for doc in self.db.get_all(refs):
+                if not doc.exists:
+                    continue
+                data = doc.to_dict()
+                if data.get('expires_at') and data['expires_at'] < now:
+                    continue
+                found[doc.id] = json.loads(data['value'])
+        return found
+
+    def set(self, key, value, kind):
+        now = datetime.now(timezone.utc)
+        self.db.collection(self.collection).document(key).set({
+            'kind': kind,
+            'value': json.dumps(value, ensure_ascii=False),
+            'created_at': now,
+            'expires_at': now + self.ttl
+        })
+        metrics.count('firestore_writes', collection=self.collection)
+
+    def evict(self):
+        collection = self.db.collection(self.collection)
+        count = collection.count().get()[0][0].value
+        metrics.count('firestore_reads', collection=self.collection)
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+
+        # 古いものから上限超過分を削除
+        deleted = 0
+        batch = self.db.batch()
+        for doc in collection.order_by('created_at').limit(excess).select([]).stream():
+            batch.delete(doc.reference)
+            deleted += 1
+            if deleted % 500 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        batch.commit()
+        metrics.count('firestore_reads', deleted, collection=self.collection)
+        metrics.count('firestore_writes', deleted, collection=self.collection)
+        return deleted
+
+
+class SQLiteCacheTier(CacheTier):
+    """ローカルのSQLiteファイルに保存する"""
+
+    def __init__(self, path=LLM_CACHE_SQLITE_PATH, ttl_hours=LLM_CACHE_TTL_HOURS,
+                 max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache ('
+            'key TEXT PRIMARY KEY, kind TEXT, value TEXT, created_at REAL, expires_at REAL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache (created_at)')
+        self.conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM llm_cache WHERE key IN ({','.join('?' * len(chunk))}) AND expires_at > ?",
+                    chunk + [time.time()]
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def set(self, key, value, kind):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, kind, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+                (key, kind, json.dumps(value, ensure_ascii=False), now, now + self.ttl_seconds)
+            )
+            self.conn.commit()
+
+    def evict(self):
+        with self._lock:
+            expired = self.conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (time.time(),)).rowcount
+            overflow = self.conn.execute(
+                'DELETE FROM llm_cache WHERE key IN ('
+                'SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            ).rowcount
+            self.conn.commit()
+        return expired + overflow
+
+
+class LLMCache:
+    """プロセス内LRU + 永続層の2段キャッシュ"""
+
+    def __init__(self, tier=None, memory_entries=LLM_CACHE_MEMORY_ENTRIES):
+        self.tier = tier or CacheTier()
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """実行ごとの集計をリセットする（キャッシュの内容はそのまま）"""
+        with self._lock:
+            self.stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'writes': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def lookup(self, key):
+        """(ヒットしたか, 値) を返す（値がNoneでもヒットとして扱える）"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return True, self._memory[key]
+
+        try:
+            hit, value = self.tier.get(key)
+        except Exception as e:
+            logger.error(f"LLMキャッシュ読み取りエラー: {e}")
+            self._count('errors')
+            hit, value = False, None
+
+        if hit:
+            self._count('persistent_hits')
+            self._remember(key, value)
+            return True, value
+
+        self._count('misses')
+        return False, None
+
+    def lookup_many(self, keys):
+        """複数のキーをまとめて引き、キーごとの (ヒットしたか, 値) のリストを入力順で返す
+
+        プロセス内LRUにないキーだけを永続層から1回（Firestoreは get_all）で読む。
+        """
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory and key not in found:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.stats['memory_hits'] += 1
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            try:
+                persisted = self.tier.get_many(missing)
+            except Exception as e:
+                logger.error(f"LLMキャッシュ読み取りエラー: {e}")
+                self._count('errors')
+                persisted = {}
+            for key in missing:
+                if key in persisted:
+                    self._count('persistent_hits')
+                    self._remember(key, persisted[key])
+                    found[key] = persisted[key]
+                else:
+                    self._count('misses')
+
+        return [(key in found, found.get(key)) for key in keys]
+
+    def store(self, key, value, kind=''):
+        self._remember(key, value)
+        try:
+            self.tier.set(key, value, kind)
+            self._count('writes')
+        except Exception as e:
+            logger.error(f"LLMキャッシュ書き込みエラー: {e}")
+            self._count('errors')
+
+    def evict(self):
+        try:
+            return self.tier.evict()
+        except Exception as e:
+            logger.error(f"LLMキャッシュ削除エラー: {e}")
+            return 0
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+def create_llm_cache(db=None, backend=None):
+    """設定に応じたキャッシュを生成"""
+    backend = backend or LLM_CACHE_BACKEND
+    if backend == 'none':
+        return LLMCache(memory_entries=0)
+    if backend == 'firestore' and db is not None:
+        return LLMCache(FirestoreCacheTier(db))
+    if backend == 'sqlite':
+        return LLMCache(SQLiteCacheTier())
+    return LLMCache()
@@ -0,0 +1,277 @@
+"""
+レート制限付きのOpenAIクライアント
+
+リクエスト数/分とトークン数/分の2つのトークンバケットで送信を調整し、
+429・5xx・接続エラーはジッター付きの指数バックオフで再試行する。
+複数スレッドから同時に呼び出せるので、記事ごとの要約を並行に実行できる。
+実行ごとのリクエスト数・トークン数・推定費用を集計する。
+"""
+
+import os
+import time
+import random
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# クライアント設定（環境変数で上書き可能）
+OPENAI_RPM_LIMIT = float(os.environ.get('OPENAI_RPM_LIMIT', '500'))
+OPENAI_TPM_LIMIT = float(os.environ.get('OPENAI_TPM_LIMIT', '200000'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '5'))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.environ.get('OPENAI_BACKOFF_BASE_SECONDS', '1'))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.environ.get('OPENAI_BACKOFF_MAX_SECONDS', '30'))
+OPENAI_REQUEST_TIMEOUT = float(os.environ.get('OPENAI_REQUEST_TIMEOUT', '60'))
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+
+# 100万トークンあたりの料金（USD, 入力/出力）。未登録のモデルは環境変数で指定する
+MODEL_PRICES_PER_1M = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+}
+BATCH_PRICE_FACTOR = 0.5  # Batch API の料金は同期呼び出しの半額
+
+
+class LLMUnavailable(Exception):
+    """再試行しても一時的なエラーが解消しなかった（記事は次回に持ち越す）"""
+
+
+def estimate_tokens(text):
+    """トークン数の概算（英数字は約4文字、日本語は約1文字で1トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model):
+    """tiktokenのエンコーディング（tiktokenが使えない環境ではNone）"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        logger.warning(f"トークナイザーを読み込めないため概算を使用: {e}")
+        return None
+
+
+def count_tokens(text, model=None):
+    """トークン数（tiktokenがあれば実際のトークナイザー、なければ estimate_tokens の概算）"""
+    encoding = _get_encoding(model or 'gpt-4o-mini')
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_request_tokens(messages, max_tokens):
+    """リクエスト全体（入力+出力上限）のトークン数の概算"""
+    prompt_tokens = sum(estimate_tokens(message.get('content') or '') + 4 for message in messages)
+    return prompt_tokens + (max_tokens or 0)
+
+
+def is_retryable(error):
+    """429・5xx・接続エラー・タイムアウトなら再試行する"""
+    import openai
+
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error):
+    """レスポンスの Retry-After ヘッダー（秒）。なければNone"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """1分あたりの上限で補充されるトークンバケット"""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """amount分のトークンが貯まるまで待ってから消費し、待った秒数を返す"""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def refund(self, amount):
+        """見積もりより実際の消費が少なかった分を戻す（多かった場合は差し引く）"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMClient:
+    """レート制限・再試行・費用集計を行う chat.completions のラッパー"""
+
+    def __init__(self, api_key=None, rpm=OPENAI_RPM_LIMIT, tpm=OPENAI_TPM_LIMIT,
+                 max_retries=OPENAI_MAX_RETRIES, base_delay=OPENAI_BACKOFF_BASE_SECONDS,
+                 max_delay=OPENAI_BACKOFF_MAX_SECONDS, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.api_key = api_key
+        self.requests_bucket = TokenBucket(rpm)
+        self.tokens_bucket = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def client(self):
+        # 再試行はこのクラスで行うため、SDK側の自動再試行は無効にする
+        # openai の読み込みは重いので、最初にAPIを呼ぶときまで遅らせる
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import openai
+
+                    self._client = openai.OpenAI(api_key=self.api_key, max_retries=0,
+                                                 timeout=OPENAI_REQUEST_TIMEOUT)
+        return self._client
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {
+                'requests': 0, 'retries': 0, 'rate_limited': 0, 'failures': 0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0, 'throttle_seconds': 0.0
+            }
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['cost_usd'] = round(stats['cost_usd'], 6)
+        stats['throttle_seconds'] = round(stats['throttle_seconds'], 2)
+        return stats
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def _usage_cost(self, model, prompt_tokens, completion_tokens):
+        input_price, output_price = MODEL_PRICES_PER_1M.get(model, (
+            float(os.environ.get('OPENAI_PRICE_INPUT_PER_1M', '0')),
+            float(os.environ.get('OPENAI_PRICE_OUTPUT_PER_1M', '0'))
+        ))
+        return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    def _record_usage(self, model, usage, estimated_tokens):
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        cost_usd = self._usage_cost(model, prompt_tokens, completion_tokens)
+        self._count(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost_usd=cost_usd)
+        stage = metrics.current_stage()
+        metrics.count('openai_prompt_tokens', prompt_tokens, stage=stage)
+        metrics.count('openai_completion_tokens', completion_tokens, stage=stage)
+        metrics.count('openai_cost_usd', cost_usd, stage=stage)
+        if usage is not None:
+            self.tokens_bucket.refund(estimated_tokens - prompt_tokens - completion_tokens)
+
+    def record_batch_usage(self, model, usages):
+        """Batch API の結果に含まれる使用量（辞書のリスト）を集計する"""
+        prompt_tokens = sum((usage or {}).get('prompt_tokens', 0) for usage in usages)
+        completion_tokens = sum((usage or {}).get('completion_tokens', 0) for usage in usages)
+        cost_usd = self._usage_cost(model, prompt_tokens, completion_tokens) * BATCH_PRICE_FACTOR
+        self._count(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost_usd=cost_usd)
+        metrics.count('openai_prompt_tokens', prompt_tokens, stage='batch')
+        metrics.count('openai_completion_tokens', completion_tokens, stage='batch')
+        metrics.count('openai_cost_usd', cost_usd, stage='batch')
+
+    def chat(self, **kwargs):
+        """chat.completions.create をレート制限・再試行付きで呼び出す
+
+        一時的なエラーが再試行上限まで続いた場合は LLMUnavailable を送出する。
+        それ以外のエラーはそのまま送出する。
+        """
+        estimated_tokens = estimate_request_tokens(kwargs.get('messages', []), kwargs.get('max_tokens'))
+
+        for attempt in range(self.max_retries + 1):
+            throttled = self.requests_bucket.acquire() + self.tokens_bucket.acquire(estimated_tokens)
+            self._count(requests=1, throttle_seconds=throttled)
+            stage = metrics.current_stage()
+            metrics.count('openai_requests', stage=stage)
+            started = time.perf_counter()
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    self._count(failures=1)
+                    metrics.count('openai_failures', stage=stage)
+                    raise
+                if getattr(e, 'status_code', None) == 429:
+                    self._count(rate_limited=1)
+                    metrics.count('openai_rate_limited', stage=stage)
+                if attempt == self.max_retries:
+                    self._count(failures=1)
+                    metrics.count('openai_failures', stage=stage)
+                    raise LLMUnavailable(f"再試行上限に達しました: {e}") from e
+
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * (2 ** attempt)) * (0.5 + random.random())
+                self._count(retries=1)
+                logger.warning(f"OpenAI APIを再試行 ({attempt + 1}/{self.max_retries}, {delay:.1f}秒後): {e}")
+                time.sleep(delay)
+                continue
+
+            metrics.observe('openai_request_seconds', time.perf_counter() - started, stage=stage)
+            self._record_usage(kwargs.get('model'), getattr(response, 'usage', None), estimated_tokens)
+            return response
+
+    def map(self, fn, items):
+        """itemsの各要素にfnを並行に適用し、(結果, 例外) のリストを入力順で返す"""
+        items = list(items)
+        if not items:
+            return []
+
+        # 各スレッドの処理は呼び出し元のスパンの下で計測する
+        path = metrics.current_path()
+
+        def run(item):
+            try:
+                with metrics.bound(path):
+                    return fn(item), None
+            except Exception as e:
+                return None, e
+
+        if self.max_concurrency <= 1 or len(items) == 1:
+            return [run(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(items)),
+                                thread_name_prefix='llm') as executor:
+            return list(executor.map(run, items))
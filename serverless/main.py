@@ -1,15 +1,31 @@
 import os
 import json
-import feedparser
-import openai
-from google.cloud import firestore
+import gzip
 from datetime import datetime, timedelta, timezone
 import hashlib
 import logging
+import functools
+import threading
 import functions_framework
-from slack_sdk import WebhookClient
-import requests
 import re
+import time
+from prefilter import prefilter_article
+from primary_sources import find_primary_sources, rank_primary_sources, primary_source_urls, confirm_llm_sources
+from llm_cache import create_llm_cache, make_cache_key, article_key_parts
+from storage import create_article_store, article_path, project
+from llm_client import LLMClient, LLMUnavailable, estimate_tokens, count_tokens
+from feed_health import FeedHealthTracker
+from metrics import metrics
+from scheduler import RunScheduler, CollectCursor, rotate_feeds, next_start_index
+from fanout import (
+    COLLECT_SHARDS, FANOUT_DISPATCHER, FANOUT_WORKER_URL, parse_shard, parse_shard_count, shard_feeds, merge_results,
+    HttpDispatcher, LocalQueueDispatcher
+)
+from clustering import (
+    canonicalize_url, remember_redirect, story_fingerprint, hamming_distance,
+    StoryClusterIndex, SIMHASH_MAX_DISTANCE, CLUSTER_COLLECTION
+)
+from llm_batch import BatchJobs, LLM_BATCH_MAX_REQUESTS
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -18,12 +34,86 @@ logger = logging.getLogger(__name__)
 # 環境変数から設定を取得
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 SLACK_WEBHOOK_URL = os.environ.get('SLACK_WEBHOOK_URL')
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+
+# LLM応答キャッシュのキーに含めるプロンプトのバージョン（プロンプトを変更したら上げる）
+LLM_PROMPT_VERSIONS = {
+    'classify': 'v1',
+    'sources': 'v2',
+    'summarize': 'v1',
+    'analyze': 'v2',
+    'thread': 'v1',
+    'thread_digest': 'v1'
+}
+
+# 判定・要約・1次情報抽出を1回のLLM呼び出しで行うか（失敗時は個別呼び出しにフォールバック）
+LLM_COMBINED_MODE = os.environ.get('LLM_COMBINED_MODE', '1') == '1'
+
+# AI関連と判定した記事の要約・1次情報抽出を OpenAI Batch API に回すか
+# （記事は要約待ちで保存し、後の実行で完了したジョブの結果を取り込む。料金は半額）
+LLM_BATCH_MODE = os.environ.get('LLM_BATCH_MODE', '0') == '1'
+BATCH_PENDING_IMPORTANCE = 3  # 要約待ちの記事の仮の重要度
+
+# LLM判定の前にローカルのキーワード・フィード事前スコアで明らかな記事を振り分けるか
+PREFILTER_MODE = os.environ.get('PREFILTER_MODE', '1') == '1'
+
+# AI関連判定を複数記事まとめて1回のリクエストで行う設定
+CLASSIFY_BATCH_MODE = os.environ.get('CLASSIFY_BATCH_MODE', '1') == '1'
+CLASSIFY_BATCH_SIZE = int(os.environ.get('CLASSIFY_BATCH_SIZE', '30'))
+CLASSIFY_BATCH_TOKEN_BUDGET = int(os.environ.get('CLASSIFY_BATCH_TOKEN_BUDGET', '6000'))
+CLASSIFY_BATCH_MAX_RETRIES = int(os.environ.get('CLASSIFY_BATCH_MAX_RETRIES', '2'))
+CLASSIFY_SNIPPET_CHARS = 300
+
+# フィードごとに候補にする最新記事の件数
+ENTRIES_PER_FEED = int(os.environ.get('ENTRIES_PER_FEED', '3'))
+# 先頭の ENTRIES_PER_FEED 件だけを逐次パースし、残りは読まずに打ち切るか
+# （逐次パースできないフィードは全体を読んで feedparser で解析する）
+FEED_STREAM_MODE = os.environ.get('FEED_STREAM_MODE', '1') == '1'
+
+# X投稿まとめの候補として読み込む未使用記事の上限
+SUMMARY_MAX_CANDIDATES = int(os.environ.get('SUMMARY_MAX_CANDIDATES', '100'))
+
+# X投稿スレッドに載せる記事の選定設定
+THREAD_INPUT_TOKEN_BUDGET = int(os.environ.get('THREAD_INPUT_TOKEN_BUDGET', '6000'))
+THREAD_MAX_ARTICLES = int(os.environ.get('THREAD_MAX_ARTICLES', '10'))
+THREAD_MAX_OUTPUT_TOKENS = int(os.environ.get('THREAD_MAX_OUTPUT_TOKENS', '3000'))
+# 候補の合計トークン数がこれを超えたら、分割して並行に絞り込んでからスレッドを作る
+THREAD_MAP_REDUCE_TOKENS = int(os.environ.get('THREAD_MAP_REDUCE_TOKENS', '18000'))
+THREAD_DIGEST_KEEP = int(os.environ.get('THREAD_DIGEST_KEEP', '4'))
+THREAD_HISTORY_LIMIT = int(os.environ.get('THREAD_HISTORY_LIMIT', '50'))
+
+# 一覧・履歴APIの設定
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', '20'))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', '100'))
+API_CACHE_MAX_AGE = int(os.environ.get('API_CACHE_MAX_AGE', '60'))
+API_GZIP_MIN_BYTES = int(os.environ.get('API_GZIP_MIN_BYTES', '1024'))
+
+# action=list で返す記事のフィールドと、値がない場合の既定値
+LIST_ARTICLE_DEFAULTS = {
+    'title': '', 'url': '', 'source': '', 'summary': '', 'source_lang': '',
+    'primary_source': [], 'used_in_summary': False, 'date': '', 'summary_status': 'done'
+}
+
+# action=history で返す記事のフィールド（スレッドに保存したスナップショットの項目）
+HISTORY_ARTICLE_FIELDS = [
+    'title', 'url', 'summary', 'source', 'primary_source', 'importance_score', 'created_at'
+]
+
+# カスタムスレッドの作成で読み取る記事のフィールド（本文の全文などは読まない）
+THREAD_ARTICLE_FIELDS = [
+    'title', 'url', 'summary', 'source', 'primary_source', 'importance_score', 'cluster_id', 'created_at',
+    'summary_status'
+]
+
+# 収集処理全体の締め切り（秒）。Cloud Functionsのタイムアウト(540秒)より短くする
+COLLECT_DEADLINE_SECONDS = int(os.environ.get('COLLECT_DEADLINE_SECONDS', '420'))
 
 # RSS フィード一覧（多様な情報源）
+# prior: AI専門フィードの事前スコア（事前フィルタで加点。5なら常にAI関連として扱う）
 RSS_FEEDS = [
     # 日本の主要テックサイト
     {"url": "https://gigazine.net/news/rss_2.0/", "name": "GIGAZINE", "lang": "ja"},
-    {"url": "https://www.itmedia.co.jp/rss/2.0/news_ai.xml", "name": "ITmedia AI", "lang": "ja"},
+    {"url": "https://www.itmedia.co.jp/rss/2.0/news_ai.xml", "name": "ITmedia AI", "lang": "ja", "prior": 5},
     {"url": "https://www.publickey1.jp/atom.xml", "name": "Publickey", "lang": "ja"},
     {"url": "https://japan.zdnet.com/rss/index.rdf", "name": "ZDNet Japan", "lang": "ja"},
     {"url": "https://ascii.jp/rss.xml", "name": "ASCII.jp", "lang": "ja"},
@@ -48,43 +138,43 @@ RSS_FEEDS = [
     {"url": "https://feeds.feedburner.com/TechCrunchIT", "name": "TechCrunch IT", "lang": "en"},
     
     # AI専門サイト
-    {"url": "https://feeds.feedburner.com/aidaily", "name": "AI Daily", "lang": "en"},
-    {"url": "https://www.artificialintelligence-news.com/feed/", "name": "AI News", "lang": "en"},
-    {"url": "https://venturebeat.com/ai/feed/", "name": "VentureBeat AI", "lang": "en"},
-    {"url": "https://www.unite.ai/feed/", "name": "Unite.AI", "lang": "en"},
-    {"url": "https://towardsdatascience.com/feed", "name": "Towards Data Science", "lang": "en"},
-    {"url": "https://machinelearningmastery.com/feed/", "name": "Machine Learning Mastery", "lang": "en"},
-    {"url": "https://www.kdnuggets.com/feed", "name": "KDnuggets", "lang": "en"},
-    {"url": "https://analyticsindiamag.com/feed/", "name": "Analytics India Magazine", "lang": "en"},
-    {"url": "https://www.marktechpost.com/feed/", "name": "MarkTechPost", "lang": "en"},
-    {"url": "https://syncedreview.com/feed/", "name": "Synced", "lang": "en"},
+    {"url": "https://feeds.feedburner.com/aidaily", "name": "AI Daily", "lang": "en", "prior": 5},
+    {"url": "https://www.artificialintelligence-news.com/feed/", "name": "AI News", "lang": "en", "prior": 5},
+    {"url": "https://venturebeat.com/ai/feed/", "name": "VentureBeat AI", "lang": "en", "prior": 5},
+    {"url": "https://www.unite.ai/feed/", "name": "Unite.AI", "lang": "en", "prior": 2},
+    {"url": "https://towardsdatascience.com/feed", "name": "Towards Data Science", "lang": "en", "prior": 2},
+    {"url": "https://machinelearningmastery.com/feed/", "name": "Machine Learning Mastery", "lang": "en", "prior": 2},
+    {"url": "https://www.kdnuggets.com/feed", "name": "KDnuggets", "lang": "en", "prior": 2},
+    {"url": "https://analyticsindiamag.com/feed/", "name": "Analytics India Magazine", "lang": "en", "prior": 2},
+    {"url": "https://www.marktechpost.com/feed/", "name": "MarkTechPost", "lang": "en", "prior": 5},
+    {"url": "https://syncedreview.com/feed/", "name": "Synced", "lang": "en", "prior": 5},
     
     # 学術・研究系
-    {"url": "https://arxiv.org/rss/cs.AI", "name": "arXiv AI", "lang": "en"},
-    {"url": "https://www.nature.com/subjects/machine-learning.rss", "name": "Nature ML", "lang": "en"},
-    {"url": "https://arxiv.org/rss/cs.LG", "name": "arXiv Machine Learning", "lang": "en"},
-    {"url": "https://arxiv.org/rss/cs.CL", "name": "arXiv NLP", "lang": "en"},
-    {"url": "https://arxiv.org/rss/cs.CV", "name": "arXiv Computer Vision", "lang": "en"},
-    {"url": "https://distill.pub/rss.xml", "name": "Distill", "lang": "en"},
+    {"url": "https://arxiv.org/rss/cs.AI", "name": "arXiv AI", "lang": "en", "prior": 5},
+    {"url": "https://www.nature.com/subjects/machine-learning.rss", "name": "Nature ML", "lang": "en", "prior": 5},
+    {"url": "https://arxiv.org/rss/cs.LG", "name": "arXiv Machine Learning", "lang": "en", "prior": 5},
+    {"url": "https://arxiv.org/rss/cs.CL", "name": "arXiv NLP", "lang": "en", "prior": 5},
+    {"url": "https://arxiv.org/rss/cs.CV", "name": "arXiv Computer Vision", "lang": "en", "prior": 5},
+    {"url": "https://distill.pub/rss.xml", "name": "Distill", "lang": "en", "prior": 5},
     
     # 企業・スタートアップ系
-    {"url": "https://openai.com/blog/rss.xml", "name": "OpenAI Blog", "lang": "en"},
-    {"url": "https://blog.google/technology/ai/rss/", "name": "Google AI Blog", "lang": "en"},
+    {"url": "https://openai.com/blog/rss.xml", "name": "OpenAI Blog", "lang": "en", "prior": 5},
+    {"url": "https://blog.google/technology/ai/rss/", "name": "Google AI Blog", "lang": "en", "prior": 5},
     {"url": "https://engineering.fb.com/feed/", "name": "Meta Engineering", "lang": "en"},
-    {"url": "https://blogs.microsoft.com/ai/feed/", "name": "Microsoft AI Blog", "lang": "en"},
-    {"url": "https://aws.amazon.com/blogs/machine-learning/feed/", "name": "AWS ML Blog", "lang": "en"},
-    {"url": "https://blog.tensorflow.org/feeds/posts/default", "name": "TensorFlow Blog", "lang": "en"},
-    {"url": "https://pytorch.org/blog/feed.xml", "name": "PyTorch Blog", "lang": "en"},
-    {"url": "https://huggingface.co/blog/feed.xml", "name": "Hugging Face Blog", "lang": "en"},
-    {"url": "https://deepmind.com/blog/feed/basic/", "name": "DeepMind Blog", "lang": "en"},
-    {"url": "https://blog.anthropic.com/rss.xml", "name": "Anthropic Blog", "lang": "en"},
+    {"url": "https://blogs.microsoft.com/ai/feed/", "name": "Microsoft AI Blog", "lang": "en", "prior": 5},
+    {"url": "https://aws.amazon.com/blogs/machine-learning/feed/", "name": "AWS ML Blog", "lang": "en", "prior": 2},
+    {"url": "https://blog.tensorflow.org/feeds/posts/default", "name": "TensorFlow Blog", "lang": "en", "prior": 2},
+    {"url": "https://pytorch.org/blog/feed.xml", "name": "PyTorch Blog", "lang": "en", "prior": 2},
+    {"url": "https://huggingface.co/blog/feed.xml", "name": "Hugging Face Blog", "lang": "en", "prior": 2},
+    {"url": "https://deepmind.com/blog/feed/basic/", "name": "DeepMind Blog", "lang": "en", "prior": 5},
+    {"url": "https://blog.anthropic.com/rss.xml", "name": "Anthropic Blog", "lang": "en", "prior": 5},
     
     # 開発者・エンジニア向け
     {"url": "https://github.blog/feed/", "name": "GitHub Blog", "lang": "en"},
     {"url": "https://stackoverflow.blog/feed/", "name": "Stack Overflow Blog", "lang": "en"},
     {"url": "https://dev.to/feed", "name": "DEV Community", "lang": "en"},
     {"url": "https://hackernoon.com/feed", "name": "HackerNoon", "lang": "en"},
-    {"url": "https://medium.com/feed/@towardsdatascience", "name": "Medium TDS", "lang": "en"},
+    {"url": "https://medium.com/feed/@towardsdatascience", "name": "Medium TDS", "lang": "en", "prior": 2},
     {"url": "https://www.infoq.com/feed/", "name": "InfoQ", "lang": "en"},
     
     # ビジネス・投資系（AI関連）
@@ -96,42 +186,87 @@ RSS_FEEDS = [
     {"url": "https://thebridge.jp/feed", "name": "THE BRIDGE", "lang": "ja"},
     {"url": "https://jp.techcrunch.com/feed/", "name": "TechCrunch Japan", "lang": "ja"},
     {"url": "https://www.startupdb.jp/feed", "name": "STARTUP DB", "lang": "ja"},
-    {"url": "https://ainow.ai/feed/", "name": "AINOW", "lang": "ja"},
-    {"url": "https://ledge.ai/feed/", "name": "Ledge.ai", "lang": "ja"}
+    {"url": "https://ainow.ai/feed/", "name": "AINOW", "lang": "ja", "prior": 5},
+    {"url": "https://ledge.ai/feed/", "name": "Ledge.ai", "lang": "ja", "prior": 5}
 ]
 
 # クライアント初期化
-openai.api_key = OPENAI_API_KEY
-db = firestore.Client()
+# コールドスタートを短くするため、openai・Firestore・Slack・feedparser などの重い依存は
+# 最初に使うときに読み込む（list・history などの読み取り専用のアクションでは読み込まない）
+llm = LLMClient(api_key=OPENAI_API_KEY)
+store = create_article_store()
+
+def lazy(factory):
+    """最初の呼び出しで作ったオブジェクトを以降も返す（複数スレッドから同時に呼ばれても1回だけ作る）"""
+    lock = threading.Lock()
+    created = []
+    
+    @functools.wraps(factory)
+    def get():
+        if not created:
+            with lock:
+                if not created:
+                    created.append(factory())
+        return created[0]
+    return get
+
+@lazy
+def get_feed_cache():
+    """フィードの条件付きGETキャッシュ"""
+    from feed_fetcher import create_feed_cache_store
+    
+    return create_feed_cache_store(store.db)  # Firestoreの場合のみ store.db がある
+
+@lazy
+def get_llm_cache():
+    """LLM応答キャッシュ"""
+    return create_llm_cache(store.db)
+
+@lazy
+def get_slack_client():
+    """Slack通知クライアント（SLACK_WEBHOOK_URL が未設定ならNone）"""
+    if not SLACK_WEBHOOK_URL:
+        return None
+    from slack_sdk import WebhookClient
+    
+    return WebhookClient(url=SLACK_WEBHOOK_URL)
 
-# Slack通知クライアント
-slack_client = WebhookClient(url=SLACK_WEBHOOK_URL) if SLACK_WEBHOOK_URL else None
+def llm_cache_key(kind, *parts):
+    """LLM応答キャッシュのキーを生成"""
+    return make_cache_key(kind, OPENAI_MODEL, LLM_PROMPT_VERSIONS[kind], *parts)
 
 def create_article_hash(url, title):
     """記事の重複チェック用ハッシュを生成"""
     return hashlib.md5(f"{url}{title}".encode()).hexdigest()
 
-def get_processed_articles():
-    """Firestoreから処理済み記事のハッシュリストを取得"""
+@metrics.timed('dedup')
+def find_processed_hashes(article_hashes):
+    """候補のハッシュのうち処理済みのものを返す
+
+    記事のドキュメントIDはハッシュそのものなので、今回の候補分だけを
+    get_allでまとめて存在確認する（コレクション全体は走査しない）。
+    """
+    article_hashes = list(dict.fromkeys(article_hashes))
+    if not article_hashes:
+        return set()
+    
     try:
-        docs = db.collection('ai_articles').select(['hash']).stream()
-        processed_hashes = set()
-        
-        for doc in docs:
-            data = doc.to_dict()
-            if 'hash' in data:
-                processed_hashes.add(data['hash'])
-        
-        return processed_hashes
+        return store.find_existing(article_hashes)
     except Exception as e:
         logger.error(f"Firestore読み取りエラー: {e}")
         return set()
 
+@metrics.timed('classify')
 def is_ai_related_article(title, content):
     """GPTを使ってAI関連の最新ニュースかどうかを判定"""
+    cache_key = llm_cache_key('classify', *article_key_parts(title, content))
+    hit, cached = get_llm_cache().lookup(cache_key)
+    if hit:
+        return cached
+    
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
+        response = llm.chat(
+            model=OPENAI_MODEL,
             messages=[
                 {
                     "role": "system", 
@@ -154,53 +289,203 @@ def is_ai_related_article(title, content):
             temperature=0.1
         )
         
-        result = response.choices[0].message.content.strip().upper()
-        return result == "YES"
+        result = response.choices[0].message.content.strip().upper() == "YES"
+        get_llm_cache().store(cache_key, result, 'classify')
+        return result
+    except LLMUnavailable:
+        raise
     except Exception as e:
         logger.error(f"AI関連判定エラー: {e}")
         return False
 
-def extract_primary_sources(content, title):
-    """記事から1次情報のリンクを抽出"""
+def format_classification_item(number, title, content):
+    """一括判定プロンプト用に1記事分を整形"""
+    snippet = re.sub(r'<[^>]+>', ' ', content or '')
+    snippet = re.sub(r'\s+', ' ', snippet).strip()[:CLASSIFY_SNIPPET_CHARS]
+    return f"[{number}] タイトル: {title}\n内容: {snippet}"
+
+def pack_classification_batches(items, indices, batch_size, token_budget):
+    """件数上限とトークン予算に収まるように判定対象を分割"""
+    batches = []
+    current = []
+    current_tokens = 0
+    
+    for index in indices:
+        title, content = items[index]
+        tokens = estimate_tokens(format_classification_item(len(current) + 1, title, content))
+        if current and (len(current) >= batch_size or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_batch_verdicts(text, count):
+    """「番号: YES/NO」形式の回答を {番号: bool} に変換（範囲外・重複矛盾は無視）"""
+    verdicts = {}
+    conflicts = set()
+    for match in re.finditer(r'^\s*\[?(\d+)\]?\s*[:：.)\-]\s*(YES|NO)\b', text or '', re.IGNORECASE | re.MULTILINE):
+        number = int(match.group(1))
+        verdict = match.group(2).upper() == 'YES'
+        if not 1 <= number <= count:
+            continue
+        if number in verdicts and verdicts[number] != verdict:
+            conflicts.add(number)
+        verdicts[number] = verdict
+    
+    for number in conflicts:
+        del verdicts[number]
+    return verdicts
+
+def classify_batch_once(items, batch):
+    """1バッチ分をGPTで判定し、{itemsのインデックス: bool} を返す"""
+    items_text = "\n\n".join(
+        format_classification_item(number, *items[index])
+        for number, index in enumerate(batch, start=1)
+    )
+    
+    response = llm.chat(
+        model=OPENAI_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": """あなたはAI・機械学習・テクノロジーの最新ニュース分類専門家です。
+                番号付きの各記事がAI、機械学習、人工知能、ChatGPT、Claude、Gemini、深層学習、
+                自然言語処理、コンピュータビジョン、ロボティクス、自動化技術、
+                データサイエンス、MLOps等に関連する「最新ニュース」かどうかを判定してください。
+                
+                【含める】新製品発表、企業発表、技術革新、買収・提携、規制・政策、研究成果
+                【除外する】用語解説、ハウツー記事、チュートリアル、基本概念説明、過去の振り返り
+                
+                全ての記事について1行ずつ「番号: YES」または「番号: NO」の形式のみで回答してください。"""
+            },
+            {
+                "role": "user",
+                "content": items_text
+            }
+        ],
+        max_tokens=len(batch) * 6 + 10,
+        temperature=0.1
+    )
+    
+    verdicts = parse_batch_verdicts(response.choices[0].message.content, len(batch))
+    return {batch[number - 1]: verdict for number, verdict in verdicts.items()}
+
+@metrics.timed('classify')
+def classify_articles_batch(items, batch_size=None, token_budget=None, stats=None):
+    """複数の (タイトル, 内容) をまとめてAI関連判定し、boolのリストを返す
+
+    回答が欠けた・不正な記事だけを再送し、それでも判定できなかった記事は
+    is_ai_related_article で個別に判定する。レート制限で判定できなかった記事はNone。
+    """
+    batch_size = batch_size or CLASSIFY_BATCH_SIZE
+    token_budget = token_budget or CLASSIFY_BATCH_TOKEN_BUDGET
+    stats = stats if stats is not None else {}
+    verdicts = {}
+    
+    # 判定済みの記事はキャッシュから取得（個別判定と同じキーを共有）
+    cache_keys = [llm_cache_key('classify', *article_key_parts(title, content)) for title, content in items]
+    for index, (hit, cached) in enumerate(get_llm_cache().lookup_many(cache_keys)):
+        if hit:
+            verdicts[index] = cached
+    pending = [index for index in range(len(items)) if index not in verdicts]
+    
+    for attempt in range(CLASSIFY_BATCH_MAX_RETRIES + 1):
+        if not pending:
+            break
+        if attempt:
+            logger.info(f"一括判定の再試行: {len(pending)}件")
+        
+        for batch in pack_classification_batches(items, pending, batch_size, token_budget):
+            try:
+                stats['classification_requests'] = stats.get('classification_requests', 0) + 1
+                batch_verdicts = classify_batch_once(items, batch)
+                for index, verdict in batch_verdicts.items():
+                    get_llm_cache().store(cache_keys[index], verdict, 'classify')
+                verdicts.update(batch_verdicts)
+            except Exception as e:
+                logger.error(f"AI関連一括判定エラー: {e}")
+        
+        pending = [index for index in pending if index not in verdicts]
+    
+    for index in pending:
+        stats['classification_requests'] = stats.get('classification_requests', 0) + 1
+        try:
+            verdicts[index] = is_ai_related_article(*items[index])
+        except LLMUnavailable as e:
+            logger.warning(f"AI関連判定を保留: {e}")
+            verdicts[index] = None
+    
+    return [verdicts[index] for index in range(len(items))]
+
+@metrics.timed('sources')
+def extract_primary_sources(content, title, url=None):
+    """記事から1次情報のリンクを抽出し、URLのリストで返す
+
+    本文のリンクを許可・除外リストで振り分け、許可リストのリンクがあればそれを返す。
+    判断がつかないリンクしかない場合だけ、その候補からLLMに選ばせる（リンクがなければ呼ばない）。
+    """
+    primary, ambiguous = find_primary_sources(content, url)
+    if primary or not ambiguous:
+        metrics.count('primary_sources_local', outcome='found' if primary else 'none')
+        return primary
+    
+    cache_key = llm_cache_key('sources', *article_key_parts(title, content))
+    hit, cached = get_llm_cache().lookup(cache_key)
+    if hit:
+        return cached
+    
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
+        candidates = "\n".join(ambiguous)
+        response = llm.chat(
+            model=OPENAI_MODEL,
             messages=[
                 {
                     "role": "system",
-                    "content": """記事から1次情報のリンクを抽出してください。
-                    優先順位：
-                    1. 公式発表・プレスリリース
-                    2. 企業公式サイト・ブログ
-                    3. GitHub・技術文書
-                    4. 公式Twitter/X投稿
-                    5. 研究論文・学術サイト
+                    "content": """候補のリンクから1次情報のリンクを抽出してください。
+                    1次情報：公式発表・プレスリリース、企業公式サイト・ブログ、GitHub・技術文書、
+                    公式Twitter/X投稿、研究論文・学術サイト
                     
                     まとめサイトやニュースサイトのリンクは除外してください。
-                    見つからない場合は "なし" と回答してください。"""
+                    該当する候補のURLを1行に1つずつそのまま回答し、なければ "なし" と回答してください。"""
                 },
                 {
                     "role": "user",
-                    "content": f"タイトル: {title}\n\n記事内容: {content[:2000]}"
+                    "content": f"タイトル: {title}\n\n候補のリンク:\n{candidates}"
                 }
             ],
             max_tokens=200,
             temperature=0.1
         )
         
-        result = response.choices[0].message.content.strip()
-        return result if result != "なし" else None
+        # 候補にないURL（LLMが作ったもの）は使わない
+        answer = set(primary_source_urls(response.choices[0].message.content))
+        result = [candidate for candidate in ambiguous if candidate in answer]
+        get_llm_cache().store(cache_key, result, 'sources')
+        return result
+    except LLMUnavailable:
+        raise
     except Exception as e:
         logger.error(f"1次情報抽出エラー: {e}")
-        return None
+        return []
 
+@metrics.timed('summarize')
 def summarize_with_openai(title, content, source_lang="en"):
     """OpenAI GPT-4o miniで記事を日本語で要約し、重要度も評価"""
+    cache_key = llm_cache_key('summarize', source_lang, *article_key_parts(title, content))
+    hit, cached = get_llm_cache().lookup(cache_key)
+    if hit:
+        return tuple(cached)
+    
     try:
         lang_instruction = "記事は英語ですが、" if source_lang == "en" else ""
         
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
+        response = llm.chat(
+            model=OPENAI_MODEL,
             messages=[
                 {
                     "role": "system", 
@@ -250,17 +535,167 @@ def summarize_with_openai(title, content, source_lang="en"):
         if not summary:
             summary = result  # フォーマットが異なる場合は全体を要約として使用
         
+        get_llm_cache().store(cache_key, [summary, importance_score], 'summarize')
         return summary, importance_score
         
+    except LLMUnavailable:
+        raise
     except Exception as e:
         logger.error(f"OpenAI要約エラー: {e}")
         return "要約の生成に失敗しました。", 3
 
-def save_to_firestore(title, url, summary, source, article_hash, source_lang, primary_source=None, importance_score=3):
-    """要約をFirestoreに保存（拡張データ構造）"""
+# 判定・要約・1次情報抽出をまとめて返すための出力スキーマ
+ARTICLE_ANALYSIS_SCHEMA = {
+    "name": "article_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "is_ai": {"type": "boolean"},
+            "summary": {"type": "string"},
+            "importance_score": {"type": "integer"},
+            "primary_sources": {"type": "array", "items": {"type": "string"}}
+        },
+        "required": ["is_ai", "summary", "importance_score", "primary_sources"],
+        "additionalProperties": False
+    }
+}
+
+# 本文に判断のつかないリンクがない記事用（1次情報はローカルの抽出結果だけを使う）
+ARTICLE_SUMMARY_SCHEMA = {
+    "name": "article_summary",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "is_ai": {"type": "boolean"},
+            "summary": {"type": "string"},
+            "importance_score": {"type": "integer"}
+        },
+        "required": ["is_ai", "summary", "importance_score"],
+        "additionalProperties": False
+    }
+}
+
+def parse_article_analysis(raw):
+    """構造化出力を検証して辞書で返す（不正な場合はNone）"""
     try:
-        doc_ref = db.collection('ai_articles').document()
-        doc_ref.set({
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    
+    if not isinstance(data, dict) or not isinstance(data.get('is_ai'), bool):
+        return None
+    
+    summary = data.get('summary')
+    importance_score = data.get('importance_score')
+    primary_sources = data.get('primary_sources', [])
+    if not isinstance(summary, str) or not isinstance(primary_sources, list):
+        return None
+    if isinstance(importance_score, bool) or not isinstance(importance_score, int):
+        return None
+    if data['is_ai'] and not summary.strip():
+        return None
+    
+    return {
+        'is_ai': data['is_ai'],
+        'summary': summary.strip(),
+        'importance_score': max(1, min(5, importance_score)),  # 1-5の範囲に制限
+        'primary_sources': [url.strip() for url in primary_sources if isinstance(url, str) and url.strip().startswith('http')]
+    }
+
+def analysis_cache_key(title, content, source_lang):
+    return llm_cache_key('analyze', source_lang, *article_key_parts(title, content))
+
+def analysis_request(title, content, source_lang="en", source_candidates=()):
+    """AI関連判定・要約・重要度・1次情報抽出のリクエスト本文（同期呼び出しとBatch APIで共通）
+
+    1次情報は本文のリンクのうち許可・除外リストで判断がつかないもの（source_candidates）から
+    選ばせる。候補がなければ1次情報は尋ねない。
+    """
+    lang_instruction = "記事は英語ですが、" if source_lang == "en" else ""
+    if source_candidates:
+        sources_instruction = """
+                4. primary_sources: 候補のリンクのうち1次情報に当たるもののURL一覧（候補にないURLは含めない）
+                   （公式発表・プレスリリース、企業公式サイト・ブログ、GitHub・技術文書、
+                   公式Twitter/X投稿、研究論文・学術サイト。まとめサイトやニュースサイトは除外）
+                
+                is_ai が false の場合は summary を空文字、primary_sources を空配列にしてください。"""
+        candidates_text = "\n\n候補のリンク:\n" + "\n".join(source_candidates)
+    else:
+        sources_instruction = """
+                
+                is_ai が false の場合は summary を空文字にしてください。"""
+        candidates_text = ""
+    return dict(
+        model=OPENAI_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": f"""あなたはAI・テクノロジー記事の分類・要約・評価スペシャリストです。
+                {lang_instruction}以下の作業を行い、JSONで回答してください：
+                
+                1. is_ai: AI、機械学習、人工知能、ChatGPT、Claude、Gemini、深層学習、
+                   自然言語処理、コンピュータビジョン、ロボティクス、自動化技術、
+                   データサイエンス、MLOps等に関連する「最新ニュース」かどうか
+                   【含める】新製品発表、企業発表、技術革新、買収・提携、規制・政策、研究成果
+                   【除外する】用語解説、ハウツー記事、チュートリアル、基本概念説明、過去の振り返り
+                2. summary: 記事を日本語で分かりやすく3-5文で要約
+                3. importance_score: AI初心者・エンジニアにとっての重要度（1-5の整数）
+                   5: 業界を変える革新的発表、大手企業の重要発表
+                   4: 注目すべき新技術、重要な企業動向
+                   3: 興味深い開発、中程度の影響
+                   2: 小さな更新、限定的な影響
+                   1: 軽微なニュース、参考程度{sources_instruction}"""
+            },
+            {
+                "role": "user",
+                "content": f"記事タイトル: {title}\n\n記事内容: {content[:3000]}{candidates_text}"
+            }
+        ],
+        response_format={"type": "json_schema", "json_schema":
+                         ARTICLE_ANALYSIS_SCHEMA if source_candidates else ARTICLE_SUMMARY_SCHEMA},
+        max_tokens=700,
+        temperature=0.2
+    )
+
+@metrics.timed('analyze')
+def analyze_article_with_openai(title, content, source_lang="en", source_candidates=()):
+    """AI関連判定・要約・重要度・1次情報抽出を1回の呼び出しで行う
+
+    1次情報は source_candidates（本文の判断がつかないリンク）から選ばせ、候補にないURLは除く。
+    パースや検証に失敗した場合はNoneを返す（呼び出し側で個別処理にフォールバック）。
+    """
+    cache_key = analysis_cache_key(title, content, source_lang)
+    hit, cached = get_llm_cache().lookup(cache_key)
+    if hit:
+        return cached
+    
+    try:
+        response = llm.chat(**analysis_request(title, content, source_lang, source_candidates))
+        
+        analysis = parse_article_analysis(response.choices[0].message.content)
+        if analysis is None:
+            logger.warning(f"構造化出力の検証に失敗: {title}")
+        else:
+            analysis['primary_sources'] = confirm_llm_sources(analysis['primary_sources'], source_candidates)
+            get_llm_cache().store(cache_key, analysis, 'analyze')
+        return analysis
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"記事一括分析エラー: {e}")
+        return None
+
+def save_to_firestore(title, url, summary, source, article_hash, source_lang, primary_source=None, importance_score=3,
+                      cluster_id=None, writer=None, summary_status=None):
+    """要約をFirestoreに保存（拡張データ構造）
+
+    writerを渡した場合は一括書き込みのバッファに積むだけで、結果はwriter.flush()で確定する。
+    summary_status='pending' は要約をBatch APIで生成中の記事（結果の取り込み時に要約を埋める）。
+    """
+    try:
+        data = {
             'title': title,
             'url': url,
             'summary': summary,
@@ -268,69 +703,217 @@ def save_to_firestore(title, url, summary, source, article_hash, source_lang, pr
             'source': source,
             'source_lang': source_lang,
             'hash': article_hash,
-            'primary_source': primary_source,
+            'primary_source': list(primary_source or []),  # 1次情報のURLのリスト
             'processed': True,
             'used_in_summary': False,  # X投稿まとめで使用済みかフラグ
             'importance_score': importance_score,     # 重要度スコア
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
+            'cluster_id': cluster_id or article_hash  # 同一ストーリーの記事で共通のID
+        }
+        if summary_status:
+            data['summary_status'] = summary_status
         
+        # ハッシュをドキュメントIDにして重複判定をID検索で行えるようにする（created_atは保存先が付与）
+        if writer is not None:
+            writer.create_article(article_hash, data)
+            return True
+        
+        if not store.create_article(article_hash, data):
+            logger.info(f"保存済み記事のためスキップ: {title}")
+            return False
         logger.info(f"Firestoreに保存完了: {title}")
         return True
     except Exception as e:
         logger.error(f"Firestore保存エラー: {e}")
         return False
 
-def get_recent_unused_articles(hours=24):
-    """未使用の最近の記事を重要度順で取得"""
+@metrics.timed('load_articles')
+def get_recent_unused_articles(hours=24, limit=None):
+    """未使用の最近の記事を重要度順（同じ重要度なら新しい順）で最大limit件取得"""
     try:
         cutoff_time = datetime.now(timezone.utc) - timedelta(hours=hours)
         
-        # まず未使用の記事を全て取得（created_atフィールドがない場合も考慮）
-        docs = db.collection('ai_articles').where(
-            filter=firestore.FieldFilter('used_in_summary', '==', False)
-        ).stream()
-        
+        # 複合インデックスを使って期間内の未使用記事を並び順どおりに読む
         articles = []
-        for doc in docs:
-            data = doc.to_dict()
-            
-            # created_atがない場合はdateフィールドを使用
-            article_time = data.get('created_at')
-            if not article_time:
-                article_time = data.get('date')
-            
-            # 時間フィルタリング（フィールドがない場合は含める）
-            if not article_time or article_time >= cutoff_time:
-                articles.append({
-                    'id': doc.id,
-                    'title': data.get('title', ''),
-                    'url': data.get('url', ''),
-                    'summary': data.get('summary', ''),
-                    'source': data.get('source', ''),
-                    'primary_source': data.get('primary_source'),
-                    'importance_score': data.get('importance_score', 3),
-                    'created_at': article_time
-                })
-        
-        # 重要度順でソート（高い順）、同じ重要度なら新しい順
-        articles.sort(key=lambda x: (-x.get('importance_score', 3), -(x.get('created_at') or datetime.min).timestamp()))
+        for data in store.unused_articles(cutoff_time, limit or SUMMARY_MAX_CANDIDATES):
+            # 要約待ち・AI関連外と判定された（Batch APIの）記事はまとめに使わない
+            if data.get('summary_status', 'done') != 'done':
+                continue
+            articles.append({
+                'id': data['id'],
+                'title': data.get('title', ''),
+                'url': data.get('url', ''),
+                'summary': data.get('summary', ''),
+                'source': data.get('source', ''),
+                'primary_source': primary_source_urls(data.get('primary_source')),
+                'importance_score': data.get('importance_score', 3),
+                'cluster_id': data.get('cluster_id') or data['id'],
+                'created_at': data.get('created_at')
+            })
         
         return articles
     except Exception as e:
         logger.error(f"未使用記事取得エラー: {e}")
         return []
 
+def collapse_story_clusters(articles):
+    """同じストーリークラスタの記事をまとめ、各クラスタの先頭の記事だけを返す（順序は維持）"""
+    seen_clusters = set()
+    representatives = []
+    for article in articles:
+        cluster_id = article.get('cluster_id') or article.get('id') or article.get('url')
+        if cluster_id in seen_clusters:
+            continue
+        seen_clusters.add(cluster_id)
+        representatives.append(article)
+    return representatives
+
+def format_thread_item(article):
+    """スレッド生成プロンプト用に1記事分を整形（分割ごとの絞り込みで1文に縮めた要約があればそれを使う）"""
+    primary_sources = ' '.join(primary_source_urls(article.get('primary_source'))) or 'なし'
+    summary = article.get('digest') or article['summary']
+    return f"【{article['source']}】{article['title']}\n要約: {summary}\n重要度: {article.get('importance_score', 3)}\n参考URL: {article['url']}\n1次情報: {primary_sources}"
+
+def rank_thread_articles(articles, window_hours=24):
+    """重要度・新しさ・ストーリーの重複なさで記事を並べる
+
+    同じストーリーの記事は1件にまとめ、同じ配信元の記事が続く場合は少しずつ順位を下げる。
+    """
+    now = datetime.now(timezone.utc)
+    scored = []
+    for article in collapse_story_clusters(articles):
+        created_at = article.get('created_at')
+        freshness = 0.0
+        if isinstance(created_at, datetime):
+            age_hours = (now - created_at).total_seconds() / 3600
+            freshness = max(0.0, 1.0 - age_hours / window_hours)
+        scored.append([article.get('importance_score', 3) + freshness, article])
+    
+    ranked = []
+    source_counts = {}
+    while scored:
+        best = max(scored, key=lambda item: item[0] - 0.5 * source_counts.get(item[1]['source'], 0))
+        scored.remove(best)
+        ranked.append(best[1])
+        source_counts[best[1]['source']] = source_counts.get(best[1]['source'], 0) + 1
+    return ranked
+
+def select_thread_articles(ranked_articles, token_budget=None, max_articles=None):
+    """順位の高い記事から、件数上限と入力トークン予算に収まる分だけ選ぶ"""
+    token_budget = token_budget or THREAD_INPUT_TOKEN_BUDGET
+    max_articles = max_articles or THREAD_MAX_ARTICLES
+    selected = []
+    used_tokens = 0
+    
+    for article in ranked_articles:
+        if len(selected) >= max_articles:
+            break
+        tokens = count_tokens(format_thread_item(article), OPENAI_MODEL)
+        if used_tokens + tokens > token_budget:
+            continue
+        selected.append(article)
+        used_tokens += tokens
+    
+    return selected
+
+def pack_thread_partitions(ranked_articles, token_budget):
+    """トークン予算ごとに記事を分割（分割ごとに絞り込みを並行実行する）"""
+    partitions = []
+    current = []
+    current_tokens = 0
+    for article in ranked_articles:
+        tokens = count_tokens(format_thread_item(article), OPENAI_MODEL)
+        if current and current_tokens + tokens > token_budget:
+            partitions.append(current)
+            current = []
+            current_tokens = 0
+        current.append(article)
+        current_tokens += tokens
+    if current:
+        partitions.append(current)
+    return partitions
+
+# 分割ごとの絞り込み結果の出力スキーマ
+THREAD_DIGEST_SCHEMA = {
+    "name": "thread_digest",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "items": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "number": {"type": "integer"},
+                        "digest": {"type": "string"}
+                    },
+                    "required": ["number", "digest"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["items"],
+        "additionalProperties": False
+    }
+}
+
+@metrics.timed('thread_digest')
+def digest_thread_partition(partition, keep=None):
+    """1つの分割から重要な記事を選び、1文に縮めた要約を digest に入れた記事のリストを返す（summary はそのまま）"""
+    keep = keep or THREAD_DIGEST_KEEP
+    items_text = "\n\n".join(
+        f"[{number}] {format_thread_item(article)}" for number, article in enumerate(partition, start=1)
+    )
+    
+    cache_key = llm_cache_key('thread_digest', keep, items_text)
+    hit, cached = get_llm_cache().lookup(cache_key)
+    if not hit:
+        response = llm.chat(
+            model=OPENAI_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"""あなたはAIニュースのキュレーション専門家です。
+                    番号付きの記事から、X投稿スレッドに載せるべき重要なニュースを最大{keep}件選び、
+                    それぞれの内容を日本語1文に要約してください。
+                    重要度が高く、初心者・エンジニアにとって価値があり、互いに重複しないものを優先してください。"""
+                },
+                {
+                    "role": "user",
+                    "content": items_text
+                }
+            ],
+            response_format={"type": "json_schema", "json_schema": THREAD_DIGEST_SCHEMA},
+            max_tokens=keep * 120 + 50,
+            temperature=0.2
+        )
+        cached = json.loads(response.choices[0].message.content)['items']
+        get_llm_cache().store(cache_key, cached, 'thread_digest')
+    
+    digested = []
+    seen = set()
+    for item in cached:
+        number = item.get('number')
+        if not isinstance(number, int) or not 1 <= number <= len(partition) or number in seen:
+            continue
+        seen.add(number)
+        article = partition[number - 1]
+        digested.append(dict(article, digest=item.get('digest')) if item.get('digest') else article)
+    return digested[:keep]
+
+@metrics.timed('thread_generate')
 def create_x_thread_summary(articles):
     """記事群からX投稿用のスレッドまとめを生成（★評価・参考リンク付き）"""
     try:
-        articles_text = "\n\n".join([
-            f"【{article['source']}】{article['title']}\n要約: {article['summary']}\n重要度: {article.get('importance_score', 3)}\n参考URL: {article['url']}\n1次情報: {article.get('primary_source', 'なし')}"
-            for article in articles
-        ])
+        articles_text = "\n\n".join([format_thread_item(article) for article in articles])
+        
+        cache_key = llm_cache_key('thread', articles_text)
+        hit, cached = get_llm_cache().lookup(cache_key)
+        if hit:
+            return cached
         
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
+        response = llm.chat(
+            model=OPENAI_MODEL,
             messages=[
                 {
                     "role": "system",
@@ -362,27 +945,75 @@ def create_x_thread_summary(articles):
                     "content": f"以下のAI関連記事からX投稿用スレッドを作成してください：\n\n{articles_text}"
                 }
             ],
-            max_tokens=2500,
+            max_tokens=min(THREAD_MAX_OUTPUT_TOKENS, 400 + 250 * len(articles)),
             temperature=0.4
         )
         
-        return response.choices[0].message.content.strip()
+        x_summary = response.choices[0].message.content.strip()
+        get_llm_cache().store(cache_key, x_summary, 'thread')
+        return x_summary
     except Exception as e:
         logger.error(f"Xまとめ生成エラー: {e}")
         return None
 
+def build_x_thread(articles, explicit=False):
+    """候補記事から載せる記事を選んでスレッドを生成する
+
+    候補が多い場合は、分割ごとに重要な記事を並行に絞り込んで（map）から
+    1つのスレッドにまとめる（reduce）。生成できなければNone、できれば
+    {'text': スレッド本文, 'articles': 実際に載せた記事, 'mode': 'direct' / 'map_reduce'} を返す。
+    explicit=True（ユーザーが選んだ記事）の場合は順位付け・同じストーリーの集約・件数上限・
+    絞り込みを行わず、渡された順に載せる（入力トークン予算を超える記事だけを外す）。
+    """
+    if explicit:
+        selected = select_thread_articles(articles, max_articles=len(articles))
+        text = create_x_thread_summary(selected) if selected else None
+        return {'text': text, 'articles': selected, 'mode': 'direct'} if text else None
+    
+    ranked = rank_thread_articles(articles)
+    mode = 'direct'
+    
+    total_tokens = sum(count_tokens(format_thread_item(article), OPENAI_MODEL) for article in ranked)
+    if total_tokens > THREAD_MAP_REDUCE_TOKENS:
+        mode = 'map_reduce'
+        partitions = pack_thread_partitions(ranked, THREAD_INPUT_TOKEN_BUDGET)
+        logger.info(f"候補が多いため{len(partitions)}分割で絞り込み: {len(ranked)}件")
+        
+        ranked = []
+        for partition, (digested, error) in zip(partitions, llm.map(digest_thread_partition, partitions)):
+            if error is not None or not digested:
+                # 絞り込めなかった分割は順位の高い記事をそのまま候補にする
+                if error is not None:
+                    logger.error(f"スレッド候補の絞り込みエラー: {error}")
+                digested = partition[:THREAD_DIGEST_KEEP]
+            ranked.extend(digested)
+        ranked = rank_thread_articles(ranked)
+    
+    selected = select_thread_articles(ranked)
+    if not selected:
+        return None
+    
+    text = create_x_thread_summary(selected)
+    if not text:
+        return None
+    return {'text': text, 'articles': selected, 'mode': mode}
+
+@metrics.timed('mark_used')
 def mark_articles_as_used(article_ids):
-    """記事を使用済みとしてマーク"""
+    """記事を使用済みとしてマーク（最大500件ずつ一括更新）"""
     try:
+        writer = store.writer()
         for article_id in article_ids:
-            doc_ref = db.collection('ai_articles').document(article_id)
-            doc_ref.update({'used_in_summary': True})
-        logger.info(f"{len(article_ids)}件の記事を使用済みにマーク")
+            writer.update_article(article_id, {'used_in_summary': True})
+        failed = writer.flush()
+        logger.info(f"{len(article_ids) - len(failed)}件の記事を使用済みにマーク（コミット{writer.stats['commits']}回）")
     except Exception as e:
         logger.error(f"使用済みマークエラー: {e}")
 
+@metrics.timed('notify')
 def send_slack_notification_summary(x_summary, article_count):
     """X投稿スレッドをSlackに通知"""
+    slack_client = get_slack_client()
     if not slack_client or not x_summary:
         return
     
@@ -427,11 +1058,18 @@ def send_slack_notification_summary(x_summary, article_count):
         logger.error(f"Slack通知エラー: {e}")
         return False
 
+@metrics.timed('notify')
 def send_slack_notification(articles):
     """個別記事をSlackに通知（従来機能）"""
+    # 要約待ち（Batch API）の記事は結果を取り込んだときに通知する
+    articles = [article for article in articles if article.get('summary_status', 'done') == 'done']
+    slack_client = get_slack_client()
     if not slack_client or not articles:
         return
     
+    # 同じストーリーの記事は1件だけ通知
+    articles = collapse_story_clusters(articles)
+    
     try:
         article_list = []
         for article in articles:
@@ -469,92 +1107,91 @@ def send_slack_notification(articles):
         logger.error(f"Slack通知エラー: {e}")
         return False
 
-def get_recent_articles():
-    """最近の記事を取得（管理用）"""
+@metrics.timed('load_articles')
+def get_recent_articles(limit=API_PAGE_SIZE, after=None, fields=None):
+    """最近の記事を取得（管理用、afterに前のページの最後の記事IDを渡すと続きを返す）"""
     try:
-        docs = db.collection('ai_articles').order_by('created_at', direction=firestore.Query.DESCENDING).limit(20).stream()
+        fields = fields or list(LIST_ARTICLE_DEFAULTS)
         articles = []
         
-        for doc in docs:
-            data = doc.to_dict()
-            articles.append({
-                'title': data.get('title', ''),
-                'url': data.get('url', ''),
-                'source': data.get('source', ''),
-                'summary': data.get('summary', ''),
-                'source_lang': data.get('source_lang', ''),
-                'primary_source': data.get('primary_source'),
-                'used_in_summary': data.get('used_in_summary', False),
-                'date': data.get('date', '').isoformat() if data.get('date') else ''
-            })
+        for data in store.recent_articles(limit, after=after, fields=fields):
+            article = {'id': data['id']}
+            for field in fields:
+                value = data.get(field)
+                if field == 'primary_source':
+                    value = primary_source_urls(value)
+                if value is None:
+                    value = LIST_ARTICLE_DEFAULTS[field]
+                article[field] = value.isoformat() if isinstance(value, datetime) else value
+            articles.append(article)
         
         return articles
     except Exception as e:
         logger.error(f"記事取得エラー: {e}")
         return []
 
-def get_thread_history(days=7):
-    """過去のスレッド履歴を取得"""
+def thread_article_snapshot(article):
+    """スレッドに載せた記事の表示用スナップショット（記事が更新・削除されても履歴は変わらない）"""
+    created_at = article.get('created_at')
+    return {
+        'id': article['id'],
+        'title': article.get('title', ''),
+        'url': article.get('url', ''),
+        'summary': article.get('summary', ''),
+        'source': article.get('source', ''),
+        'primary_source': primary_source_urls(article.get('primary_source')),
+        'importance_score': article.get('importance_score', 3),
+        'created_at': created_at.isoformat() if isinstance(created_at, datetime) else created_at
+    }
+
+@metrics.timed('save_thread')
+def save_thread(thread, kind):
+    """生成したスレッドを threads に保存し、IDを返す（失敗時はNone）"""
+    try:
+        articles = sorted(thread['articles'], key=lambda x: -x.get('importance_score', 3))
+        return store.create_thread({
+            'kind': kind,  # summary / custom
+            'text': thread['text'],
+            'mode': thread['mode'],
+            'article_ids': [article['id'] for article in articles],
+            'articles': [thread_article_snapshot(article) for article in articles]
+        })
+    except Exception as e:
+        logger.error(f"スレッド保存エラー: {e}")
+        return None
+
+@metrics.timed('load_history')
+def get_thread_history(days=7, limit=THREAD_HISTORY_LIMIT, after=None):
+    """過去のスレッドを新しい順に取得（afterに前のページの最後のスレッドIDを渡すと続きを返す）"""
     try:
         cutoff_time = datetime.now(timezone.utc) - timedelta(days=days)
-        
-        # 使用済み記事を取得（最近のもの）
-        docs = db.collection('ai_articles').where(
-            filter=firestore.FieldFilter('used_in_summary', '==', True)
-        ).where(
-            filter=firestore.FieldFilter('created_at', '>=', cutoff_time)
-        ).order_by('created_at', direction=firestore.Query.DESCENDING).stream()
-        
-        threads = {}
-        for doc in docs:
-            data = doc.to_dict()
-            created_at = data.get('created_at')
-            if created_at:
-                # 6時間単位でグループ化（スレッド生成間隔に合わせる）
-                thread_key = created_at.replace(hour=(created_at.hour // 6) * 6, minute=0, second=0, microsecond=0)
-                
-                if thread_key not in threads:
-                    threads[thread_key] = []
-                
-                threads[thread_key].append({
-                    'id': doc.id,
-                    'title': data.get('title', ''),
-                    'url': data.get('url', ''),
-                    'summary': data.get('summary', ''),
-                    'source': data.get('source', ''),
-                    'primary_source': data.get('primary_source'),
-                    'importance_score': data.get('importance_score', 3),
-                    'created_at': created_at
-                })
-        
-        # 各スレッドを重要度順でソート
-        for thread_key in threads:
-            threads[thread_key].sort(key=lambda x: -x.get('importance_score', 3))
-        
-        return threads
+        # 本文は履歴に表示しないので読まない
+        return store.recent_threads(cutoff_time, limit, after=after, fields=['created_at', 'articles'])
     except Exception as e:
         logger.error(f"スレッド履歴取得エラー: {e}")
-        return {}
+        return []
 
+@metrics.timed('custom_thread')
 def create_custom_thread_from_selection(selected_article_ids):
     """選択された記事IDから新しいスレッドを作成"""
     try:
-        # 選択された記事を取得
+        # 選択された記事をまとめて取得
         selected_articles = []
-        for article_id in selected_article_ids:
-            doc = db.collection('ai_articles').document(article_id).get()
-            if doc.exists:
-                data = doc.to_dict()
-                selected_articles.append({
-                    'id': doc.id,
-                    'title': data.get('title', ''),
-                    'url': data.get('url', ''),
-                    'summary': data.get('summary', ''),
-                    'source': data.get('source', ''),
-                    'primary_source': data.get('primary_source'),
-                    'importance_score': data.get('importance_score', 3),
-                    'created_at': data.get('created_at')
-                })
+        for data in store.get_articles(selected_article_ids, fields=THREAD_ARTICLE_FIELDS):
+            # 要約待ちの記事はスレッドに載せない
+            if data.get('summary_status', 'done') != 'done':
+                continue
+            selected_articles.append({
+                'id': data['id'],
+                'title': data.get('title', ''),
+                'url': data.get('url', ''),
+                'summary': data.get('summary', ''),
+                'source': data.get('source', ''),
+                'primary_source': primary_source_urls(data.get('primary_source')),
+                'importance_score': data.get('importance_score', 3),
+                'cluster_id': data.get('cluster_id') or data['id'],
+                'created_at': data.get('created_at')
+            })
         
         if not selected_articles:
             return None
@@ -562,55 +1199,917 @@ def create_custom_thread_from_selection(selected_article_ids):
         # 重要度順でソート
         selected_articles.sort(key=lambda x: -x.get('importance_score', 3))
         
-        # スレッド生成
-        thread_summary = create_x_thread_summary(selected_articles)
+        # スレッド生成（選ばれた記事はすべて載せる。入力トークン予算を超える分だけ外して返す）
+        thread = build_x_thread(selected_articles, explicit=True)
+        used_ids = {article['id'] for article in thread['articles']} if thread else set()
         
         return {
-            'thread_summary': thread_summary,
-            'articles_used': len(selected_articles),
-            'articles': selected_articles
+            'thread_id': save_thread(thread, 'custom') if thread else None,
+            'thread_summary': thread['text'] if thread else None,
+            'articles_used': len(used_ids),
+            'articles_dropped': [article['id'] for article in selected_articles if article['id'] not in used_ids],
+            'articles': [thread_article_snapshot(article) for article in selected_articles]
         }
     except Exception as e:
         logger.error(f"カスタムスレッド作成エラー: {e}")
         return None
 
+def entry_to_candidate(entry, feed_config):
+    """フィードのエントリを処理候補の辞書に変換"""
+    title = entry.title
+    
+    # FeedBurner経由の記事は元記事のURLを使う
+    original_link = entry.get('feedburner_origlink')
+    if original_link:
+        remember_redirect(entry.link, original_link)
+    url = canonicalize_url(original_link or entry.link)
+    content = entry.get('summary', '') or entry.get('description', '')
+    
+    return {
+        'title': title,
+        'url': url,
+        'content': content,
+        'source': feed_config["name"],
+        'source_lang': feed_config["lang"],
+        'prior': feed_config.get("prior", 0),
+        'hash': create_article_hash(url, title),
+        'fingerprint': story_fingerprint(title, content),
+        'feed_url': feed_config["url"]
+    }
+
+def record_feed_read(feed_reads, fetch_result):
+    """フィードごとの読み込みバイト数・保持した最大バイト数・パーサーを集計"""
+    if not fetch_result.get('parser'):
+        return
+    feed_reads['bytes_read'] += fetch_result['bytes_read']
+    feed_reads[fetch_result['parser']] += 1
+    feed_reads['per_feed'][fetch_result['feed']['name']] = {
+        'bytes_read': fetch_result['bytes_read'],
+        'peak_bytes': fetch_result['peak_bytes'],
+        'parser': fetch_result['parser']
+    }
+
+def peak_rss_mb():
+    """このプロセスの最大常駐メモリ（MB）"""
+    try:
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except (ImportError, OSError):
+        return None
+
+def restore_candidate(pending):
+    """前回の実行で保存した未処理の候補を処理候補の辞書に戻す"""
+    candidate = dict(pending)
+    candidate['fingerprint'] = story_fingerprint(candidate['title'], candidate['content'])
+    return candidate
+
+def analyze_candidate(candidate, classified=False):
+    """候補記事を要約して (要約, 重要度, 1次情報) を返す（AI関連外ならNone）
+
+    classified=True の場合は一括判定済みとして個別のAI関連判定を省略する。
+    """
+    title = candidate['title']
+    content = candidate['content']
+    
+    # 判定・要約・1次情報抽出を1回の呼び出しで実行（1次情報は本文のリンクをローカルで振り分けてから）
+    local_sources, ambiguous = find_primary_sources(content, candidate['url'])
+    analysis = analyze_article_with_openai(title, content, candidate['source_lang'], ambiguous) \
+        if LLM_COMBINED_MODE else None
+    
+    if analysis is not None:
+        if not analysis['is_ai']:
+            return None
+        # 本文のリンクから許可リストで見つけたものを優先し、LLMが候補から選んだリンクを後に並べる
+        return analysis['summary'], analysis['importance_score'], \
+            rank_primary_sources(local_sources + confirm_llm_sources(analysis['primary_sources'], ambiguous),
+                                 candidate['url'])
+    
+    # 従来の個別呼び出しにフォールバック
+    if not classified and not is_ai_related_article(title, content):
+        return None
+    
+    # 要約生成
+    summary, importance_score = summarize_with_openai(title, content, candidate['source_lang'])
+    
+    # 1次情報抽出
+    primary_source = extract_primary_sources(content, title, candidate['url'])
+    
+    return summary, importance_score, primary_source
+
+@metrics.timed('cluster')
+def assign_story_clusters(candidates, cluster_index):
+    """候補ごとに既存のストーリークラスタと、同じバッチ内で先に出た近似重複を調べる
+
+    (既存クラスタIDのリスト, バッチ内の代表候補のインデックスのリスト) を返す。
+    """
+    max_distance = cluster_index.max_distance if cluster_index else SIMHASH_MAX_DISTANCE
+    existing_clusters = [None] * len(candidates)
+    leaders = [None] * len(candidates)
+    
+    for index, candidate in enumerate(candidates):
+        if cluster_index:
+            existing_clusters[index] = cluster_index.find(candidate['fingerprint'])
+        if existing_clusters[index]:
+            continue
+        
+        for other in range(index):
+            if existing_clusters[other] is None and leaders[other] is None and \
+                    hamming_distance(candidate['fingerprint'], candidates[other]['fingerprint']) <= max_distance:
+                leaders[index] = other
+                break
+    
+    return existing_clusters, leaders
+
+def save_candidate(candidate, summary, importance_score, primary_source, cluster_id=None, writer=None,
+                   summary_status=None):
+    """候補記事を保存し、通知・レスポンス用の辞書を返す（保存できなければNone）"""
+    if not save_to_firestore(candidate['title'], candidate['url'], summary, candidate['source'], candidate['hash'],
+                             candidate['source_lang'], primary_source, importance_score, cluster_id, writer,
+                             summary_status):
+        return None
+    
+    return {
+        'id': candidate['hash'],
+        'title': candidate['title'],
+        'url': candidate['url'],
+        'source': candidate['source'],
+        'summary': summary,
+        'primary_source': primary_source,
+        'importance_score': importance_score,
+        'cluster_id': cluster_id or candidate['hash'],
+        'summary_status': summary_status or 'done'
+    }
+
+@metrics.timed('batch_submit')
+def submit_analysis_batch(candidates, indices):
+    """AI関連と判定済みの候補の要約・1次情報抽出をBatch APIに投入し、投入できた候補のインデックスを返す
+
+    LLMキャッシュにある候補と投入に失敗した分は含めない（呼び出し側で同期呼び出しに回す）。
+    """
+    jobs = BatchJobs(store, llm)
+    uncached = []
+    for index in indices:
+        candidate = candidates[index]
+        cache_key = analysis_cache_key(candidate['title'], candidate['content'], candidate['source_lang'])
+        hit, _ = get_llm_cache().lookup(cache_key)
+        if not hit:
+            uncached.append((index, cache_key))
+    
+    submitted = set()
+    for start in range(0, len(uncached), LLM_BATCH_MAX_REQUESTS):
+        chunk = uncached[start:start + LLM_BATCH_MAX_REQUESTS]
+        requests_ = []
+        items = {}
+        for index, cache_key in chunk:
+            candidate = candidates[index]
+            local_sources, ambiguous = find_primary_sources(candidate['content'], candidate['url'])
+            requests_.append((candidate['hash'], analysis_request(
+                candidate['title'], candidate['content'], candidate['source_lang'], ambiguous)))
+            items[candidate['hash']] = {'cache_key': cache_key, 'title': candidate['title'],
+                                        'url': candidate['url'], 'source': candidate['source'],
+                                        'primary_sources': local_sources, 'source_candidates': ambiguous}
+        try:
+            jobs.submit(requests_, items, 'article_analysis')
+        except Exception as e:
+            logger.error(f"Batch API投入エラー（同期呼び出しで処理）: {e}")
+            continue
+        submitted.update(index for index, _ in chunk)
+    
+    metrics.count('batch_requests_submitted', len(submitted))
+    return submitted
+
+def process_candidates(candidates, stats, cluster_index=None, deferred=None):
+    """候補記事を判定・要約してFirestoreに保存し、保存した記事の一覧を返す
+
+    既存のストーリークラスタや同じバッチ内の記事と近似重複する記事は、
+    LLMを呼ばずにクラスタの要約を使い回す。レート制限で要約できなかった記事は
+    deferred に追加する（呼び出し側で次回に持ち越す）。
+    """
+    if not candidates:
+        return []
+    
+    existing_clusters, leaders = assign_story_clusters(candidates, cluster_index)
+    new_stories = [index for index in range(len(candidates))
+                   if existing_clusters[index] is None and leaders[index] is None]
+    
+    # ローカル事前フィルタで採用・除外が明らかな記事はLLM判定を省略
+    verdicts = {index: None for index in new_stories}
+    prefilter_accepted = set()
+    if PREFILTER_MODE:
+        with metrics.span('prefilter'):
+            for index in new_stories:
+                candidate = candidates[index]
+                decision = prefilter_article(candidate['title'], candidate['content'], candidate['prior'])
+                stats[f'prefilter_{decision}'] = stats.get(f'prefilter_{decision}', 0) + 1
+                if decision == 'accept':
+                    verdicts[index] = True
+                    prefilter_accepted.add(index)
+                elif decision == 'reject':
+                    verdicts[index] = False
+    
+    ambiguous = [index for index in new_stories if verdicts[index] is None]
+    if CLASSIFY_BATCH_MODE and ambiguous:
+        batch_verdicts = classify_articles_batch(
+            [(candidates[index]['title'], candidates[index]['content']) for index in ambiguous], stats=stats
+        )
+        for index, verdict in zip(ambiguous, batch_verdicts):
+            verdicts[index] = verdict
+    
+    # AI関連と判定済みの記事の要約・1次情報抽出はBatch APIに回し、要約待ちとして保存する
+    batched = set()
+    if LLM_BATCH_MODE:
+        batched = submit_analysis_batch(candidates, [index for index in new_stories if verdicts[index] is True])
+        stats['batched'] = stats.get('batched', 0) + len(batched)
+    
+    # 要約はレート制限の範囲で並行に実行
+    for index in new_stories:
+        if verdicts[index] is False:
+            logger.info(f"AI関連外記事をスキップ: {candidates[index]['title']}")
+    to_analyze = [index for index in new_stories if verdicts[index] is not False and index not in batched]
+    if not LLM_COMBINED_MODE:
+        # 採用した記事でAI関連判定を省けるのは個別呼び出しの場合だけ（一括分析・Batch APIでは判定も兼ねる）
+        stats['prefilter_classify_skipped'] = (stats.get('prefilter_classify_skipped', 0)
+                                               + len(prefilter_accepted.intersection(to_analyze)))
+    analyses = dict(zip(to_analyze, llm.map(
+        lambda index: analyze_candidate(candidates[index], classified=verdicts[index] is True), to_analyze
+    )))
+    
+    # 保存は一括書き込みにまとめ、最後にコミットする
+    writer = store.writer()
+    processed_articles = []
+    saved = {}
+    postponed = set()
+    for index in sorted(batched):
+        candidate = candidates[index]
+        # 本文のリンクから見つかった1次情報は要約を待たずに保存する
+        article = save_candidate(candidate, '', BATCH_PENDING_IMPORTANCE,
+                                 find_primary_sources(candidate['content'], candidate['url'])[0],
+                                 writer=writer, summary_status='pending')
+        if article:
+            saved[index] = article
+            processed_articles.append(article)
+            if cluster_index:
+                try:
+                    cluster_index.create_cluster(candidate['hash'], candidate['fingerprint'], article, writer)
+                except Exception as e:
+                    logger.error(f"ストーリークラスタ作成エラー: {e}")
+    
+    for index in to_analyze:
+        candidate = candidates[index]
+        title = candidate['title']
+        
+        analysis, error = analyses[index]
+        if error is not None:
+            if isinstance(error, LLMUnavailable):
+                logger.warning(f"レート制限のため次回に持ち越し: {title}")
+                postponed.add(index)
+            else:
+                logger.error(f"記事処理エラー ({title}): {error}")
+            continue
+        if analysis is None:
+            logger.info(f"AI関連外記事をスキップ: {title}")
+            continue
+        
+        logger.info(f"AI関連記事を処理中: {title}")
+        
+        # Firestoreに保存し、新しいストーリークラスタとして登録
+        article = save_candidate(candidate, *analysis, writer=writer)
+        if article:
+            saved[index] = article
+            processed_articles.append(article)
+            if cluster_index:
+                try:
+                    cluster_index.create_cluster(candidate['hash'], candidate['fingerprint'], article, writer)
+                except Exception as e:
+                    logger.error(f"ストーリークラスタ作成エラー: {e}")
+    
+    # 近似重複の記事はクラスタの要約を使い回す
+    for index, candidate in enumerate(candidates):
+        if leaders[index] is not None:
+            if leaders[index] in postponed:
+                postponed.add(index)
+                continue
+            leader = saved.get(leaders[index])
+            if not leader:
+                continue
+            cluster_id = leader['cluster_id']
+            cluster = leader
+        elif existing_clusters[index]:
+            cluster_id = existing_clusters[index]
+            try:
+                cluster = cluster_index.get_cluster(cluster_id)
+            except Exception as e:
+                logger.error(f"ストーリークラスタ取得エラー: {e}")
+                cluster = None
+            if not cluster:
+                continue
+        else:
+            continue
+        
+        # 要約待ちのストーリーの記事は要約待ちで保存し、結果の取り込み時にクラスタの全記事を埋める
+        summary_status = cluster.get('summary_status', 'done')
+        if summary_status not in ('done', 'pending'):
+            continue
+        
+        logger.info(f"既存ストーリーの記事として保存: {candidate['title']}")
+        article = save_candidate(candidate, cluster['summary'], cluster['importance_score'],
+                                 primary_source_urls(cluster['primary_source']), cluster_id, writer,
+                                 summary_status if summary_status == 'pending' else None)
+        if article:
+            stats['cluster_reused'] = stats.get('cluster_reused', 0) + 1
+            processed_articles.append(article)
+            if cluster_index:
+                try:
+                    cluster_index.add_member(cluster_id, candidate['hash'], writer)
+                except Exception as e:
+                    logger.error(f"ストーリークラスタ更新エラー: {e}")
+    
+    # 書き込みに失敗した記事は結果から除く
+    with metrics.span('save'):
+        failed = writer.flush()
+    stats['firestore_commits'] = stats.get('firestore_commits', 0) + writer.stats['commits']
+    processed_articles = [
+        article for article in processed_articles
+        if article_path(article['id']) not in failed
+    ]
+    logger.info(f"Firestoreに保存完了: {len(processed_articles)}件（コミット{writer.stats['commits']}回）")
+    
+    if deferred is not None:
+        deferred.extend(candidates[index] for index in sorted(postponed))
+    stats['deferred'] = stats.get('deferred', 0) + len(postponed)
+    return processed_articles
+
+def flush_candidates(candidates, pending_cache_states, stats, cluster_index=None, scheduler=None, deferred=None):
+    """溜まった候補のうち締め切りまでに処理できる分を処理し、対象フィードのキャッシュを更新"""
+    limit = scheduler.units_affordable() if scheduler else len(candidates)
+    batch = candidates[:limit]
+    
+    started = time.monotonic()
+    processed_articles = process_candidates(batch, stats, cluster_index, deferred) if batch else []
+    if scheduler:
+        scheduler.record(len(batch), time.monotonic() - started)
+    del candidates[:len(batch)]
+    
+    # 候補をすべて処理し終えてからキャッシュを更新（残りがあれば保留キューの保存後に更新）
+    if not candidates and not deferred:
+        save_feed_cache_states(pending_cache_states)
+    return processed_articles
+
+def save_feed_cache_states(pending_cache_states):
+    """取得済みフィードのキャッシュ状態を保存"""
+    for feed_url, cache_state in pending_cache_states:
+        try:
+            get_feed_cache().save(feed_url, cache_state)
+        except Exception as e:
+            logger.error(f"フィードキャッシュ保存エラー ({feed_url}): {e}")
+    pending_cache_states.clear()
+
+def batch_article_update(analysis, item):
+    """Batch APIの結果から記事・クラスタに書き込むフィールドを作る（analysis=None は検証に失敗した記事）"""
+    if analysis is None:
+        return {'summary_status': 'failed'}
+    if not analysis['is_ai']:
+        return {'summary_status': 'excluded'}
+    return {
+        'summary': analysis['summary'],
+        'importance_score': analysis['importance_score'],
+        'primary_source': rank_primary_sources(
+            item.get('primary_sources', [])
+            + confirm_llm_sources(analysis['primary_sources'], item.get('source_candidates', [])),
+            item['url']),
+        'summary_status': 'done'
+    }
+
+def ingest_batch_job(jobs, job, outputs, writer, scheduler=None):
+    """1つのジョブの結果を記事とストーリークラスタに反映し、(要約できた記事の一覧, 状態ごとの件数, 持ち越す項目) を返す
+
+    結果がない・検証に失敗したリクエストは投入したときの本文で同期呼び出しをやり直す。
+    やり直しの結果も検証に失敗した記事と、投入した本文が見つからない記事は failed にする。
+    レート制限・接続エラーなどでやり直せなかった記事と、締め切りまでにやり直せない記事は
+    pending のまま残し、持ち越す項目として返す（次回また取り込む）。
+    """
+    items = job.get('items') or {}
+    analyses = {custom_id: parse_article_analysis(outputs[custom_id]) for custom_id in items if custom_id in outputs}
+    
+    missing = [custom_id for custom_id in items if analyses.get(custom_id) is None]
+    unresolved = {}
+    if missing:
+        logger.warning(f"Batch APIの結果がない{len(missing)}件を同期呼び出しで処理")
+        bodies = jobs.input_bodies(job)
+        for custom_id in missing:
+            if custom_id not in bodies:
+                logger.error(f"Batch APIに投入した本文が見つかりません: {custom_id}")
+        missing = [custom_id for custom_id in missing if custom_id in bodies]
+        
+        # 締め切りまでにやり直せない分は次回に持ち越す
+        affordable = scheduler.units_affordable() if scheduler else len(missing)
+        for custom_id in missing[affordable:]:
+            unresolved[custom_id] = items[custom_id]
+        missing = missing[:affordable]
+        
+        started = time.monotonic()
+        retried = llm.map(
+            lambda custom_id: parse_article_analysis(llm.chat(**bodies[custom_id]).choices[0].message.content),
+            missing
+        )
+        if scheduler:
+            scheduler.record(len(missing), time.monotonic() - started)
+        for custom_id, (analysis, error) in zip(missing, retried):
+            if error is not None:
+                logger.error(f"記事処理エラー（次回やり直し） ({items[custom_id]['title']}): {error}")
+                unresolved[custom_id] = items[custom_id]
+                continue
+            analyses[custom_id] = analysis
+    
+    # 同じストーリーの記事を探すため、クラスタはまとめて読む
+    clusters = store.get_documents(CLUSTER_COLLECTION, list(items))
+    
+    ingested = []
+    counts = {}
+    for custom_id, item in items.items():
+        if custom_id in unresolved:
+            counts['pending'] = counts.get('pending', 0) + 1
+            continue
+        analysis = analyses.get(custom_id)
+        if analysis is not None:
+            get_llm_cache().store(item['cache_key'], analysis, 'analyze')
+        update = batch_article_update(analysis, item)
+        
+        # 同じストーリーとして要約待ちで保存した記事にも同じ要約を書き込む
+        cluster = clusters.get(custom_id)
+        for article_id in (cluster or {}).get('article_ids') or [custom_id]:
+            writer.update_article(article_id, update)
+        if cluster:
+            writer.set_document(CLUSTER_COLLECTION, custom_id, update, merge=True)
+        
+        counts[update['summary_status']] = counts.get(update['summary_status'], 0) + 1
+        if update['summary_status'] == 'done':
+            ingested.append(dict(update, id=custom_id, title=item['title'], url=item['url'],
+                                 source=item['source'], cluster_id=custom_id))
+    return ingested, counts, unresolved
+
+@metrics.timed('batch_ingest')
+def ingest_analysis_batches(notify=True, scheduler=None):
+    """完了したBatch APIのジョブの結果を取り込み、実行結果を返す（処理中のジョブはそのまま残す）
+
+    scheduler を渡すと締め切りが近づいた時点で取り込みをやめ、残りのジョブは次回に回す。
+    """
+    jobs = BatchJobs(store, llm)
+    result = {'jobs_running': 0, 'jobs_finished': 0, 'articles': [], 'statuses': {}}
+    try:
+        open_jobs = jobs.open_jobs()
+    except Exception as e:
+        logger.error(f"Batch APIのジョブ一覧の読み取りエラー: {e}")
+        return result
+    
+    for batch_id in sorted(open_jobs):
+        if scheduler and scheduler.expired():
+            result['jobs_running'] += 1
+            continue
+        try:
+            polled = jobs.poll(batch_id)
+            if polled is None:
+                result['jobs_running'] += 1
+                continue
+            status, outputs, usages = polled
+            job = jobs.get_job(batch_id) or {}
+            if not job.get('usage_recorded'):
+                llm.record_batch_usage(OPENAI_MODEL, usages)
+            
+            writer = store.writer()
+            ingested, counts, unresolved = ingest_batch_job(jobs, job, outputs, writer, scheduler)
+            failed = writer.flush()
+            if failed:
+                # 書き込めなかった分は次回もう一度取り込む
+                logger.error(f"Batch APIの結果の書き込みに失敗: {batch_id} ({len(failed)}件)")
+                continue
+            
+            if unresolved:
+                # やり直せなかった記事だけを残してジョブを開いたままにする
+                jobs.retain(batch_id, job, unresolved)
+                result['jobs_running'] += 1
+                logger.warning(f"Batch APIの結果を一部持ち越し: {batch_id} ({len(unresolved)}件)")
+            else:
+                jobs.close(batch_id, status, {'article_statuses': counts})
+                result['jobs_finished'] += 1
+            for summary_status, count in counts.items():
+                result['statuses'][summary_status] = result['statuses'].get(summary_status, 0) + count
+            result['articles'].extend(ingested)
+            logger.info(f"Batch APIの結果を取り込み: {batch_id} ({len(ingested)}件)")
+        except Exception as e:
+            logger.error(f"Batch APIの結果の取り込みエラー ({batch_id}): {e}")
+    
+    metrics.count('batch_articles_ingested', len(result['articles']))
+    if result['articles'] and notify:
+        send_slack_notification(result['articles'])
+    return result
+
+def collect_articles(shard=None, notify=True):
+    """フィードから新着記事を収集・要約して保存し、実行結果を返す
+
+    shard=(i, n) を指定するとi番目のシャードが担当するフィードだけを処理する。
+    notify=False の場合はSlack通知を送らない（コーディネーターがまとめて通知する）。
+    """
+    # feedparser・requests は収集でしか使わないので、ここで読み込む
+    from feed_fetcher import fetch_feeds
+    
+    feeds = shard_feeds(RSS_FEEDS, *shard) if shard else RSS_FEEDS
+    shard_label = f"{shard[0]}/{shard[1]}" if shard else None
+    logger.info(f"AI関連RSS要約処理を開始 (シャード: {shard_label or '全体'}, {len(feeds)}フィード)")
+    processed_hashes = set()
+    processed_articles = []
+    feed_status_counts = {}
+    feed_reads = {'bytes_read': 0, 'stream': 0, 'feedparser': 0, 'per_feed': {}}
+    stats = {'candidates': 0, 'classification_requests': 0}
+    deferred = []
+    llm.reset_stats()
+    get_llm_cache().reset_stats()
+    
+    # 前回の続きの位置・未処理の候補・1件あたりの処理コストを読み込む
+    cursor = CollectCursor(store, f"cursor-{shard[0]}of{shard[1]}" if shard else 'cursor')
+    try:
+        cursor.load()
+    except Exception as e:
+        logger.error(f"収集カーソル読み取りエラー: {e}")
+    scheduler = RunScheduler(COLLECT_DEADLINE_SECONDS, unit_cost=cursor.unit_cost)
+    
+    # 前回までに投入したBatch APIのジョブが終わっていれば結果を取り込む（シャード実行では最初のシャードだけ）
+    # 取り込みのやり直しにかかる時間も収集の締め切りに含める
+    batch_result = None
+    if LLM_BATCH_MODE and (not shard or shard[0] == 0):
+        batch_result = ingest_analysis_batches(notify, scheduler)
+    start_index = cursor.next_feed_index % len(feeds) if feeds else 0
+    completed_feed_urls = set()
+    
+    try:
+        cache_states = get_feed_cache().load_all([feed_config["url"] for feed_config in feeds])
+    except Exception as e:
+        logger.error(f"フィードキャッシュ読み取りエラー: {e}")
+        cache_states = {}
+    
+    # 近似重複判定用のストーリークラスタ一覧
+    try:
+        cluster_index = StoryClusterIndex(store).load()
+    except Exception as e:
+        logger.error(f"ストーリークラスタ読み取りエラー: {e}")
+        cluster_index = None
+    
+    # 一括判定のため、候補記事はバッチサイズに達するまで溜めてから処理
+    # 前回処理しきれなかった候補を先頭に入れ、今回の新着より先に処理する
+    candidates = []
+    processed_hashes.update(find_processed_hashes(pending['hash'] for pending in cursor.pending))
+    for pending in cursor.pending:
+        if pending.get('hash') in processed_hashes:
+            continue
+        processed_hashes.add(pending['hash'])
+        candidates.append(restore_candidate(pending))
+    stats['resumed'] = len(candidates)
+    pending_cache_states = []
+    
+    # フィードの稼働状況から今回取得するフィードを決める（失敗が続くフィード・更新の少ないフィードは見送る）
+    health = FeedHealthTracker(store)
+    try:
+        health.load()
+    except Exception as e:
+        logger.error(f"フィード稼働状況の読み取りエラー: {e}")
+    due_feeds, waiting_feeds = health.split_due(rotate_feeds(feeds, start_index))
+    # 見送ったフィードは取得済みとして扱い、収集カーソルを先へ進める
+    completed_feed_urls.update(feed_config["url"] for feed_config in waiting_feeds)
+    if waiting_feeds:
+        logger.info(f"取得時刻前のため{len(waiting_feeds)}フィードを見送り")
+    
+    # 前回止まったフィードから順に並行取得し、取得できたものから順に処理
+    for fetch_result in fetch_feeds(due_feeds, scheduler.fetch_deadline(),
+                                    cache_states=cache_states,
+                                    max_entries=ENTRIES_PER_FEED if FEED_STREAM_MODE else None):
+        feed_config = fetch_result['feed']
+        feed_name = feed_config["name"]
+        status = fetch_result['status']
+        feed_status_counts[status] = feed_status_counts.get(status, 0) + 1
+        record_feed_read(feed_reads, fetch_result)
+        # 取得は並行に行うので、フィードごとの所要時間を取得ステージのスパンとして記録する
+        metrics.record_span('fetch', fetch_result['elapsed'])
+        metrics.count('feeds_fetched', status=status)
+        
+        # 締め切りで取得できなかったフィードは次回ここから再開する
+        if status != 'timeout':
+            completed_feed_urls.add(feed_config["url"])
+        
+        # 収集全体の締め切りで取得しなかったフィード（elapsed=0）はフィードの失敗として数えない
+        if status != 'ok' and (status != 'timeout' or fetch_result['elapsed']):
+            health.record(feed_config, status, fetch_result['elapsed'], error=fetch_result['error'])
+        
+        if status in ('not_modified', 'unchanged'):
+            # 前回から変化なし: パース・重複チェック・LLM呼び出しをすべて省略
+            logger.info(f"RSS更新なし: {feed_name} ({status})")
+            continue
+        elif status == 'bozo':
+            logger.warning(f"RSS解析警告: {feed_name}")
+            continue
+        elif status != 'ok':
+            logger.warning(f"RSS取得失敗 ({feed_name}): {status} {fetch_result['error']}")
+            continue
+        
+        logger.info(f"RSS取得完了: {feed_name} ({fetch_result['elapsed']:.2f}秒, "
+                    f"{fetch_result['bytes_read'] / 1024:.0f}KB, {fetch_result['parser']})")
+        
+        try:
+            # 最新の記事を候補にする
+            feed_candidates = [entry_to_candidate(entry, feed_config)
+                               for entry in fetch_result['feed_data'].entries[:ENTRIES_PER_FEED]]
+            
+            # 今回の候補分だけ処理済みかを確認
+            processed_hashes.update(find_processed_hashes(candidate['hash'] for candidate in feed_candidates))
+            
+            new_entries = 0
+            for candidate in feed_candidates:
+                # 重複チェック
+                if candidate['hash'] in processed_hashes:
+                    continue
+                processed_hashes.add(candidate['hash'])
+                candidates.append(candidate)
+                stats['candidates'] += 1
+                new_entries += 1
+            
+            pending_cache_states.append((feed_config["url"], fetch_result['cache_state']))
+            health.record(feed_config, status, fetch_result['elapsed'], new_entries)
+        except Exception as e:
+            logger.error(f"フィード処理エラー ({feed_name}): {e}")
+            health.record(feed_config, 'error', fetch_result['elapsed'], error=str(e))
+            continue
+        
+        if len(candidates) >= CLASSIFY_BATCH_SIZE or not CLASSIFY_BATCH_MODE:
+            processed_articles.extend(flush_candidates(candidates, pending_cache_states, stats, cluster_index, scheduler, deferred))
+        
+        if scheduler.expired():
+            logger.warning(f"締め切りが近いため収集を中断 (経過 {scheduler.elapsed():.0f}秒)")
+            break
+    
+    processed_articles.extend(flush_candidates(candidates, pending_cache_states, stats, cluster_index, scheduler, deferred))
+    
+    # 次回の開始位置と未処理の候補を保存してから、残りのフィードキャッシュを更新
+    # レート制限で持ち越した候補を先頭にして保存
+    candidates[:0] = deferred
+    next_feed_index = next_start_index(feeds, start_index, completed_feed_urls)
+    with metrics.span('save_state'):
+        try:
+            queued = cursor.save(next_feed_index, candidates, scheduler.unit_cost)
+            if queued < len(candidates):
+                # 保存しきれなかった候補があるフィードは次回もう一度取得する
+                logger.warning(f"保留キューの上限超過: {len(candidates) - queued}件は次回再取得")
+                pending_cache_states.clear()
+        except Exception as e:
+            logger.error(f"収集カーソル保存エラー: {e}")
+            queued = 0
+            pending_cache_states.clear()
+        save_feed_cache_states(pending_cache_states)
+        try:
+            health.save()
+        except Exception as e:
+            logger.error(f"フィード稼働状況の保存エラー: {e}")
+        
+        if cluster_index:
+            try:
+                cluster_index.save()
+            except Exception as e:
+                logger.error(f"ストーリークラスタ保存エラー: {e}")
+    
+    # 新しい記事があれば個別通知
+    if processed_articles and notify:
+        send_slack_notification(processed_articles)
+    
+    # 永続キャッシュの期限切れ・上限超過分を削除
+    get_llm_cache().evict()
+    
+    result = {
+        'status': 'success',
+        'action': 'collect',
+        'shard': shard_label,
+        'new_ai_articles': len(processed_articles),
+        'articles': processed_articles,
+        'total_feeds_checked': len(completed_feed_urls),
+        'total_feeds': len(feeds),
+        'next_feed_index': next_feed_index,
+        'resumed_candidates': stats['resumed'],
+        'queued_candidates': queued,
+        'deferred_candidates': stats.get('deferred', 0),
+        'estimated_seconds_per_candidate': round(scheduler.unit_cost, 2),
+        'elapsed_seconds': round(scheduler.elapsed(), 1),
+        'feed_status': feed_status_counts,
+        'feeds_waiting': len(waiting_feeds),
+        'feeds_circuit_open': sum(1 for feed_config in feeds if health.state(feed_config["url"]).get('circuit') == 'open'),
+        'feed_reads': feed_reads,
+        'peak_rss_mb': peak_rss_mb(),
+        'feeds_skipped_unchanged': feed_status_counts.get('not_modified', 0) + feed_status_counts.get('unchanged', 0),
+        'candidates': stats['candidates'],
+        'classification_requests': stats['classification_requests'],
+        'llm_cache': get_llm_cache().snapshot_stats(),
+        'llm_usage': llm.snapshot_stats(),
+        'cluster_reused': stats.get('cluster_reused', 0),
+        'batched_candidates': stats.get('batched', 0),
+        'firestore_commits': stats.get('firestore_commits', 0),
+        'prefilter': {
+            'accepted': stats.get('prefilter_accept', 0),
+            'rejected': stats.get('prefilter_reject', 0),
+            'ambiguous': stats.get('prefilter_ambiguous', 0),
+            # 事前フィルタで確定し、LLMのAI関連判定を行わずに済んだ件数
+            # （除外した記事と、個別呼び出しで判定を省いた採用記事）
+            'llm_classifications_saved': stats.get('prefilter_reject', 0) + stats.get('prefilter_classify_skipped', 0)
+        },
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    }
+    
+    if batch_result is not None:
+        result['batch_ingest'] = dict(batch_result, articles=len(batch_result['articles']))
+        if not notify:
+            # 通知しなかった取り込み分はコーディネーターがまとめて通知する
+            result['batch_articles'] = batch_result['articles']
+    
+    metrics.count('candidates', stats['candidates'])
+    metrics.count('articles_saved', len(processed_articles))
+    logger.info(f"処理完了: {len(processed_articles)}件のAI関連記事")
+    return result
+
+def coordinate_collect(shard_count, worker_url=None):
+    """フィードをシャードに分けてワーカーを並列実行し、結果をまとめて1回だけ通知する"""
+    logger.info(f"シャード分割収集を開始: {shard_count}シャード")
+    started = time.monotonic()
+    
+    if FANOUT_DISPATCHER == 'local' or not worker_url:
+        dispatcher = LocalQueueDispatcher(lambda index, count: collect_articles((index, count), notify=False))
+    else:
+        dispatcher = HttpDispatcher(worker_url)
+    
+    shard_results = dispatcher.dispatch(shard_count)
+    succeeded = [result for result, error in shard_results if error is None and result.get('status') == 'success']
+    failed_shards = [
+        {'shard': f"{index}/{shard_count}", 'error': str(error) if error else (result or {}).get('message')}
+        for index, (result, error) in enumerate(shard_results)
+        if error is not None or result.get('status') != 'success'
+    ]
+    
+    merged = merge_results(succeeded)
+    articles = merged.get('articles', [])
+    # Batch APIの結果を取り込んだシャードは、要約できた記事を通知せずに返す
+    notified = articles + merged.get('batch_articles', [])
+    if notified:
+        send_slack_notification(notified)
+    
+    merged.update({
+        'status': 'success' if succeeded else 'error',
+        'action': 'coordinate',
+        'shards': shard_count,
+        'failed_shards': failed_shards,
+        'elapsed_seconds': round(time.monotonic() - started, 1),
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    })
+    logger.info(f"シャード分割収集が完了: {len(articles)}件（失敗シャード{len(failed_shards)}件）")
+    return merged
+
+def get_page_params(request, allowed_fields, default_limit):
+    """ページングのパラメータ（limit・after・fields）を取得
+
+    limit は1〜API_MAX_PAGE_SIZE に収める。fields はカンマ区切りで、
+    allowed_fields にないフィールドは無視する（有効なものがなければNone）。
+    """
+    try:
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        limit = default_limit
+    limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+    requested = {field.strip() for field in request.args.get('fields', '').split(',')}
+    fields = [field for field in allowed_fields if field in requested]
+    return limit, request.args.get('after') or None, fields or None
+
+def cached_json_response(request, payload):
+    """GET用のJSONレスポンス（ETag・Cache-Control付き、If-None-Matchが一致すれば304、対応クライアントにはgzip）"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    headers = {
+        'Content-Type': 'application/json; charset=utf-8',
+        'ETag': etag,
+        'Cache-Control': f'private, max-age={API_CACHE_MAX_AGE}',
+        'Vary': 'Accept-Encoding'
+    }
+    
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        return '', 304, headers
+    
+    if len(body) >= API_GZIP_MIN_BYTES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    return body, 200, headers
+
+def get_selected_ids(request):
+    """選択された記事IDを取得
+
+    大量に選択するとURLが長くなりすぎるため、クエリパラメータ（ids=a,b,c）のほかに
+    POSTの本文（JSONの {"ids": [...]} またはフォームの ids=a,b,c）でも受け付ける。
+    """
+    ids = request.args.get('ids', '')
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and isinstance(body.get('ids'), list):
+            ids = body['ids']
+        else:
+            ids = request.form.get('ids', ids)
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    return [str(id).strip() for id in ids if str(id).strip()]
+
+def attach_profile(response, profile):
+    """JSONレスポンスに profile（リクエストの内訳）を追加する（内訳は毎回変わるのでETagは外す）"""
+    body, status = response[:2]
+    headers = dict(response[2]) if len(response) > 2 else {}
+    if headers.pop('Content-Encoding', None) == 'gzip':
+        body = gzip.decompress(body)
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return response
+    if not isinstance(payload, dict):
+        return response
+    
+    payload['profile'] = profile
+    headers.pop('ETag', None)
+    headers['Cache-Control'] = 'no-store'
+    return json.dumps(payload, ensure_ascii=False, indent=2, default=str), status, headers
+
 @functions_framework.http
 def rss_summarizer(request):
-    """メインのRSS要約関数"""
+    """メインのRSS要約関数
+
+    ステージごとの所要時間・トークン数・Firestoreの読み書き件数を計測して構造化ログに出力し、
+    profile=1 が指定されていればその内訳をレスポンスに含める。
+    """
+    # GETパラメータで機能を分岐
+    action = request.args.get('action', 'collect')
+    trace = metrics.start_request(action)
+    with metrics.span(action):
+        response = dispatch_action(request, action)
+    profile = metrics.finish_request(trace, response[1])
+    
+    if request.args.get('profile') == '1':
+        return attach_profile(response, profile)
+    return response
+
+def dispatch_action(request, action):
+    """action に応じた処理を実行し、レスポンスを返す"""
     try:
-        # GETパラメータで機能を分岐
-        action = request.args.get('action', 'collect')
-        
         if action == 'list':
-            articles = get_recent_articles()
-            return json.dumps({
+            limit, after, fields = get_page_params(request, list(LIST_ARTICLE_DEFAULTS), API_PAGE_SIZE)
+            articles = get_recent_articles(limit, after, fields)
+            return cached_json_response(request, {
                 'status': 'success',
                 'articles': articles,
-                'count': len(articles)
-            }, ensure_ascii=False, indent=2), 200
+                'count': len(articles),
+                'next_after': articles[-1]['id'] if len(articles) == limit else None
+            })
+        
+        elif action == 'metrics':
+            # このインスタンスの起動からの累計と、アクションごとの直近のリクエストの内訳
+            return json.dumps(dict(metrics.snapshot(), status='success', action='metrics'),
+                              ensure_ascii=False, indent=2, default=str), 200
+        
+        elif action == 'feeds':
+            # フィードごとの稼働状況（サーキットブレーカー・次回の取得時刻など）
+            feed_report = FeedHealthTracker(store).load().report(RSS_FEEDS)
+            return cached_json_response(request, {
+                'status': 'success',
+                'action': 'feeds',
+                'feeds': feed_report,
+                'count': len(feed_report),
+                'circuit_open': sum(1 for feed in feed_report if feed['circuit'] == 'open'),
+                'due': sum(1 for feed in feed_report if feed['due'])
+            })
         
         elif action == 'history':
             # 過去のスレッド履歴を取得
             days = int(request.args.get('days', 7))
-            thread_history = get_thread_history(days)
+            limit, after, fields = get_page_params(request, HISTORY_ARTICLE_FIELDS, THREAD_HISTORY_LIMIT)
+            threads = get_thread_history(days, limit, after)
             
-            return json.dumps({
+            # ETagが毎回変わらないよう、timestampは含めない
+            return cached_json_response(request, {
                 'status': 'success',
                 'action': 'history',
-                'thread_history': {k.isoformat(): v for k, v in thread_history.items()},
-                'thread_count': len(thread_history),
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            }, ensure_ascii=False, indent=2), 200
+                'thread_history': {
+                    thread['created_at'].isoformat(): [project(article, fields) for article in thread['articles']]
+                    for thread in threads
+                },
+                'thread_count': len(threads),
+                'next_after': threads[-1]['id'] if len(threads) == limit else None
+            })
         
         elif action == 'custom':
             # 選択された記事からカスタムスレッドを作成
-            selected_ids = request.args.get('ids', '').split(',')
-            selected_ids = [id.strip() for id in selected_ids if id.strip()]
+            selected_ids = get_selected_ids(request)
             
             if not selected_ids:
                 return json.dumps({
                     'status': 'error',
-                    'message': 'idsパラメータが必要です（カンマ区切り）'
+                    'message': 'idsパラメータが必要です（カンマ区切り、またはPOSTの本文）'
                 }, ensure_ascii=False), 400
             
             result = create_custom_thread_from_selection(selected_ids)
@@ -619,6 +2118,8 @@ def rss_summarizer(request):
                     'status': 'success',
                     'action': 'custom_thread_created',
                     'articles_used': result['articles_used'],
+                    'articles_dropped': result['articles_dropped'],
+                    'thread_id': result['thread_id'],
                     'thread_summary': result['thread_summary'],
                     'articles': result['articles'],
                     'timestamp': datetime.now(timezone.utc).isoformat()
@@ -632,108 +2133,66 @@ def rss_summarizer(request):
         elif action == 'summary':
             # X投稿用まとめ生成
             unused_articles = get_recent_unused_articles(24)
-            if len(unused_articles) >= 3:  # 最低3件以上で実行
-                x_summary = create_x_thread_summary(unused_articles)
-                if x_summary:
-                    # 使用済みマーク
-                    article_ids = [article['id'] for article in unused_articles]
+            # 同じストーリーの記事は1件にまとめる
+            thread_articles = collapse_story_clusters(unused_articles)
+            if len(thread_articles) >= 3:  # 最低3件以上で実行
+                thread = build_x_thread(thread_articles)
+                if thread:
+                    # 実際に載せた記事だけを使用済みにマーク（同じストーリーの重複記事も含む）
+                    used_clusters = {article['cluster_id'] for article in thread['articles']}
+                    article_ids = [article['id'] for article in unused_articles if article['cluster_id'] in used_clusters]
                     mark_articles_as_used(article_ids)
+                    thread_id = save_thread(thread, 'summary')
                     
                     # Slack通知
-                    send_slack_notification_summary(x_summary, len(unused_articles))
+                    send_slack_notification_summary(thread['text'], len(thread['articles']))
                     
                     return json.dumps({
                         'status': 'success',
                         'action': 'summary_created',
-                        'articles_used': len(unused_articles),
-                        'x_summary': x_summary,
+                        'articles_used': len(thread['articles']),
+                        'articles_considered': len(thread_articles),
+                        'duplicates_collapsed': len(article_ids) - len(thread['articles']),
+                        'mode': thread['mode'],
+                        'thread_id': thread_id,
+                        'x_summary': thread['text'],
                         'timestamp': datetime.now(timezone.utc).isoformat()
                     }, ensure_ascii=False, indent=2), 200
             
             return json.dumps({
                 'status': 'success',
                 'action': 'summary_skipped',
-                'reason': f'記事数不足（{len(unused_articles)}件、最低3件必要）',
+                'reason': f'記事数不足（{len(thread_articles)}件、最低3件必要）',
                 'timestamp': datetime.now(timezone.utc).isoformat()
             }, ensure_ascii=False, indent=2), 200
         
-        # デフォルト: 記事収集
-        logger.info("AI関連RSS要約処理を開始")
-        processed_hashes = get_processed_articles()
-        new_articles_count = 0
-        processed_articles = []
+        elif action == 'batches':
+            # 完了したBatch APIのジョブの結果を取り込む（収集を待たずに要約を反映したいとき）
+            result = ingest_analysis_batches(notify=request.args.get('notify', '1') != '0',
+                                             scheduler=RunScheduler(COLLECT_DEADLINE_SECONDS))
+            return json.dumps(dict(result, status='success', action='batches', timestamp=datetime.now(timezone.utc).isoformat()),
+                              ensure_ascii=False, indent=2, default=str), 200
         
-        for feed_config in RSS_FEEDS:
-            feed_url = feed_config["url"]
-            feed_name = feed_config["name"]
-            feed_lang = feed_config["lang"]
-            
-            logger.info(f"RSS取得中: {feed_name} ({feed_url})")
-            
+        elif action == 'coordinate':
+            # フィードをシャードに分けてワーカーを並列実行
             try:
-                feed = feedparser.parse(feed_url)
-                
-                if feed.bozo:
-                    logger.warning(f"RSS解析警告: {feed_name}")
-                    continue
-                
-                # 最新3記事を処理
-                for entry in feed.entries[:3]:
-                    title = entry.title
-                    url = entry.link
-                    content = entry.get('summary', '') or entry.get('description', '')
-                    
-                    # 重複チェック
-                    article_hash = create_article_hash(url, title)
-                    if article_hash in processed_hashes:
-                        continue
-                    
-                    # AI関連記事かどうか判定
-                    if not is_ai_related_article(title, content):
-                        logger.info(f"AI関連外記事をスキップ: {title}")
-                        continue
-                    
-                    logger.info(f"AI関連記事を処理中: {title}")
-                    
-                    # 要約生成
-                    summary, importance_score = summarize_with_openai(title, content, feed_lang)
-                    
-                    # 1次情報抽出
-                    primary_source = extract_primary_sources(content, title)
-                    
-                    # Firestoreに保存
-                    if save_to_firestore(title, url, summary, feed_name, article_hash, feed_lang, primary_source, importance_score):
-                        new_articles_count += 1
-                        processed_hashes.add(article_hash)
-                        processed_articles.append({
-                            'title': title,
-                            'url': url,
-                            'source': feed_name,
-                            'summary': summary,
-                            'primary_source': primary_source,
-                            'importance_score': importance_score
-                        })
-                        
-            except Exception as e:
-                logger.error(f"フィード処理エラー ({feed_name}): {e}")
-                continue
+                shard_count = parse_shard_count(request.args.get('shards', COLLECT_SHARDS), len(RSS_FEEDS))
+            except ValueError as e:
+                return json.dumps({'status': 'error', 'message': str(e)}, ensure_ascii=False), 400
+            worker_url = FANOUT_WORKER_URL or request.base_url
+            result = coordinate_collect(shard_count, worker_url)
+            return json.dumps(result, ensure_ascii=False, indent=2), 200
         
-        # 新しい記事があれば個別通知
-        if processed_articles:
-            send_slack_notification(processed_articles)
-        
-        result = {
-            'status': 'success',
-            'action': 'collect',
-            'new_ai_articles': new_articles_count,
-            'articles': processed_articles,
-            'total_feeds_checked': len(RSS_FEEDS),
-            'timestamp': datetime.now(timezone.utc).isoformat()
-        }
-        
-        logger.info(f"処理完了: {new_articles_count}件のAI関連記事")
+        # デフォルト: 記事収集（shard=i/n でシャード単位のワーカーとして動作）
+        shard = request.args.get('shard')
+        if shard:
+            try:
+                shard = parse_shard(shard)
+            except ValueError as e:
+                return json.dumps({'status': 'error', 'message': str(e)}, ensure_ascii=False), 400
+        result = collect_articles(shard, notify=request.args.get('notify', '1') != '0')
         return json.dumps(result, ensure_ascii=False, indent=2), 200
         
     except Exception as e:
         logger.error(f"メイン処理エラー: {e}")
-        return json.dumps({'status': 'error', 'message': str(e)}, ensure_ascii=False), 500 
\ No newline at end of file
+        return json.dumps({'status': 'error', 'message': str(e)}, ensure_ascii=False), 500
@@ -0,0 +1,214 @@
+"""
+ステージごとの所要時間・呼び出し回数・トークン数の計測
+
+フィード取得・判定・要約・1次情報の抽出・保存などのステージをスパンとして計測し、
+所要時間をヒストグラムに、OpenAIのトークン数やFirestoreの読み書き件数をカウンタに
+集計する。集計はインスタンスの起動からの累計で ?action=metrics で参照できる。
+リクエストごとの内訳は終了時に構造化ログ（1行のJSON）として出力し、profile=1 を
+付けたリクエストではレスポンスにも含める。
+
+Cloud Functions のインスタンスは同時に1リクエストしか処理しないので、実行中の
+リクエストの内訳はモジュール全体で1つだけ持つ。
+"""
+
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# 所要時間のヒストグラムの区切り（秒）
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def metric_key(name, labels):
+    """ラベル付きのメトリクス名（例: openai_tokens{stage=summarize}）"""
+    labels = {key: value for key, value in labels.items() if value is not None}
+    if not labels:
+        return name
+    return name + '{' + ','.join(f"{key}={labels[key]}" for key in sorted(labels)) + '}'
+
+
+class Histogram:
+    """区切りごとの件数・合計・最大値"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self):
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)}
+        buckets['le_inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'avg': round(self.total / self.count, 3) if self.count else 0,
+            'max': round(self.max, 3),
+            'buckets': buckets
+        }
+
+
+class RequestTrace:
+    """1リクエスト分のスパンとカウンタ"""
+
+    def __init__(self, action):
+        self.action = action
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+
+    def add_span(self, path, seconds):
+        span = self.spans.setdefault(path, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        span['count'] += 1
+        span['total_seconds'] += seconds
+        span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    def count(self, key, value):
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self):
+        return {
+            'action': self.action,
+            'started_at': self.started_at.isoformat(),
+            'wall_seconds': round(time.perf_counter() - self._started, 3),
+            # 並行に実行したスパンは合計が実時間を超えることがある
+            'spans': {
+                path: {'count': span['count'], 'total_seconds': round(span['total_seconds'], 3),
+                       'max_seconds': round(span['max_seconds'], 3)}
+                for path, span in sorted(self.spans.items())
+            },
+            'counters': {key: round(value, 6) if isinstance(value, float) else value
+                         for key, value in sorted(self.counters.items())}
+        }
+
+
+class MetricsRegistry:
+    """インスタンス全体のカウンタ・ヒストグラムと、実行中のリクエストの内訳"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started_at = datetime.now(timezone.utc)
+        self.counters = {}
+        self.histograms = {}
+        self.last_requests = {}
+        self.trace = None
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_path(self):
+        """このスレッドで実行中のスパンのパス（例: ('collect', 'analyze')）"""
+        return tuple(self._stack())
+
+    def current_stage(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def bound(self, path):
+        """別スレッドで実行する処理を、呼び出し元のスパンの下で計測する"""
+        previous = getattr(self._local, 'stack', None)
+        self._local.stack = list(path)
+        try:
+            yield
+        finally:
+            self._local.stack = previous if previous is not None else []
+
+    def count(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            if self.trace is not None:
+                self.trace.count(key, value)
+
+    def observe(self, name, seconds, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            self.histograms.setdefault(key, Histogram()).observe(seconds)
+
+    def record_span(self, stage, seconds):
+        """計測済みの所要時間を、現在のスパンの下のステージとして記録する"""
+        self.observe('stage_seconds', seconds, stage=stage)
+        path = '/'.join(self.current_path() + (stage,))
+        with self._lock:
+            if self.trace is not None:
+                self.trace.add_span(path, seconds)
+
+    @contextmanager
+    def span(self, stage):
+        """with ブロックの所要時間をステージとして計測する（入れ子にできる）"""
+        stack = self._stack()
+        stack.append(stage)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            stack.pop()
+            self.record_span(stage, seconds)
+
+    def timed(self, stage):
+        """関数の実行時間をステージとして計測するデコレータ"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def start_request(self, action):
+        with self._lock:
+            self.trace = RequestTrace(action)
+        self._local.stack = []
+        return self.trace
+
+    def finish_request(self, trace, status=None):
+        """リクエストの内訳を確定し、構造化ログに出力して返す"""
+        summary = trace.summary()
+        summary['http_status'] = status
+        with self._lock:
+            if self.trace is trace:
+                self.trace = None
+            self.last_requests[trace.action] = summary
+        self.observe('request_seconds', summary['wall_seconds'], action=trace.action)
+        self.count('requests', action=trace.action, status=status)
+        log_structured(f"{trace.action} 完了 ({summary['wall_seconds']:.2f}秒)", metrics=summary)
+        return summary
+
+    def snapshot(self):
+        """インスタンスの起動からの累計（?action=metrics 用）"""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            return {
+                'instance_started_at': self.started_at.isoformat(),
+                'uptime_seconds': round((now - self.started_at).total_seconds(), 1),
+                'counters': {key: round(value, 6) if isinstance(value, float) else value
+                             for key, value in sorted(self.counters.items())},
+                'histograms': {key: histogram.snapshot() for key, histogram in sorted(self.histograms.items())},
+                'last_requests': dict(self.last_requests)
+            }
+
+
+def log_structured(message, severity='INFO', **fields):
+    """Cloud Logging が jsonPayload として取り込む1行のJSONを標準出力に書く"""
+    print(json.dumps(dict(fields, severity=severity, message=message), ensure_ascii=False, default=str),
+          flush=True)
+
+
+metrics = MetricsRegistry()
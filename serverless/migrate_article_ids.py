@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+既存記事のドキュメントIDを記事ハッシュに揃える移行スクリプト（1回のみ実行）
+
+重複チェックはハッシュをドキュメントIDとしたID検索で行うため、
+自動採番IDで保存されていた過去の記事をハッシュIDへ移し替える。
+記事ハッシュは正規化したURL（トラッキング用パラメータ・末尾のスラッシュを除く）から
+計算するので、正規化前のURLで保存した記事も正規化後のURL・ハッシュIDへ移す
+（移さないと、次回の収集で同じ記事が別の記事として処理・投稿される）。
+"""
+
+import hashlib
+
+from google.cloud import firestore
+
+from clustering import canonicalize_url
+
+BATCH_SIZE = 250  # 1記事あたり作成+削除の2書き込み（上限500）
+
+def create_article_hash(url, title):
+    """正規化したURLから記事ハッシュを計算（main.create_article_hash と同じ）"""
+    return hashlib.md5(f"{url}{title}".encode()).hexdigest()
+
+def migrate_article_ids():
+    """自動採番IDの記事・正規化前のURLで保存した記事をハッシュIDのドキュメントへ移行"""
+    db = firestore.Client()
+    collection = db.collection('ai_articles')
+
+    try:
+        batch = db.batch()
+        pending = 0
+        migrated = 0
+        skipped = 0
+
+        for doc in collection.stream():
+            data = doc.to_dict()
+            article_hash = data.get('hash')
+            # 正規化前のURLで保存された記事は、正規化後のURLとハッシュに付け替える
+            url = canonicalize_url(data.get('url'))
+            if url and url != data['url'] and 'title' in data:
+                article_hash = create_article_hash(url, data['title'])
+                data = dict(data, url=url, hash=article_hash)
+            if not article_hash or doc.id == article_hash:
+                skipped += 1
+                continue
+
+            # 同じハッシュの記事が既にあれば上書きせず旧ドキュメントのみ削除
+            target = collection.document(article_hash)
+            if not target.get(field_paths=['hash']).exists:
+                batch.set(target, data)
+            batch.delete(doc.reference)
+            pending += 1
+            migrated += 1
+
+            if pending >= BATCH_SIZE:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+
+        if pending:
+            batch.commit()
+
+        print(f"✅ {migrated}件の記事をハッシュIDに移行しました（対象外: {skipped}件）")
+
+    except Exception as e:
+        print(f"❌ エラー: {e}")
+
+if __name__ == "__main__":
+    migrate_article_ids()
@@ -0,0 +1,89 @@
+"""
+LLM判定前のローカル事前フィルタ
+
+日英のキーワード辞書とフィードごとの事前スコアで記事をスコアリングし、
+明らかにAI関連の記事は採用、明らかに無関係な記事は除外する。
+判断がつかない記事だけをLLMのAI関連判定に回す。
+"""
+
+import os
+import re
+
+# 判定しきい値（環境変数で上書き可能）
+PREFILTER_ACCEPT_THRESHOLD = float(os.environ.get('PREFILTER_ACCEPT_THRESHOLD', '4'))
+PREFILTER_REJECT_THRESHOLD = float(os.environ.get('PREFILTER_REJECT_THRESHOLD', '0'))
+
+# タイトル中の一致は本文より重く扱う
+TITLE_WEIGHT = 2.0
+CONTENT_WEIGHT = 1.0
+
+# 日本語の直後でも英単語として一致させるため \b ではなく英数字の有無で境界を判定
+_B = r'(?<![A-Za-z0-9])'
+_E = r'(?![A-Za-z0-9])'
+
+# AIそのものを指す語（1つでも含まれれば自動除外しない）
+AI_TERMS = [
+    (re.compile(_B + r'A\.?I' + _E), 2.0),
+    (re.compile(r'人工知能|機械学習|深層学習|ディープラーニング|生成AI|大規模言語モデル|言語モデル|ニューラルネット'), 2.0),
+    (re.compile(_B + r'(artificial intelligence|machine learning|deep learning|neural net(work)?s?|generative|'
+                r'large language models?|language models?|LLMs?|foundation models?|diffusion models?)' + _E,
+                re.IGNORECASE), 2.0),
+    (re.compile(_B + r'(ChatGPT|GPT-?\d[A-Za-z0-9.]*|OpenAI|Anthropic|Claude|Gemini|Copilot|DeepMind|Hugging ?Face|'
+                r'Llama|Mistral|Stable Diffusion|Midjourney|Perplexity|xAI|Grok|Altman)' + _E, re.IGNORECASE), 2.0),
+    (re.compile(r'自然言語処理|画像認識|音声認識|画像生成|チャットボット|エージェント|推論モデル'), 1.0),
+    (re.compile(_B + r'(NLP|computer vision|chatbots?|AI agents?|agentic|inference|fine-?tun(e|ing)|'
+                r'MLOps|data science|reinforcement learning|transformers?)' + _E,
+                re.IGNORECASE), 1.0),
+]
+
+# AI関連でよく出るが単独ではAIとは限らない語
+RELATED_TERMS = [
+    (re.compile(r'ロボット|自動運転|データサイエンス|半導体|GPU|NVIDIA|エヌビディア'), 0.5),
+    (re.compile(_B + r'(robots?|robotics|autonomous|self-driving|GPUs?|NVIDIA|accelerators?|datacenters?|data centers?)' + _E,
+                re.IGNORECASE), 0.5),
+]
+
+# 判定基準で除外対象となる記事の傾向（ハウツー・解説・セール情報など）
+NEGATIVE_TERMS = [
+    (re.compile(r'使い方|入門|とは[？?]?$|とは何か|解説|チュートリアル|まとめ|セール|割引|レビュー'), -1.5),
+    (re.compile(_B + r'(how to|tutorial|beginner\'?s guide|explained|what is|deals?|sale|discount|review)' + _E,
+                re.IGNORECASE), -1.5),
+]
+
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _score_text(text, weight):
+    score = 0.0
+    ai_hit = False
+    for pattern, term_weight in AI_TERMS:
+        if pattern.search(text):
+            score += term_weight * weight
+            ai_hit = True
+    for pattern, term_weight in RELATED_TERMS + NEGATIVE_TERMS:
+        if pattern.search(text):
+            score += term_weight * weight
+    return score, ai_hit
+
+
+def score_article(title, content, feed_prior=0.0):
+    """記事のAI関連スコアを計算し (スコア, AI語を含むか) を返す"""
+    snippet = _TAG_RE.sub(' ', content or '')[:1500]
+    title_score, title_hit = _score_text(title or '', TITLE_WEIGHT)
+    content_score, content_hit = _score_text(snippet, CONTENT_WEIGHT)
+    return feed_prior + title_score + content_score, title_hit or content_hit
+
+
+def prefilter_article(title, content, feed_prior=0.0):
+    """'accept' / 'reject' / 'ambiguous' のいずれかを返す
+
+    AI語を1つも含まず事前スコアもないフィードの記事は除外し、
+    スコアがしきい値以上の記事は採用する。それ以外はLLMに判定させる。
+    """
+    score, ai_hit = score_article(title, content, feed_prior)
+
+    if score >= PREFILTER_ACCEPT_THRESHOLD:
+        return 'accept'
+    if not ai_hit and feed_prior <= 0 and score <= PREFILTER_REJECT_THRESHOLD:
+        return 'reject'
+    return 'ambiguous'
@@ -0,0 +1,198 @@
+"""
+1次情報リンクのローカル抽出
+
+RSSの summary / description のHTMLからリンクを取り出し、ドメインの許可リスト
+（公式発表・公式ブログ・GitHub・論文サイトなど）と除外リスト（ニュースサイト・
+まとめサイト・共有ボタンなど）で振り分けて優先度順に並べる。どちらにも当てはまらない
+リンクだけが残った場合に、呼び出し側でLLMに判断させる。
+"""
+
+import os
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+# 1記事あたりに保存する1次情報リンクの最大数（環境変数で上書き可能）
+PRIMARY_SOURCE_MAX = int(os.environ.get('PRIMARY_SOURCE_MAX', '3'))
+# LLMに判断させるリンクの最大数
+PRIMARY_SOURCE_LLM_CANDIDATES = int(os.environ.get('PRIMARY_SOURCE_LLM_CANDIDATES', '10'))
+
+# 許可リスト（優先度が小さいほど上位。LLMのプロンプトの優先順位と同じ）
+# 1: 公式発表・プレスリリース 2: 企業公式サイト・ブログ 3: GitHub・技術文書
+# 4: 公式Twitter/X投稿 5: 研究論文・学術サイト
+PRIMARY_DOMAINS = {
+    'prtimes.jp': 1, 'businesswire.com': 1, 'prnewswire.com': 1, 'globenewswire.com': 1, 'newswire.ca': 1,
+    'openai.com': 2, 'anthropic.com': 2, 'blog.google': 2, 'deepmind.google': 2, 'ai.google': 2,
+    'research.google': 2, 'ai.meta.com': 2, 'about.fb.com': 2, 'blogs.microsoft.com': 2,
+    'news.microsoft.com': 2, 'blogs.nvidia.com': 2, 'nvidianews.nvidia.com': 2, 'aws.amazon.com': 2,
+    'machinelearning.apple.com': 2, 'mistral.ai': 2, 'x.ai': 2, 'stability.ai': 2, 'cohere.com': 2,
+    'ai21.com': 2, 'perplexity.ai': 2, 'sakana.ai': 2, 'preferred.jp': 2, 'rinna.co.jp': 2,
+    'github.com': 3, 'gitlab.com': 3, 'huggingface.co': 3, 'pypi.org': 3, 'readthedocs.io': 3,
+    'platform.openai.com': 3, 'docs.anthropic.com': 3, 'ai.google.dev': 3, 'learn.microsoft.com': 3,
+    'x.com': 4, 'twitter.com': 4,
+    'arxiv.org': 5, 'openreview.net': 5, 'aclanthology.org': 5, 'paperswithcode.com': 5,
+    'proceedings.neurips.cc': 5, 'proceedings.mlr.press': 5, 'dl.acm.org': 5, 'ieeexplore.ieee.org': 5,
+    'nature.com': 5, 'science.org': 5, 'biorxiv.org': 5, 'doi.org': 5,
+}
+
+# 許可リストにないリンクの並び順（許可リストのリンクの後）
+UNLISTED_PRIORITY = 6
+
+# サブドメインから公式の発表・ブログ・技術文書と判断できるもの
+PRIMARY_HOST_PREFIXES = {
+    'newsroom.': 1, 'press.': 1, 'ir.': 1, 'investor.': 1, 'investors.': 1,
+    'blog.': 2, 'blogs.': 2, 'research.': 2, 'engineering.': 2,
+    'docs.': 3, 'developer.': 3, 'developers.': 3,
+}
+
+# 除外リスト（ニュースサイト・まとめサイト・SNSの共有・フィード配信）
+EXCLUDED_DOMAINS = {
+    'news.google.com', 'news.yahoo.co.jp', 'news.yahoo.com', 'news.ycombinator.com', 'reddit.com',
+    'b.hatena.ne.jp', 'feedly.com', 'feedproxy.google.com', 'feeds.feedburner.com', 'feedburner.com',
+    'techcrunch.com', 'theverge.com', 'venturebeat.com', 'wired.com', 'wired.jp', 'arstechnica.com',
+    'engadget.com', 'zdnet.com', 'cnet.com', 'reuters.com', 'bloomberg.com', 'cnbc.com', 'theinformation.com',
+    'technologyreview.com', 'itmedia.co.jp', 'gigazine.net', 'impress.co.jp', 'ascii.jp', 'gizmodo.jp',
+    'nikkei.com', 'xtech.nikkei.com', 'techno-edge.net', 'publickey1.jp', 'codezine.jp', 'zenn.dev', 'qiita.com',
+    'note.com', 'medium.com', 'substack.com', 'facebook.com', 'linkedin.com', 'instagram.com', 't.co',
+    'doubleclick.net', 'addtoany.com', 'wp.me', 'gravatar.com', 'wordpress.com',
+}
+
+# 共有ボタン・画像などのリンク
+EXCLUDED_PATH = re.compile(r'/(intent|share|sharer|hashtag)(/|\.php|$)', re.IGNORECASE)
+EXCLUDED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.mp3', '.mp4', '.css', '.js')
+
+# 2階層のトップレベルドメイン（example.co.jp のサイトを example.co.jp として扱う）
+SECOND_LEVEL_LABELS = {'co', 'ac', 'or', 'ne', 'go', 'com', 'net', 'org', 'gov', 'edu'}
+
+BARE_URL = re.compile(r'https?://[^\s<>"\'）」]+')
+
+
+class _AnchorParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href.strip())
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+
+def extract_links(content):
+    """HTMLのアンカーと本文中のURLを出現順に重複なく返す（http/https のみ）"""
+    parser = _AnchorParser()
+    try:
+        parser.feed(content or '')
+        parser.close()
+    except Exception:
+        pass
+    links = parser.links + BARE_URL.findall(' '.join(parser.text))
+
+    seen = set()
+    urls = []
+    for link in links:
+        url = link.rstrip('.,;:)]')
+        if not url.startswith(('http://', 'https://')) or url in seen:
+            continue
+        seen.add(url)
+        urls.append(url)
+    return urls
+
+
+def _host(url):
+    try:
+        host = (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def _matches(host, domain):
+    return host == domain or host.endswith('.' + domain)
+
+
+def site_of(host):
+    """ホストの登録ドメイン（news.example.co.jp -> example.co.jp）"""
+    labels = host.split('.')
+    if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def link_priority(url, article_url=None):
+    """リンクの優先度（許可リストなら1〜5、判断がつかなければ0、除外ならNone）"""
+    host = _host(url)
+    if not host:
+        return None
+    path = urlsplit(url).path
+    if EXCLUDED_PATH.search(path) or path.lower().endswith(EXCLUDED_EXTENSIONS):
+        return None
+    # 記事自身のサイトへのリンク（関連記事・カテゴリなど）は1次情報ではない
+    if article_url and site_of(host) == site_of(_host(article_url)):
+        return None
+    if any(_matches(host, domain) for domain in EXCLUDED_DOMAINS):
+        return None
+
+    # 最も具体的な（長い）ドメインの優先度を使う
+    matched = [domain for domain in PRIMARY_DOMAINS if _matches(host, domain)]
+    if matched:
+        priority = PRIMARY_DOMAINS[max(matched, key=len)]
+        # X・Twitterは個別の投稿だけを1次情報とする
+        if priority == 4 and '/status/' not in path:
+            return None
+        return priority
+    for prefix, priority in PRIMARY_HOST_PREFIXES.items():
+        if host.startswith(prefix):
+            return priority
+    return 0
+
+
+def rank_primary_sources(urls, article_url=None, limit=PRIMARY_SOURCE_MAX):
+    """除外リストのリンクを除き、許可リストの優先度順（同じなら出現順）に最大limit件を返す
+
+    許可リストにないリンク（LLMが選んだものなど）は許可リストのリンクの後に並べる。
+    """
+    ranked = []
+    seen = set()
+    for position, url in enumerate(urls):
+        if url in seen:
+            continue
+        seen.add(url)
+        priority = link_priority(url, article_url)
+        if priority is None:
+            continue
+        ranked.append((priority or UNLISTED_PRIORITY, position, url))
+    return [url for _, _, url in sorted(ranked)][:limit]
+
+
+def find_primary_sources(content, article_url=None):
+    """本文のリンクを (許可リストのリンクを優先度順に, 判断がつかないリンク) に振り分ける"""
+    primary = []
+    ambiguous = []
+    for url in extract_links(content):
+        priority = link_priority(url, article_url)
+        if priority:
+            primary.append(url)
+        elif priority == 0:
+            ambiguous.append(url)
+    return rank_primary_sources(primary, article_url), ambiguous[:PRIMARY_SOURCE_LLM_CANDIDATES]
+
+
+def confirm_llm_sources(urls, candidates):
+    """LLMが挙げたURLのうち、LLMに渡した候補（本文のリンク）にあるものだけを返す（作られたURLは除く）"""
+    candidates = set(candidates or ())
+    return [url for url in urls if url in candidates]
+
+
+def primary_source_urls(value):
+    """保存済みの primary_source をURLのリストにする（以前の改行区切りの文字列・Noneにも対応）"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [url.rstrip('.,;:)]') for url in BARE_URL.findall(value)]
+    return [url for url in value if isinstance(url, str) and url]
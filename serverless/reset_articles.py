@@ -3,26 +3,30 @@
 既存記事を未使用状態にリセットするスクリプト（テスト用）
 """
 
-from google.cloud import firestore
+from storage import create_article_store
 
 def reset_articles_to_unused():
     """全ての記事を未使用状態にリセット"""
-    db = firestore.Client()
+    store = create_article_store()
     
     try:
-        # 全ての記事を取得
-        docs = db.collection('ai_articles').stream()
+        # 全ての記事を取得（更新にはIDだけあればよいのでフィールドは読まない）
+        articles = store.iter_articles(fields=[])
         
+        # used_in_summaryフィールドを追加/更新（最大500件ずつ一括更新）
+        writer = store.writer()
         count = 0
-        for doc in docs:
-            # used_in_summaryフィールドを追加/更新
-            doc.reference.update({
+        for article in articles:
+            writer.update_article(article['id'], {
                 'used_in_summary': False,
-                'primary_source': None  # 既存記事には1次情報がないため
+                'primary_source': []  # 既存記事には1次情報がないため
             })
             count += 1
         
-        print(f"✅ {count}件の記事を未使用状態にリセットしました")
+        failed = writer.flush()
+        print(f"✅ {count - len(failed)}件の記事を未使用状態にリセットしました（コミット{writer.stats['commits']}回）")
+        if failed:
+            print(f"⚠️ {len(failed)}件の更新に失敗しました")
         
     except Exception as e:
         print(f"❌ エラー: {e}")
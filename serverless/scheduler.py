@@ -0,0 +1,122 @@
+"""
+収集処理の締め切り管理と再開用カーソル
+
+実行時間の残りと1件あたりの処理コストの見積もりから、締め切り前に処理を
+打ち切る。未処理の候補記事と次に取得を始めるフィードの位置を保存し、
+次回の実行はその続きから始める（フィードは順番に巡回するので偏らない）。
+"""
+
+import os
+import time
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# スケジューラ設定（環境変数で上書き可能）
+COLLECT_SAFETY_MARGIN_SECONDS = float(os.environ.get('COLLECT_SAFETY_MARGIN_SECONDS', '30'))
+INITIAL_UNIT_COST_SECONDS = float(os.environ.get('COLLECT_INITIAL_UNIT_COST_SECONDS', '3'))
+COLLECT_MAX_PENDING = int(os.environ.get('COLLECT_MAX_PENDING', '200'))
+UNIT_COST_SMOOTHING = 0.3
+
+STATE_COLLECTION = 'collect_state'
+PENDING_CONTENT_CHARS = 3000
+
+# 保存する候補記事のフィールド（指紋などは復元時に再計算する）
+PENDING_FIELDS = ('title', 'url', 'content', 'source', 'source_lang', 'prior', 'hash', 'feed_url')
+
+
+class RunScheduler:
+    """1回の実行の残り時間と、候補記事1件あたりの処理コストを管理する"""
+
+    def __init__(self, budget_seconds, safety_margin=COLLECT_SAFETY_MARGIN_SECONDS,
+                 unit_cost=INITIAL_UNIT_COST_SECONDS):
+        self.started = time.monotonic()
+        self.deadline = self.started + budget_seconds
+        self.safety_margin = safety_margin
+        self.unit_cost = unit_cost or INITIAL_UNIT_COST_SECONDS
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def fetch_deadline(self):
+        """フィード取得を打ち切る時刻（time.monotonic() 基準）"""
+        return self.deadline - self.safety_margin
+
+    def expired(self):
+        return self.remaining() <= self.safety_margin
+
+    def units_affordable(self):
+        """締め切りまでに処理できる候補記事の件数の見積もり
+
+        見積もりが過大なまま処理が止まらないよう、時間が残っていれば最低1件は処理する。
+        """
+        usable = self.remaining() - self.safety_margin
+        if usable <= 0:
+            return 0
+        return max(1, int(usable / self.unit_cost))
+
+    def record(self, units, elapsed):
+        """実績から1件あたりのコストを更新（指数移動平均）"""
+        if units <= 0:
+            return
+        observed = elapsed / units
+        self.unit_cost = (1 - UNIT_COST_SMOOTHING) * self.unit_cost + UNIT_COST_SMOOTHING * observed
+
+
+class CollectCursor:
+    """次回の開始位置・未処理の候補記事・処理コストの見積もりを保存する"""
+
+    def __init__(self, store, cursor_id='cursor'):
+        self.store = store
+        self.cursor_id = cursor_id
+        self.next_feed_index = 0
+        self.pending = []
+        self.unit_cost = INITIAL_UNIT_COST_SECONDS
+
+    def load(self):
+        data = self.store.get_document(STATE_COLLECTION, self.cursor_id)
+        if data:
+            self.next_feed_index = data.get('next_feed_index', 0)
+            self.pending = data.get('pending', [])
+            self.unit_cost = data.get('unit_cost', INITIAL_UNIT_COST_SECONDS)
+        return self
+
+    def save(self, next_feed_index, pending, unit_cost):
+        """次回の開始位置と未処理の候補を保存し、保存した候補の件数を返す"""
+        self.next_feed_index = next_feed_index
+        self.pending = [
+            dict({field: candidate.get(field) for field in PENDING_FIELDS},
+                 content=(candidate.get('content') or '')[:PENDING_CONTENT_CHARS])
+            for candidate in pending[:COLLECT_MAX_PENDING]
+        ]
+        self.unit_cost = unit_cost
+        self.store.set_document(STATE_COLLECTION, self.cursor_id, {
+            'next_feed_index': next_feed_index,
+            'pending': self.pending,
+            'unit_cost': unit_cost,
+            'updated_at': datetime.now(timezone.utc)
+        })
+        return len(self.pending)
+
+
+def rotate_feeds(feeds, start_index):
+    """start_indexのフィードから始まるように並べ替えたリストを返す"""
+    if not feeds:
+        return []
+    start_index %= len(feeds)
+    return feeds[start_index:] + feeds[:start_index]
+
+
+def next_start_index(feeds, start_index, completed_urls):
+    """巡回順で最初に未完了だったフィードの位置を返す（すべて完了なら開始位置のまま）"""
+    if not feeds:
+        return 0
+    for offset in range(len(feeds)):
+        index = (start_index + offset) % len(feeds)
+        if feeds[index]['url'] not in completed_urls:
+            return index
+    return start_index % len(feeds)
@@ -0,0 +1,605 @@
+"""
+記事と状態ドキュメントの保存先
+
+main.py やメンテナンススクリプトは ArticleStore を経由して記事の保存・重複確認・
+未使用記事の取得・使用済みマークを行う。本番用のFirestore実装と、オフラインでの
+負荷試験やローカル実行用のSQLite実装がある。収集カーソルやストーリークラスタの
+ような小さな状態はコレクション名とIDで読み書きするドキュメントとして保存する。
+"""
+
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 保存先の設定（環境変数で上書き可能）
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')  # firestore / sqlite
+STORAGE_SQLITE_PATH = os.environ.get('STORAGE_SQLITE_PATH', '/tmp/rss_summarizer.sqlite3')
+
+ARTICLES_COLLECTION = 'ai_articles'
+THREADS_COLLECTION = 'threads'
+IMPORTANCE_SCORES = (5, 4, 3, 2, 1)  # 重要度の高い順
+GET_ALL_CHUNK_SIZE = 300  # Firestoreの get_all 1回で読むドキュメント数
+
+
+def article_path(article_id):
+    """書き込み失敗の判定に使う記事のパス（Firestoreのドキュメントパスと同じ形式）"""
+    return f"{ARTICLES_COLLECTION}/{article_id}"
+
+
+def project(doc, fields):
+    """指定したフィールドとIDだけを残す（fieldsがNoneならそのまま）"""
+    if fields is None:
+        return doc
+    return {key: doc[key] for key in list(fields) + ['id'] if key in doc}
+
+
+def count_query_reads(collection, returned):
+    """クエリの読み取り件数を数える（結果が0件でも1件分の読み取りとして課金される）"""
+    metrics.count('firestore_reads', max(1, returned), collection=collection)
+
+
+def article_time(article):
+    """記事の作成日時（created_at がない古い記事は date）"""
+    return article.get('created_at') or article.get('date')
+
+
+class ArticleStore:
+    """記事と状態ドキュメントの保存先のインターフェース"""
+
+    db = None  # Firestoreのクライアント（Firestore実装のみ）
+
+    def find_existing(self, article_ids):
+        """指定したIDのうち保存済みのものを返す"""
+        raise NotImplementedError
+
+    def get_articles(self, article_ids, fields=None):
+        """IDを指定して記事を取得（存在しないIDは除く、順序は指定順、fieldsを指定すると読み取るフィールドを絞る）"""
+        raise NotImplementedError
+
+    def recent_articles(self, limit=20, after=None, fields=None):
+        """作成日時の新しい順に記事を取得
+
+        after に前のページの最後の記事IDを渡すと、その次の記事から返す。
+        fields を指定すると読み取るフィールドを絞る。
+        """
+        raise NotImplementedError
+
+    def unused_articles(self, since=None, limit=None):
+        """まとめに未使用でsince以降に作成された記事を、重要度の高い順・同じ重要度なら新しい順に取得"""
+        raise NotImplementedError
+
+    def iter_articles(self, fields=None):
+        """全記事を順に返す（fieldsを指定すると読み取るフィールドを絞る）"""
+        raise NotImplementedError
+
+    def create_article(self, article_id, data):
+        """記事を保存（保存済みならFalse）"""
+        writer = self.writer()
+        writer.create_article(article_id, data)
+        return not writer.flush()
+
+    def writer(self):
+        """一括書き込み用のライターを返す"""
+        raise NotImplementedError
+
+    def create_thread(self, data):
+        """生成したスレッドを保存し、IDを返す（created_at は保存時刻）"""
+        raise NotImplementedError
+
+    def recent_threads(self, since, limit=None, after=None, fields=None):
+        """since以降に保存したスレッドを新しい順に取得（after・fields は recent_articles と同じ）"""
+        raise NotImplementedError
+
+    def get_document(self, collection, doc_id):
+        """状態ドキュメントを取得（なければNone）"""
+        raise NotImplementedError
+
+    def get_documents(self, collection, doc_ids):
+        """状態ドキュメントをまとめて取得し、{ID: 内容} で返す（存在しないIDは含めない）"""
+        raise NotImplementedError
+
+    def set_document(self, collection, doc_id, data, merge=False):
+        raise NotImplementedError
+
+    def array_union(self, collection, doc_id, field, values):
+        """ドキュメントの配列フィールドに未登録の値を追加（ドキュメントがなければ作成）"""
+        raise NotImplementedError
+
+    def array_remove(self, collection, doc_id, field, values):
+        """ドキュメントの配列フィールドから指定した値を削除（他の値は書き換えない）"""
+        raise NotImplementedError
+
+
+class StoreWriter:
+    """書き込みをまとめて確定するライターのインターフェース
+
+    flush() は前回のflush以降に失敗した書き込みの {パス: 例外} を返す。
+    """
+
+    def create_article(self, article_id, data):
+        raise NotImplementedError
+
+    def update_article(self, article_id, data):
+        raise NotImplementedError
+
+    def set_document(self, collection, doc_id, data, merge=False):
+        raise NotImplementedError
+
+    def array_union(self, collection, doc_id, field, values):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+
+class FirestoreStoreWriter(StoreWriter):
+    """BulkWriterで最大500件ずつコミットする"""
+
+    def __init__(self, db):
+        from firestore_bulk import BulkWriter
+
+        self.db = db
+        self.bulk = BulkWriter(db)
+        self.stats = self.bulk.stats
+
+    def create_article(self, article_id, data):
+        from google.cloud import firestore
+
+        self.bulk.create(self.db.collection(ARTICLES_COLLECTION).document(article_id),
+                         dict(data, created_at=firestore.SERVER_TIMESTAMP))
+
+    def update_article(self, article_id, data):
+        self.bulk.update(self.db.collection(ARTICLES_COLLECTION).document(article_id), data)
+
+    def set_document(self, collection, doc_id, data, merge=False):
+        self.bulk.set(self.db.collection(collection).document(doc_id), data, merge=merge)
+
+    def array_union(self, collection, doc_id, field, values):
+        from google.cloud import firestore
+
+        self.bulk.set(self.db.collection(collection).document(doc_id),
+                      {field: firestore.ArrayUnion(list(values))}, merge=True)
+
+    def flush(self):
+        return self.bulk.flush()
+
+
+class FirestoreArticleStore(ArticleStore):
+    """Firestoreの ai_articles コレクション（ドキュメントIDは記事ハッシュ）
+
+    Firestoreのクライアントは読み込み・接続の準備が重いので、最初に使うときに作る。
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    from google.cloud import firestore
+
+                    self._db = firestore.Client()
+        return self._db
+
+    def _articles(self):
+        return self.db.collection(ARTICLES_COLLECTION)
+
+    def find_existing(self, article_ids):
+        article_ids = list(dict.fromkeys(article_ids))
+        if not article_ids:
+            return set()
+        return {doc.id for doc in self._get_all(ARTICLES_COLLECTION, article_ids, ['hash'])}
+
+    def _get_all(self, collection, doc_ids, fields=None):
+        """存在するドキュメントのスナップショットを GET_ALL_CHUNK_SIZE 件ずつまとめて読む（順序は不定）"""
+        for start in range(0, len(doc_ids), GET_ALL_CHUNK_SIZE):
+            refs = [self.db.collection(collection).document(doc_id)
+                    for doc_id in doc_ids[start:start + GET_ALL_CHUNK_SIZE]]
+            # 存在しないドキュメントも1件の読み取りとして課金される
+            metrics.count('firestore_reads', len(refs), collection=collection)
+            for doc in self.db.get_all(refs, field_paths=fields):
+                if doc.exists:
+                    yield doc
+
+    def get_articles(self, article_ids, fields=None):
+        article_ids = list(dict.fromkeys(article_ids))
+        found = {doc.id: dict(doc.to_dict(), id=doc.id)
+                 for doc in self._get_all(ARTICLES_COLLECTION, article_ids, fields)}
+        return [found[article_id] for article_id in article_ids if article_id in found]
+
+    def _page(self, collection, query, limit, after, fields):
+        """created_at の降順クエリを after の次から limit 件読む"""
+        if fields is not None:
+            query = query.select(fields)
+        if after:
+            # カーソルのドキュメントの created_at とIDから続きを読む（同じ日時でも重複・欠落しない）
+            cursor = self.db.collection(collection).document(after).get(field_paths=['created_at'])
+            metrics.count('firestore_reads', collection=collection)
+            if not cursor.exists:
+                return []
+            query = query.start_after(cursor)
+        if limit is not None:
+            query = query.limit(limit)
+        docs = [dict(doc.to_dict() or {}, id=doc.id) for doc in query.stream()]
+        count_query_reads(collection, len(docs))
+        return docs
+
+    def recent_articles(self, limit=20, after=None, fields=None):
+        from google.cloud import firestore
+
+        query = self._articles().order_by('created_at', direction=firestore.Query.DESCENDING)
+        return self._page(ARTICLES_COLLECTION, query, limit, after, fields)
+
+    def unused_articles(self, since=None, limit=None):
+        from google.cloud import firestore
+
+        unused = self._articles().where(filter=firestore.FieldFilter('used_in_summary', '==', False))
+        if since is None:
+            articles = [dict(doc.to_dict(), id=doc.id) for doc in unused.stream()]
+            count_query_reads(ARTICLES_COLLECTION, len(articles))
+            return articles
+
+        # 重要度ごとに (used_in_summary, importance_score, created_at) の複合インデックスで
+        # 新しい順に読み、上限に達したら打ち切る（読み取りは最大limit件）
+        articles = []
+        for score in IMPORTANCE_SCORES:
+            query = unused.where(
+                filter=firestore.FieldFilter('importance_score', '==', score)
+            ).where(
+                filter=firestore.FieldFilter('created_at', '>=', since)
+            ).order_by('created_at', direction=firestore.Query.DESCENDING)
+            if limit is not None:
+                if len(articles) >= limit:
+                    break
+                query = query.limit(limit - len(articles))
+            found = [dict(doc.to_dict(), id=doc.id) for doc in query.stream()]
+            count_query_reads(ARTICLES_COLLECTION, len(found))
+            articles.extend(found)
+        return articles
+
+    def iter_articles(self, fields=None):
+        query = self._articles()
+        if fields is not None:
+            query = query.select(fields)
+        for doc in query.stream():
+            metrics.count('firestore_reads', collection=ARTICLES_COLLECTION)
+            yield dict(doc.to_dict() or {}, id=doc.id)
+
+    def create_article(self, article_id, data):
+        from google.cloud import firestore
+        from google.api_core.exceptions import AlreadyExists
+
+        try:
+            metrics.count('firestore_writes', collection=ARTICLES_COLLECTION)
+            self._articles().document(article_id).create(dict(data, created_at=firestore.SERVER_TIMESTAMP))
+            return True
+        except AlreadyExists:
+            return False
+
+    def writer(self):
+        return FirestoreStoreWriter(self.db)
+
+    def create_thread(self, data):
+        thread_ref = self.db.collection(THREADS_COLLECTION).document()
+        thread_ref.set(dict(data, created_at=datetime.now(timezone.utc)))
+        metrics.count('firestore_writes', collection=THREADS_COLLECTION)
+        return thread_ref.id
+
+    def recent_threads(self, since, limit=None, after=None, fields=None):
+        from google.cloud import firestore
+
+        query = self.db.collection(THREADS_COLLECTION).where(
+            filter=firestore.FieldFilter('created_at', '>=', since)
+        ).order_by('created_at', direction=firestore.Query.DESCENDING)
+        return self._page(THREADS_COLLECTION, query, limit, after, fields)
+
+    def get_document(self, collection, doc_id):
+        doc = self.db.collection(collection).document(doc_id).get()
+        metrics.count('firestore_reads', collection=collection)
+        return doc.to_dict() if doc.exists else None
+
+    def get_documents(self, collection, doc_ids):
+        return {doc.id: doc.to_dict() for doc in self._get_all(collection, list(dict.fromkeys(doc_ids)))}
+
+    def set_document(self, collection, doc_id, data, merge=False):
+        self.db.collection(collection).document(doc_id).set(data, merge=merge)
+        metrics.count('firestore_writes', collection=collection)
+
+    def array_union(self, collection, doc_id, field, values):
+        from google.cloud import firestore
+
+        self.db.collection(collection).document(doc_id).set({field: firestore.ArrayUnion(list(values))}, merge=True)
+        metrics.count('firestore_writes', collection=collection)
+
+    def array_remove(self, collection, doc_id, field, values):
+        from google.cloud import firestore
+
+        self.db.collection(collection).document(doc_id).set({field: firestore.ArrayRemove(list(values))}, merge=True)
+        metrics.count('firestore_writes', collection=collection)
+
+
+def _encode(value):
+    """datetimeを含む値をJSONに保存できる形に変換"""
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if set(value) == {'$datetime'}:
+            return datetime.fromisoformat(value['$datetime'])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _timestamp(value):
+    return value.timestamp() if isinstance(value, datetime) else None
+
+
+class SQLiteStoreWriter(StoreWriter):
+    """書き込みを溜めて1トランザクションで確定する"""
+
+    def __init__(self, store):
+        self.store = store
+        self._ops = []
+        self.stats = {'writes': 0, 'commits': 0, 'retries': 0, 'failed': 0}
+
+    def create_article(self, article_id, data):
+        self._ops.append(('create_article', article_id, data))
+
+    def update_article(self, article_id, data):
+        self._ops.append(('update_article', article_id, data))
+
+    def set_document(self, collection, doc_id, data, merge=False):
+        self._ops.append(('set_document', collection, doc_id, data, merge))
+
+    def array_union(self, collection, doc_id, field, values):
+        self._ops.append(('array_union', collection, doc_id, field, list(values)))
+
+    def flush(self):
+        ops, self._ops = self._ops, []
+        if not ops:
+            return {}
+        failed = self.store._apply(ops)
+        self.stats['commits'] += 1
+        self.stats['writes'] += len(ops) - len(failed)
+        self.stats['failed'] += len(failed)
+        return failed
+
+
+class SQLiteArticleStore(ArticleStore):
+    """ローカルのSQLiteファイルに保存する（オフラインでの負荷試験・ローカル実行用）
+
+    記事の全フィールドはJSONで保存し、検索に使う列（hash, used_in_summary,
+    created_at, importance_score）には索引を張る。
+    """
+
+    def __init__(self, path=STORAGE_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS articles (
+                id TEXT PRIMARY KEY,
+                hash TEXT,
+                used_in_summary INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                importance_score INTEGER,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_articles_hash ON articles (hash);
+            CREATE INDEX IF NOT EXISTS idx_articles_unused ON articles (used_in_summary, created_at);
+            CREATE INDEX IF NOT EXISTS idx_articles_importance ON articles (importance_score);
+            CREATE INDEX IF NOT EXISTS idx_articles_created_at ON articles (created_at, id);
+            CREATE TABLE IF NOT EXISTS threads (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_threads_created_at ON threads (created_at, id);
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (collection, id)
+            );
+        ''')
+        self.conn.commit()
+
+    def _rows_to_dicts(self, rows):
+        return [dict(_decode(json.loads(data)), id=article_id) for article_id, data in rows]
+
+    def find_existing(self, article_ids):
+        article_ids = list(dict.fromkeys(article_ids))
+        existing = set()
+        with self._lock:
+            for start in range(0, len(article_ids), 500):
+                chunk = article_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id FROM articles WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                existing.update(row[0] for row in rows)
+        return existing
+
+    def get_articles(self, article_ids, fields=None):
+        article_ids = list(dict.fromkeys(article_ids))
+        found = {}
+        with self._lock:
+            for start in range(0, len(article_ids), 500):
+                chunk = article_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, data FROM articles WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+        rows = ((article_id, found[article_id]) for article_id in article_ids if article_id in found)
+        return [project(article, fields) for article in self._rows_to_dicts(rows)]
+
+    def _page(self, table, where, params, limit, after, fields):
+        """created_at・IDの降順で after の次から limit 件読む"""
+        with self._lock:
+            if after:
+                cursor = self.conn.execute(f'SELECT created_at FROM {table} WHERE id = ?', (after,)).fetchone()
+                if cursor is None:
+                    return []
+                where += ' AND (created_at < ? OR (created_at = ? AND id < ?))'
+                params += (cursor[0], cursor[0], after)
+            rows = self.conn.execute(
+                f'SELECT id, data FROM {table} WHERE {where} ORDER BY created_at DESC, id DESC LIMIT ?',
+                params + (-1 if limit is None else limit,)
+            ).fetchall()
+        return [project(doc, fields) for doc in self._rows_to_dicts(rows)]
+
+    def recent_articles(self, limit=20, after=None, fields=None):
+        return self._page('articles', '1', (), limit, after, fields)
+
+    def unused_articles(self, since=None, limit=None):
+        with self._lock:
+            if since is None:
+                rows = self.conn.execute('SELECT id, data FROM articles WHERE used_in_summary = 0').fetchall()
+            else:
+                rows = self.conn.execute(
+                    'SELECT id, data FROM articles WHERE used_in_summary = 0 AND created_at >= ? '
+                    'ORDER BY importance_score DESC, created_at DESC LIMIT ?',
+                    (since.timestamp(), -1 if limit is None else limit)
+                ).fetchall()
+        return self._rows_to_dicts(rows)
+
+    def iter_articles(self, fields=None):
+        with self._lock:
+            rows = self.conn.execute('SELECT id, data FROM articles ORDER BY rowid').fetchall()
+        for article in self._rows_to_dicts(rows):
+            yield project(article, fields)
+
+    def writer(self):
+        return SQLiteStoreWriter(self)
+
+    def create_thread(self, data):
+        thread_id = uuid.uuid4().hex
+        created_at = datetime.now(timezone.utc)
+        with self._lock:
+            self.conn.execute(
+                'INSERT INTO threads (id, created_at, data) VALUES (?, ?, ?)',
+                (thread_id, created_at.timestamp(),
+                 json.dumps(_encode(dict(data, created_at=created_at)), ensure_ascii=False))
+            )
+            self.conn.commit()
+        return thread_id
+
+    def recent_threads(self, since, limit=None, after=None, fields=None):
+        return self._page('threads', 'created_at >= ?', (since.timestamp(),), limit, after, fields)
+
+    def get_document(self, collection, doc_id):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT data FROM documents WHERE collection = ? AND id = ?', (collection, doc_id)
+            ).fetchone()
+        return _decode(json.loads(row[0])) if row else None
+
+    def get_documents(self, collection, doc_ids):
+        doc_ids = list(dict.fromkeys(doc_ids))
+        found = {}
+        with self._lock:
+            for start in range(0, len(doc_ids), 500):
+                chunk = doc_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT id, data FROM documents WHERE collection = ? AND id IN ({','.join('?' * len(chunk))})",
+                    [collection] + chunk
+                ).fetchall()
+                found.update((doc_id, _decode(json.loads(data))) for doc_id, data in rows)
+        return found
+
+    def set_document(self, collection, doc_id, data, merge=False):
+        self._apply([('set_document', collection, doc_id, data, merge)])
+
+    def array_union(self, collection, doc_id, field, values):
+        self._apply([('array_union', collection, doc_id, field, list(values))])
+
+    def array_remove(self, collection, doc_id, field, values):
+        self._apply([('array_remove', collection, doc_id, field, list(values))])
+
+    def _write_article(self, article_id, data):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO articles (id, hash, used_in_summary, created_at, importance_score, data) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (article_id, data.get('hash'), int(bool(data.get('used_in_summary'))),
+             _timestamp(article_time(data)), data.get('importance_score'),
+             json.dumps(_encode(data), ensure_ascii=False))
+        )
+
+    def _write_document(self, collection, doc_id, data):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)',
+            (collection, doc_id, json.dumps(_encode(data), ensure_ascii=False))
+        )
+
+    def _apply_one(self, op):
+        kind = op[0]
+        if kind == 'create_article':
+            _, article_id, data = op
+            if self.find_existing([article_id]):
+                raise sqlite3.IntegrityError(f"記事は保存済みです: {article_id}")
+            self._write_article(article_id, dict(data, created_at=datetime.now(timezone.utc)))
+        elif kind == 'update_article':
+            _, article_id, data = op
+            articles = self.get_articles([article_id])
+            if not articles:
+                raise KeyError(f"記事が見つかりません: {article_id}")
+            article = articles[0]
+            del article['id']
+            article.update(data)
+            self._write_article(article_id, article)
+        elif kind == 'set_document':
+            _, collection, doc_id, data, merge = op
+            if merge:
+                data = dict(self.get_document(collection, doc_id) or {}, **data)
+            self._write_document(collection, doc_id, data)
+        else:
+            kind, collection, doc_id, field, values = op
+            document = self.get_document(collection, doc_id) or {}
+            items = document.get(field, [])
+            if kind == 'array_remove':
+                document[field] = [item for item in items if item not in values]
+            else:
+                document[field] = items + [value for value in values if value not in items]
+            self._write_document(collection, doc_id, document)
+
+    def _apply(self, ops):
+        """opsを1トランザクションで適用し、失敗したものの {パス: 例外} を返す"""
+        failed = {}
+        with self._lock:
+            for op in ops:
+                try:
+                    self._apply_one(op)
+                except Exception as e:
+                    path = article_path(op[1]) if op[0].endswith('_article') else f"{op[1]}/{op[2]}"
+                    failed[path] = e
+                    if not isinstance(e, sqlite3.IntegrityError):
+                        logger.error(f"SQLite書き込みエラー ({op[0]} {path}): {e}")
+            self.conn.commit()
+        return failed
+
+
+def create_article_store(backend=None, db=None):
+    """設定に応じた保存先を生成"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'sqlite':
+        return SQLiteArticleStore()
+    return FirestoreArticleStore(db)